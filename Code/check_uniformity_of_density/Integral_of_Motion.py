@@ -12,6 +12,7 @@ FUNCTIONS:
     L_z: This functiont takes the position and velocity of a star and returns its angular momentum (per mass)
          in the z-direction
     cartesian_to_cylindrical: Convert position and velocity
+    integrals_and_gradients: Energy, L_z and both gradients in a single pass
 
 HISTORY:
     2018-05-25 - Written - Samuel Wong
@@ -24,6 +25,7 @@ from galpy.potential import evaluatePotentials
 from galpy.potential import evaluatephiforces
 from galpy.potential import evaluateRforces
 from galpy.potential import evaluatezforces
+from galpy.potential.Potential import _isNonAxi
 import numpy as np
 from tools.tools import rect_to_cyl, cyl_to_rect
 
@@ -99,7 +101,32 @@ def cylindrical_to_cartesian(R, phi, z, vR, vT, vz):
     return x, y, z, vx, vy, vz
 
 
-def Energy(coord, custom_potential = None):
+def get_potential(custom_potential = None, interpolate = False):
+    """
+    NAME:
+        get_potential
+
+    PURPOSE:
+        Return the potential in which integrals of motion are evaluated.
+
+    INPUT:
+        custom_potential = galpy potential or list of potentials; None for
+                           MWPotential2014
+        interpolate = if True, return its InterpolatedPotential, tabulated
+                      once and cached on disk
+
+    OUTPUT:
+        galpy potential or list of potentials
+    """
+    if custom_potential == None:
+        custom_potential = MWPotential2014
+    if interpolate:
+        from Interpolated_Potential import interpolated_potential
+        custom_potential = interpolated_potential(custom_potential)
+    return custom_potential
+
+
+def Energy(coord, custom_potential = None, interpolate = False):
     """
     NAME:
         Energy
@@ -110,16 +137,15 @@ def Energy(coord, custom_potential = None):
         
     INPUT:
         coord= a numpy array of coordinate
+        custom_potential = galpy potential; None for MWPotential2014
+        interpolate = if True, use the interpolated potential
     OUTPUT:
         energy = a list of total energy per mass
     HISTORY:
         2018-05-25 - Written - Samuel Wong
         2018-07-24 - Changed to an array of points - Samuel Wong
     """
-    if custom_potential == None:
-        potential_obj = MWPotential2014
-    else:
-        potential_obj = custom_potential
+    potential_obj = get_potential(custom_potential, interpolate)
     
     x, y, z, vx, vy, vz = coord.T
     R = np.sqrt(x**2 + y**2)
@@ -150,13 +176,11 @@ def L_z(coord):
         2018-07-24 - Changed to an array of points - Samuel Wong
     """
     x, y, z, vx, vy, vz = coord.T
-    # convert to cylindrical coordinate
-    R, vR, vT, z, vz, phi = rect_to_cyl(x, y, z, vx, vy, vz).T
-    # evaluate the angular momentum
-    return R*vT
+    # R*vT, without converting to cylindrical coordinates
+    return x*vy - y*vx
 
 
-def del_E(coord, custom_potential = None):
+def del_E(coord, custom_potential = None, interpolate = False):
     """
     NAME:
         del_E
@@ -170,6 +194,8 @@ def del_E(coord, custom_potential = None):
     INPUT:
         coord = array([[x, y, z, vx, vy, vz], ...])
                 where each row represents the coordinate of a star
+        custom_potential = galpy potential; None for MWPotential2014
+        interpolate = if True, use the interpolated potential
 
     OUTPUT:
         del_E = gradient in Cartesian coordinate
@@ -179,10 +205,7 @@ def del_E(coord, custom_potential = None):
         2018-07-10 - Written - Samuel Wong
         2018-07-24 - Changed to an array of points - Samuel Wong
     """
-    if custom_potential == None:
-        potential = MWPotential2014
-    else:
-        potential = custom_potential
+    potential = get_potential(custom_potential, interpolate)
     x, y, z, vx, vy, vz = coord.T
     R, vR, vT, z, vz, phi = rect_to_cyl(x, y, z, vx, vy, vz).T
     # get the force of the potential in cylindrical form
@@ -221,4 +244,76 @@ def del_Lz(coord):
     # return the gradient in Cartesian coordinate
     gradient = [vy, -vx, np.zeros(m), -y, x, np.zeros(m)]
     return np.array(gradient).T
-    
\ No newline at end of file
+    
+
+
+def integrals_and_gradients(coord, custom_potential = None,
+                            interpolate = False, out = None):
+    """
+    NAME:
+        integrals_and_gradients
+
+    PURPOSE:
+        Given (m,6) array for a list of the position and velocity of stars in
+        Cartesian coordinate, return their energy, L_z and the gradients of
+        both in a single pass: R and the direction cosines are computed once
+        and shared, phi is only computed for a non-axisymmetric potential, and
+        the results are written into preallocated (or given) arrays.
+        Assumes input and output are in natural unit.
+
+    INPUT:
+        coord = array([[x, y, z, vx, vy, vz], ...])
+        custom_potential = galpy potential; None for MWPotential2014
+        interpolate = if True, use the interpolated potential
+        out = None, or a tuple (energy, L_z, del_E, del_Lz) of arrays of
+              shapes (m,), (m,), (m,6) and (m,6) in which to write the results;
+              any of them can be None to allocate it
+
+    OUTPUT:
+        (energy, L_z, del_E, del_Lz), the same as Energy, L_z, del_E and
+        del_Lz
+    """
+    potential = get_potential(custom_potential, interpolate)
+    coord = np.asarray(coord, dtype = float)
+    m = len(coord)
+    if out is None:
+        out = (None, None, None, None)
+    energy, angular_momentum, Energy_gradient, Lz_gradient = [
+            np.empty(shape) if array is None else array
+            for array, shape in zip(out, [(m,), (m,), (m, 6), (m, 6)])]
+    x, y, z, vx, vy, vz = coord.T
+
+    R = np.hypot(x, y)
+    cos_phi = x/R
+    sin_phi = y/R
+    if _isNonAxi(potential):
+        phi = np.arctan2(y, x)
+        F_phi = evaluatephiforces(potential, R, z, phi)/R
+    else:
+        phi = 0.
+        F_phi = 0.
+    F_R = evaluateRforces(potential, R, z, phi)
+    F_z = evaluatezforces(potential, R, z, phi)
+
+    # energy
+    np.multiply(vx, vx, out = energy)
+    energy += vy*vy
+    energy += vz*vz
+    energy *= 0.5
+    energy += evaluatePotentials(potential, R, z, phi)
+    # L_z
+    np.multiply(x, vy, out = angular_momentum)
+    angular_momentum -= y*vx
+    # gradient of the energy
+    Energy_gradient[:, 0] = F_phi*sin_phi - F_R*cos_phi
+    Energy_gradient[:, 1] = -F_R*sin_phi - F_phi*cos_phi
+    Energy_gradient[:, 2] = -F_z
+    Energy_gradient[:, 3:] = coord[:, 3:]
+    # gradient of L_z
+    Lz_gradient[:, 0] = vy
+    Lz_gradient[:, 1] = -vx
+    Lz_gradient[:, 2] = 0.
+    Lz_gradient[:, 3] = -y
+    Lz_gradient[:, 4] = x
+    Lz_gradient[:, 5] = 0.
+    return energy, angular_momentum, Energy_gradient, Lz_gradient
@@ -0,0 +1,209 @@
+"""
+NAME:
+    Interpolated_Potential
+
+PURPOSE:
+    This module replaces an axisymmetric galpy potential by bicubic splines
+    of its value and of its radial and vertical forces, tabulated once on a
+    grid of (log R, asinh(|z|/z_scale)). The grid is fine near the plane,
+    where the disk makes the vertical force change quickly, and coarse far
+    from it. The tables are cached on disk per potential and grid, so that a
+    slow potential, such as an SCF expansion, is only evaluated on the grid
+    once; every later evaluation of the potential or its forces is a spline
+    lookup. Points outside the grid are evaluated with the original
+    potential. The potential is assumed to be symmetric about the plane.
+
+FUNCTIONS:
+    interpolated_potential: return the InterpolatedPotential of a potential,
+                            built once and cached on disk
+"""
+import os
+import hashlib
+import warnings
+import dill
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
+from galpy.potential import Potential, MWPotential2014, evaluatePotentials, \
+    evaluateRforces, evaluatezforces
+
+# exact evaluation of each tabulated quantity
+_EXACT = {'potential': evaluatePotentials,
+          'Rforce': evaluateRforces,
+          'zforce': evaluatezforces}
+
+# interpolated potentials built by this process, keyed by their cache key
+_interpolated = {}
+
+
+class InterpolatedPotential(Potential):
+    """
+    Class interpolating the potential and forces of an axisymmetric galpy
+    potential on an (R, z) grid
+    """
+    def __init__(self, potential, R_range = (0.01, 20.), z_max = 20.,
+                 z_scale = 0.01, n_R = 201, n_z = 201, tables = None):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            tabulate a potential and fit the splines
+
+        INPUT:
+            potential = galpy potential or list of potentials, in natural
+                        units
+            R_range = (smallest, largest) R of the grid
+            z_max = largest |z| of the grid
+            z_scale = |z| below which the grid is about uniform in z; above,
+                      it is about uniform in log |z|
+            n_R, n_z = number of grid points in R and z
+            tables = dictionary of the (n_R, n_z) arrays of the potential,
+                     Rforce and zforce on the grid, as saved from a previous
+                     InterpolatedPotential; None to compute them
+
+        OUTPUT:
+            None
+        """
+        Potential.__init__(self, amp = 1.)
+        self.isNonAxi = False
+        self.hasC = False
+        self._potential = potential
+        self.R_range = R_range
+        self.z_max = z_max
+        self.z_scale = z_scale
+        self._x = np.linspace(np.log(R_range[0]), np.log(R_range[1]), n_R)
+        self._y = np.linspace(0., np.arcsinh(z_max/z_scale), n_z)
+
+        if tables is None:
+            R, z = np.meshgrid(np.exp(self._x),
+                               z_scale*np.sinh(self._y), indexing = 'ij')
+            tables = {name: np.reshape(evaluate(potential, R.ravel(),
+                                                z.ravel()), R.shape)
+                      for name, evaluate in _EXACT.items()}
+        self.tables = tables
+        self._splines = {name: RectBivariateSpline(self._x, self._y, table)
+                         for name, table in tables.items()}
+
+    def _interpolate(self, name, R, z):
+        # spline of a tabulated quantity inside the grid, exact outside
+        R, z = np.broadcast_arrays(np.asarray(R, dtype = float),
+                                   np.asarray(z, dtype = float))
+        with np.errstate(divide = 'ignore'):
+            x = np.log(R)
+        y = np.arcsinh(np.abs(z)/self.z_scale)
+        inside = (x >= self._x[0]) & (x <= self._x[-1]) & (y <= self._y[-1])
+        value = np.empty(R.shape)
+        value[inside] = self._splines[name].ev(x[inside], y[inside])
+        if not np.all(inside):
+            value[~inside] = _EXACT[name](self._potential, R[~inside],
+                                          np.abs(z[~inside]))
+        if name == 'zforce':
+            # the vertical force is odd in z
+            value *= np.sign(z)
+        return value[()]
+
+    def _evaluate(self, R, z, phi = 0., t = 0.):
+        return self._interpolate('potential', R, z)
+
+    def _Rforce(self, R, z, phi = 0., t = 0.):
+        return self._interpolate('Rforce', R, z)
+
+    def _zforce(self, R, z, phi = 0., t = 0.):
+        return self._interpolate('zforce', R, z)
+
+    def _phiforce(self, R, z, phi = 0., t = 0.):
+        return np.zeros(np.broadcast(R, z).shape)[()]
+
+    _phitorque = _phiforce
+
+    def relative_error(self, n = 10000, random_state = 0):
+        """
+        NAME:
+            relative_error
+
+        PURPOSE:
+            estimate the accuracy of the interpolation by comparing it with
+            the original potential at random points of the grid
+
+        INPUT:
+            n = number of points
+            random_state = seed of the points
+
+        OUTPUT:
+            (maximum relative error of the potential, maximum error of the
+             force relative to the magnitude of the force)
+        """
+        rng = np.random.default_rng(random_state)
+        R = np.exp(rng.uniform(self._x[0], self._x[-1], n))
+        z = self.z_scale*np.sinh(rng.uniform(0., self._y[-1], n))
+        exact = {name: evaluate(self._potential, R, z)
+                 for name, evaluate in _EXACT.items()}
+        approximate = {name: self._interpolate(name, R, z)
+                       for name in _EXACT}
+        potential_error = np.max(np.abs(approximate['potential']/
+                                        exact['potential'] - 1.))
+        force_error = np.max(np.hypot(approximate['Rforce'] - exact['Rforce'],
+                                      approximate['zforce'] - exact['zforce'])/
+                             np.hypot(exact['Rforce'], exact['zforce']))
+        return potential_error, force_error
+
+
+def interpolated_potential(potential = None, R_range = (0.01, 20.),
+                           z_max = 20., z_scale = 0.01, n_R = 201, n_z = 201,
+                           tolerance = None,
+                           cache_dir = 'main_program_results/potential_cache'):
+    """
+    NAME:
+        interpolated_potential
+
+    PURPOSE:
+        Return the InterpolatedPotential of a potential. It is built only once
+        per process and, with a cache folder, only once on a machine: its
+        tables are saved under a key made of the content of the potential and
+        the grid.
+
+    INPUT:
+        potential = galpy potential or list of potentials; None for
+                    MWPotential2014
+        R_range, z_max, z_scale, n_R, n_z = grid, see InterpolatedPotential
+        tolerance = if given, the number of grid points in each direction is
+                    doubled (up to 3 times) until the relative errors of the
+                    potential and force estimated by relative_error are below
+                    it
+        cache_dir = folder in which the tables are saved; None not to save
+                    them
+
+    OUTPUT:
+        InterpolatedPotential
+    """
+    if potential is None:
+        potential = MWPotential2014
+    if isinstance(potential, InterpolatedPotential):
+        return potential
+
+    for _ in range(4):
+        key = hashlib.sha1(dill.dumps(potential) + repr(
+                (R_range, z_max, z_scale, n_R, n_z)).encode()).hexdigest()
+        if key not in _interpolated:
+            file_name = None
+            if cache_dir is not None:
+                file_name = os.path.join(cache_dir, key + '.npz')
+            tables = None
+            if file_name is not None and os.path.exists(file_name):
+                with np.load(file_name) as data:
+                    tables = {name: data[name] for name in _EXACT}
+            interpolated = InterpolatedPotential(potential, R_range, z_max,
+                                                 z_scale, n_R, n_z, tables)
+            if tables is None and file_name is not None:
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                np.savez(file_name, **interpolated.tables)
+            _interpolated[key] = interpolated
+        interpolated = _interpolated[key]
+        if tolerance is None or \
+           max(interpolated.relative_error()) < tolerance:
+            return interpolated
+        n_R, n_z = 2*n_R - 1, 2*n_z - 1
+    warnings.warn('the interpolated potential did not reach the tolerance '
+                  '{}'.format(tolerance))
+    return interpolated
@@ -0,0 +1,285 @@
+"""
+NAME:
+    Streaming_Evaluation
+
+PURPOSE:
+    This module evaluates uniformity, or a density, at any number of points,
+    such as every star of a catalogue or every node of a 6D grid, by
+    streaming them in chunks. Only the gradients, orthonormal bases and
+    projections of one chunk are held in memory at a time; the size of the
+    chunks follows from a memory budget. The points can be an array, a
+    memory map or a lazy tools.MeshGrid. The results are written into a
+    preallocated array or a memory-mapped .npy file, and the chunks can be
+    spread over a pool of processes.
+
+HOW TO USE:
+    result = evaluate_uniformity_streaming(density, samples, "projection",
+                                           memory_budget = 2**28,
+                                           out = 'uniformity.npy',
+                                           n_workers = 4)
+
+    axis = np.linspace(-1., 1., 11)
+    grid = MeshGrid(axis, axis, axis, axis, axis + 1., axis,
+                    mask = not_at_origin)
+    values = evaluate_density_streaming(density, grid)
+"""
+import os
+import sys
+import collections
+import multiprocessing
+import dill
+import numpy as np
+from Integral_of_Motion import Energy, L_z, integrals_and_gradients
+from Uniformity_Evaluation import grad_multi, uniformity_from_gradient, \
+    uniformity_projection_from_integrals
+
+# approximate memory used per point by the evaluation of a chunk, in bytes:
+# the shifted points and gradients of grad_multi, the gradients of the
+# integrals with the intermediate arrays of integrals_and_gradients, and the
+# bases and projections of the uniformity method
+BYTES_PER_POINT = {'projection': 1024, 'dot product': 2048}
+
+# approximate memory used per point by the evaluation of a density
+DENSITY_BYTES_PER_POINT = 256
+
+# state of a worker process, set once by _initialize_worker
+_worker = {}
+
+
+def chunk_size_for(memory_budget, uniformity_method, extra_integrals = 0):
+    """
+    NAME:
+        chunk_size_for
+
+    PURPOSE:
+        return the number of points per chunk whose evaluation fits in a
+        memory budget
+
+    INPUT:
+        memory_budget = bytes available to the evaluation of one chunk
+        uniformity_method = "projection" or "dot product"
+        extra_integrals = number of further integrals of motion
+
+    OUTPUT:
+        number of points, at least 1
+    """
+    per_point = BYTES_PER_POINT[uniformity_method] + 256*extra_integrals
+    return max(1, int(memory_budget//per_point))
+
+
+def evaluate_chunk(f, chunk, uniformity_method, custom_potential = None,
+                   gradient_method = "analytic", extra_integrals = None):
+    """
+    NAME:
+        evaluate_chunk
+
+    PURPOSE:
+        evaluate uniformity of f at the points of one chunk, along the
+        gradients of E and L_z and of any extra integrals
+
+    INPUT:
+        f = density function of (m,6) arrays in natural units
+        chunk = (m,6) array of points in natural units
+        uniformity_method, custom_potential, gradient_method,
+            extra_integrals = see evaluate_uniformity_streaming
+
+    OUTPUT:
+        array of shape (m,) for the projection or (m,4) for the dot product
+    """
+    if gradient_method == "analytic":
+        _, _, Energy_gradient, Lz_gradient = integrals_and_gradients(
+                chunk, custom_potential)
+    elif gradient_method == "numeric":
+        Energy_gradient = grad_multi(
+                lambda coord: Energy(coord, custom_potential), chunk)
+        Lz_gradient = grad_multi(L_z, chunk)
+    else:
+        raise ValueError('gradient method must be "analytic" or "numeric"')
+    gradient = grad_multi(f, chunk)
+    if extra_integrals:
+        integral_gradients = np.stack(
+                [Energy_gradient, Lz_gradient] +
+                [integral.gradient(chunk) for integral in extra_integrals],
+                axis = 1)
+        return uniformity_projection_from_integrals(gradient,
+                                                    integral_gradients)
+    return uniformity_from_gradient(gradient, Energy_gradient, Lz_gradient,
+                                    uniformity_method)
+
+
+def _initialize_worker(settings):
+    # the density is often a closure, such as a KDE, which only dill can
+    # transfer
+    _worker['settings'] = dill.loads(settings)
+
+
+def _evaluate_task(task):
+    start, chunk = task
+    settings = _worker['settings']
+    return start, settings['evaluate'](settings['f'], chunk,
+                                       **settings['options'])
+
+
+def _evaluate_density(f, chunk):
+    return np.asarray(f(chunk), dtype = float)
+
+
+def _chunks(points, chunk_size):
+    # (start, chunk) of consecutive chunks; points only need a length and
+    # slicing, so they can be a memory map or a lazily generated grid
+    for start in range(0, len(points), chunk_size):
+        yield start, np.asarray(points[start:start + chunk_size],
+                                dtype = float)
+
+
+def evaluate_uniformity_streaming(f, points, uniformity_method,
+                                  custom_potential = None,
+                                  gradient_method = "analytic",
+                                  extra_integrals = None,
+                                  memory_budget = 2**28, chunk_size = None,
+                                  out = None, n_workers = 1,
+                                  verbose = False):
+    """
+    NAME:
+        evaluate_uniformity_streaming
+
+    PURPOSE:
+        Evaluate uniformity of a density at many points, one chunk of points
+        at a time, so that memory does not grow with the number of points.
+        The result at every point is the same as that of evaluate_uniformity
+        (or evaluate_uniformity_integrals) at all points at once.
+
+    INPUT:
+        f = density function of (m,6) arrays in natural units; its gradient
+            attribute, if any, is used instead of finite differences
+        points = (n,6) array of points in natural units, or any object with a
+                 length whose slices are such arrays (e.g. a memory map or
+                 a tools.MeshGrid)
+        uniformity_method = "projection" or "dot product"
+        custom_potential = galpy potential; None for MWPotential2014
+        gradient_method = "analytic" or "numeric", referring to how the
+                          gradients of E and L_z are computed
+        extra_integrals = list of further integrals of motion with a gradient
+                          method, as for main; needs the projection method
+        memory_budget = bytes available to the evaluation of one chunk (per
+                        process); sets the chunk size
+        chunk_size = number of points per chunk; overrides memory_budget
+        out = None to allocate the results, an array of the shape of the
+              results to write them into, or the path of a .npy file to
+              memory-map them into
+        n_workers = number of processes evaluating chunks; 1 to evaluate
+                    them in this process, None for the number of CPUs
+        verbose = if True, print the progress
+
+    OUTPUT:
+        array (or memory map) of shape (n,) for the projection or (n,4) for
+        the dot product
+    """
+    if extra_integrals and uniformity_method != "projection":
+        raise ValueError('extra integrals need the projection method')
+    if uniformity_method not in BYTES_PER_POINT:
+        raise ValueError('uniformity method must be "projection" or '
+                         '"dot product"')
+    n = len(points)
+    if chunk_size is None:
+        chunk_size = chunk_size_for(memory_budget, uniformity_method,
+                                    len(extra_integrals or []))
+    shape = (n,) if uniformity_method == "projection" else (n, 4)
+    out = _allocate(out, shape)
+
+    options = {'uniformity_method': uniformity_method,
+               'custom_potential': custom_potential,
+               'gradient_method': gradient_method,
+               'extra_integrals': extra_integrals}
+    return _stream(evaluate_chunk, f, points, options, chunk_size, out,
+                   n_workers, verbose)
+
+
+def evaluate_density_streaming(f, points, memory_budget = 2**28,
+                               chunk_size = None, out = None, n_workers = 1,
+                               verbose = False):
+    """
+    NAME:
+        evaluate_density_streaming
+
+    PURPOSE:
+        Evaluate a density at many points, one chunk of points at a time, so
+        that neither the points (e.g. of a MeshGrid) nor more than one chunk
+        of values need to be held in memory
+
+    INPUT:
+        f = density function of (m,6) arrays in natural units
+        points, memory_budget, chunk_size, n_workers, verbose = see
+            evaluate_uniformity_streaming
+        out = None to allocate the results, an array of shape (n,) to write
+              them into, or the path of a .npy file to memory-map them into
+
+    OUTPUT:
+        array (or memory map) of shape (n,)
+    """
+    n = len(points)
+    if chunk_size is None:
+        chunk_size = max(1, int(memory_budget//DENSITY_BYTES_PER_POINT))
+    out = _allocate(out, (n,))
+    return _stream(_evaluate_density, f, points, {}, chunk_size, out,
+                   n_workers, verbose)
+
+
+def _allocate(out, shape):
+    # the array the results are written into
+    if out is None:
+        return np.empty(shape)
+    if isinstance(out, str):
+        return np.lib.format.open_memmap(out, mode = 'w+', dtype = float,
+                                         shape = shape)
+    if np.shape(out) != shape:
+        raise ValueError('out must have shape {}'.format(shape))
+    return out
+
+
+def _stream(evaluate, f, points, options, chunk_size, out, n_workers,
+            verbose):
+    # evaluate(f, chunk, **options) of every chunk of points, into out
+    n = len(points)
+    if n_workers == 1:
+        results = (
+            (start, evaluate(f, chunk, **options))
+            for start, chunk in _chunks(points, chunk_size))
+        _collect(results, out, n, verbose)
+    else:
+        context = multiprocessing.get_context('spawn')
+        settings = dill.dumps({'evaluate': evaluate, 'f': f,
+                               'options': options})
+        with context.Pool(n_workers, _initialize_worker,
+                          (settings,)) as pool:
+            _collect(_pool_results(pool, _chunks(points, chunk_size),
+                                   2*(n_workers or os.cpu_count())),
+                     out, n, verbose)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def _pool_results(pool, tasks, window):
+    # results of the tasks evaluated by the pool, with at most window chunks
+    # submitted and not collected, so that the chunks are not all read
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(_evaluate_task, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _collect(results, out, n, verbose):
+    # write the results of the chunks into out
+    done = 0
+    for start, result in results:
+        out[start:start + len(result)] = result
+        done += len(result)
+        if verbose:
+            sys.stdout.write('\rEvaluated {} of {} points'
+                             .format(done, n))
+    if verbose:
+        sys.stdout.write('\n')
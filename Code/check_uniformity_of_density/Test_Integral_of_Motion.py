@@ -78,6 +78,36 @@ def test_analytic_momentum_gradient():
     print('numeric del L_z 2 = ', numeric_del_Lz(point2))
     print('analytic del L_z =', del_Lz(points))
     
+def test_interpolated_potential():
+    # compare the energy and its gradient in the interpolated potential with
+    # those in the exact one, at random points near the Sun
+    points = np.random.normal(size = (1000, 6))*0.1 + \
+        np.array([1., 0., 0., 0., 1., 0.])
+    exact_E = Energy(points)
+    interpolated_E = Energy(points, interpolate = True)
+    exact_del_E = del_E(points)
+    interpolated_del_E = del_E(points, interpolate = True)
+    print('max relative error of energy = ',
+          np.max(np.abs(interpolated_E/exact_E - 1)))
+    print('max relative error of del E = ',
+          np.max(np.abs(interpolated_del_E - exact_del_E)) /
+          np.max(np.abs(exact_del_E)))
+    
+def test_integrals_and_gradients():
+    # the single pass kernel against the separate functions
+    points = np.random.normal(size = (1000, 6))*0.1 + \
+        np.array([1., 0., 0., 0., 1., 0.])
+    energy, angular_momentum, Energy_gradient, Lz_gradient = \
+        integrals_and_gradients(points)
+    print('max difference in energy = ',
+          np.max(np.abs(energy - Energy(points))))
+    print('max difference in L_z = ',
+          np.max(np.abs(angular_momentum - L_z(points))))
+    print('max difference in del E = ',
+          np.max(np.abs(Energy_gradient - del_E(points))))
+    print('max difference in del L_z = ',
+          np.max(np.abs(Lz_gradient - del_Lz(points))))
+    
 #test_cartesian_to_cylindrical(x, y, z, vx, vy, vz)
 #print()
 #test_cylindrical_to_cartesian(1,2,3,4,5,6)
@@ -88,3 +118,5 @@ def test_analytic_momentum_gradient():
 #print()
 test_analytic_energy_gradient()
 test_analytic_momentum_gradient()
+test_interpolated_potential()
+test_integrals_and_gradients()
@@ -103,6 +103,42 @@ def test_uniformity_evaluation_projection():
     print(evaluate_uniformity_projection(points, g, v1, v2))
     print("exact answer =", [0,0])
 
+def test_uniformity_projection_from_integrals():
+    # with E and L_z, the same as the Gram-Schmidt projection
+    points = np.random.normal(size = (100, 6))*0.1 + \
+        np.array([1., 0., 0., 0., 1., 0.])
+    gradient = np.random.normal(size = (100, 6))
+    v1 = grad_multi(Energy, points)
+    v2 = grad_multi(L_z, points)
+    print('max difference from two vectors =', np.max(np.abs(
+            uniformity_projection_from_integrals(
+                    gradient, np.stack([v1, v2], axis = 1)) -
+            uniformity_projection_from_gradient(gradient, v1, v2))))
+    # a function of E, L_z and v_z is uniform along the three integrals
+    # E, L_z and v_z^2/2 of a separable potential
+    v3 = np.zeros((100, 6))
+    v3[:, 5] = points[:, 5]
+    h = lambda x: np.exp(-Energy(x)) * L_z(x)**2 + x[..., 5]**2
+    print(evaluate_uniformity_integrals(
+            h, points, np.stack([v1, v2, v3], axis = 1))[:5])
+    print("exact answer = [0, 0, 0, 0, 0]")
+
+def test_evaluate_uniformity_streaming():
+    from Streaming_Evaluation import evaluate_uniformity_streaming
+    from Integral_of_Motion import del_E, del_Lz
+    points = np.random.normal(size = (1000, 6))*0.1 + \
+        np.array([1., 0., 0., 0., 1., 0.])
+    h = lambda x: np.exp(-x[:, 0]**2 - x[:, 4]**2 + x[:, 5])
+    for method in ["projection", "dot product"]:
+        whole = evaluate_uniformity(h, points, del_E(points), del_Lz(points),
+                                    method)
+        # uneven chunks, written into a given array
+        out = np.empty(np.shape(whole))
+        streamed = evaluate_uniformity_streaming(h, points, method,
+                                                 chunk_size = 77, out = out)
+        print(method, 'max difference from all points at once =',
+              np.max(np.abs(streamed - whole)), streamed is out)
+
 #test_orthonormality(W)
 #print()
 #test_evaluate_uniformity_and_orthogonal_complement(f, point, W)
@@ -118,4 +154,8 @@ def test_uniformity_evaluation_projection():
 #print()
 test_grad_multi()
 #print()
-#test_uniformity_evaluation_projection()
\ No newline at end of file
+#test_uniformity_evaluation_projection()
+#print()
+test_uniformity_projection_from_integrals()
+print()
+test_evaluate_uniformity_streaming()
@@ -0,0 +1,165 @@
+"""
+NAME:
+    Third_Integral
+
+PURPOSE:
+    This module provides the vertical action J_z, as a candidate third
+    integral of motion, and its gradient in Cartesian phase space, for (m,6)
+    arrays of points in natural units. The actions are computed with galpy's
+    C implementation of the Staeckel approximation (or of the adiabatic
+    approximation) in a single call for all points and for all the shifted
+    points of the central finite differences of the gradient. The focal
+    length of the Staeckel approximation is fixed for a provider, so that J_z
+    is one smooth function of phase space. Results for a set of points are
+    cached on disk, keyed by the points, the potential and the settings.
+
+HOW TO USE:
+    third_integral = ThirdIntegral(custom_potential)
+    gradient = third_integral.gradient(cluster)
+
+    or, to test uniformity along E, L_z and J_z,
+
+    main(..., extra_integrals = [ThirdIntegral(custom_potential)])
+"""
+import os
+import hashlib
+import dill
+import numpy as np
+from galpy.actionAngle import actionAngleStaeckel, actionAngleAdiabatic, \
+    estimateDeltaStaeckel
+from tools.tools import rect_to_cyl, array_hash
+from Integral_of_Motion import get_potential
+
+
+class ThirdIntegral:
+    """
+    Class evaluating the vertical action and its gradient in batches
+    """
+    def __init__(self, custom_potential = None, method = 'staeckel',
+                 delta = None, dx = 1e-5,
+                 cache_dir = 'main_program_results/third_integral_cache'):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a ThirdIntegral
+
+        INPUT:
+            custom_potential = galpy potential; None for MWPotential2014
+            method = 'staeckel' or 'adiabatic'
+            delta = focal length of the Staeckel approximation; None to
+                    estimate it, with galpy's estimateDeltaStaeckel, from the
+                    first points evaluated
+            dx = step of the central finite differences of the gradient
+            cache_dir = folder in which results are saved; None not to save
+                        them
+
+        OUTPUT:
+            None
+        """
+        if method not in ['staeckel', 'adiabatic']:
+            raise ValueError("method must be 'staeckel' or 'adiabatic'")
+        self.potential = get_potential(custom_potential)
+        self.method = method
+        self.delta = delta
+        self.dx = dx
+        self.cache_dir = cache_dir
+        self._action_angle = None
+        self._potential_hash = hashlib.sha1(
+                dill.dumps(self.potential)).hexdigest()
+
+    def _setup(self, coord):
+        # make the galpy action calculator, estimating delta from the points
+        if self._action_angle is not None:
+            return
+        if self.method == 'staeckel':
+            if self.delta is None:
+                self.delta = float(estimateDeltaStaeckel(
+                        self.potential, np.hypot(coord[:, 0], coord[:, 1]),
+                        coord[:, 2]))
+            self._action_angle = actionAngleStaeckel(
+                    pot = self.potential, delta = self.delta, c = True)
+        else:
+            self._action_angle = actionAngleAdiabatic(pot = self.potential,
+                                                      c = True)
+
+    def _actions(self, coord):
+        # J_z of (n,6) Cartesian points, in one call to galpy
+        self._setup(coord)
+        R, vR, vT, z, vz, phi = rect_to_cyl(*coord.T).T
+        return self._action_angle(R, vR, vT, z, vz)[2]
+
+    def value_and_gradient(self, coord):
+        """
+        NAME:
+            value_and_gradient
+
+        PURPOSE:
+            return J_z and its gradient at points; the actions of the points
+            and of their 12 shifted copies are computed together
+
+        INPUT:
+            coord = (m,6) array of points in natural units
+
+        OUTPUT:
+            (J_z of shape (m,), gradient of shape (m,6))
+        """
+        coord = np.asarray(coord, dtype = float)
+        # delta is fixed before it becomes part of the key
+        self._setup(coord)
+        file_name = None
+        if self.cache_dir is not None:
+            key = array_hash(coord, np.array([self.dx, self.delta or 0.])) + \
+                  self._potential_hash[:8] + self.method
+            file_name = os.path.join(self.cache_dir, key + '.npz')
+            if os.path.exists(file_name):
+                with np.load(file_name) as data:
+                    return data['jz'], data['gradient']
+
+        m = len(coord)
+        # the points, then the points shifted by +dx and -dx along each axis
+        shifts = np.concatenate([np.zeros((1, 6)), self.dx*np.eye(6),
+                                 -self.dx*np.eye(6)])
+        shifted = (coord[:, None, :] + shifts).reshape(-1, 6)
+        jz = self._actions(shifted).reshape(m, 13)
+        gradient = (jz[:, 1:7] - jz[:, 7:])/(2*self.dx)
+        jz = jz[:, 0]
+
+        if file_name is not None:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            np.savez(file_name, jz = jz, gradient = gradient)
+        return jz, gradient
+
+    def __call__(self, coord):
+        """
+        NAME:
+            __call__
+
+        PURPOSE:
+            return J_z at points
+
+        INPUT:
+            coord = (m,6) array of points in natural units
+
+        OUTPUT:
+            array of shape (m,)
+        """
+        return self._actions(np.asarray(coord, dtype = float))
+
+    def gradient(self, coord):
+        """
+        NAME:
+            gradient
+
+        PURPOSE:
+            return the gradient of J_z at points
+
+        INPUT:
+            coord = (m,6) array of points in natural units
+
+        OUTPUT:
+            array of shape (m,6)
+        """
+        return self.value_and_gradient(coord)[1]
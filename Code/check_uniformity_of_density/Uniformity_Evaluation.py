@@ -17,7 +17,9 @@ def grad_multi(f, points, dx = 1e-8):
 
     PURPOSE:
         Calculate the numerical value of gradient for an array of points, using
-        a function that is able to take an array of points
+        a function that is able to take an array of points. If the function
+        has a gradient attribute, such as the density of
+        toomredf.custom_density, its analytic gradient is returned instead.
 
     INPUT:
         f = a differentiable function that takes an array of points, each with n
@@ -30,6 +32,8 @@ def grad_multi(f, points, dx = 1e-8):
     HISTORY:
         2018-07-22 - Written - Samuel Wong
     """
+    if hasattr(f, 'gradient'):
+        return f.gradient(points)
     n = np.shape(points)[1]
     increment = dx*np.identity(n)
     df = []
@@ -77,36 +81,123 @@ def evaluate_uniformity_dot(f, points, v1, v2):
     HISTORY:
         2018-07-26 - Written - Samuel Wong
     """
-    m = np.shape(v1)[0] # get the number of rows
-    W = []
+    return uniformity_dot_from_gradient(grad_multi(f, points),
+                                        complement_of_pairs(v1, v2))
+
+
+def complement_of_pairs(v1, v2):
+    """
+    NAME:
+        complement_of_pairs
+
+    PURPOSE:
+        Find an orthonormal basis of the orthogonal complement of each pair of
+        rows of <v1> and <v2>. It only depends on the integrals of motion, so
+        it can be computed once and used for many densities.
+
+    INPUT:
+        v1, v2 = an array (m,6) vectors, where each row of v1 and v2 correspond
+                to a pair of vectors against which we are testing uniformity
+
+    OUTPUT:
+        W = an (m,4,6) array; the 4 rows of W[i] span the orthogonal
+            complement of v1[i] and v2[i]; rows with an anomalous complement
+            are nan
+    """
+    m, n = np.shape(v1) # get the number of rows
+    W = np.full((m, 4, n), np.nan)
     # get the orthogonal complement in each pair of v1 and v2.
     # print if anomaly in number of dimensions
     for i in range(m):
         comp = orthogonal_complement(np.array([v1[i], v2[i]]))
-        if np.shape(comp) == (4,6):
-            W.append(comp)
+        comp = np.reshape(np.array(comp, dtype = float), (-1, n))
+        if np.shape(comp) == (4,n):
+            W[i] = comp
         else:
             print("Anomaly at row {}, v1 = {}, v2 = {} , complement = {}"\
                   .format(i, v1[i], v2[i], comp))
-    W = np.array(W)
-    # reshape so that all 4 orthgoonal vectors for each row are listed together
-    # with every 4 adjacent rows being complement of the same gradient
-    W = np.reshape(W, (4*m, 6)) 
-    # get the normalize gradient and duplicate four times
-    # reshape so that every 4 adjacent rows are identical, so that it matches
-    # with W to do dot product
-    del_f_points = normalize(grad_multi(f, points))
-    del_f_points2 = np.copy(del_f_points)
-    del_f_points3 = np.copy(del_f_points)
-    del_f_points4 = np.copy(del_f_points)
-    four_f = np.stack((del_f_points, del_f_points2, del_f_points3,
-                       del_f_points4), axis =1)
-    four_f = np.reshape(four_f, np.shape(W))
-    # get the dot product and reshape such that each row contains 4 dot product
-    dot = dot_product(four_f, W)
-    dot = np.reshape(dot, (m, 4))
-    dot = dot.astype('float64') # change data type from sympy back to float
-    return dot
+    return W
+
+
+def uniformity_dot_from_gradient(gradient, W):
+    """
+    NAME:
+        uniformity_dot_from_gradient
+
+    PURPOSE:
+        Dot product of the normalized gradient of the density with the
+        orthogonal complement of the gradients of the integrals of motion.
+
+    INPUT:
+        gradient = (m,6) array of the gradient of the density at m points, or
+                   (k,m,6) array of the gradients of k densities
+        W = (m,4,6) array returned by complement_of_pairs
+
+    OUTPUT:
+        (m,4) array, or (k,m,4) array for k densities
+    """
+    gradient = gradient/LA.norm(gradient, axis = -1, keepdims = True)
+    return np.einsum('...mj,mij->...mi', gradient, W)
+
+
+def uniformity_projection_from_gradient(gradient, v1, v2):
+    """
+    NAME:
+        uniformity_projection_from_gradient
+
+    PURPOSE:
+        Fractional length of the part of the gradient of the density that is
+        orthogonal to the space spanned by v1 and v2.
+
+    INPUT:
+        gradient = (m,6) array of the gradient of the density at m points, or
+                   (k,m,6) array of the gradients of k densities
+        v1, v2 = an array (m,6) vectors, where each row of v1 and v2 correspond
+        to a pair of vectors against which we are testing uniformity
+
+    OUTPUT:
+        array of shape (m,), or (k,m) for k densities
+    """
+    e1, e2 = Gram_Schmidt_two(v1, v2)
+    # projection onto the orthonormal e1, e2, for any number of densities
+    p_projection = np.sum(gradient*e1, axis = -1, keepdims = True)*e1 + \
+                   np.sum(gradient*e2, axis = -1, keepdims = True)*e2
+    # call this projection cosine because it is adjacent over hypotenuse
+    cos = LA.norm(p_projection, axis = -1)/LA.norm(gradient, axis = -1)
+    # calculate sine from cosine; for an exactly uniform density, such as a
+    # toomredf, rounding can make cos slightly larger than 1
+    return np.sqrt(np.maximum(1- cos**2, 0.))
+
+
+def uniformity_from_gradient(gradient, v1, v2, uniformity_method, W = None):
+    """
+    NAME:
+        uniformity_from_gradient
+
+    PURPOSE:
+        Evaluate uniformity from the gradient of the density instead of the
+        density itself, for one density or many densities at once.
+
+    INPUT:
+        gradient = (m,6) array of the gradient of the density at m points, or
+                   (k,m,6) array of the gradients of k densities
+        v1, v2 = an array (m,6) vectors, where each row of v1 and v2 correspond
+        to a pair of vectors against which we are testing uniformity
+        uniformity_method = "projection" or "dot product"
+        W = for the dot product, the output of complement_of_pairs(v1, v2), if
+            already computed
+
+    OUTPUT:
+        same as evaluate_uniformity, with a leading axis for k densities
+    """
+    if uniformity_method == "projection":
+        return uniformity_projection_from_gradient(gradient, v1, v2)
+    elif uniformity_method == "dot product":
+        if W is None:
+            W = complement_of_pairs(v1, v2)
+        return uniformity_dot_from_gradient(gradient, W)
+    else:
+        raise Exception("uniformity method not understood.")
 
 
 def evaluate_uniformity_projection(f, points, v1, v2):
@@ -138,11 +229,67 @@ def evaluate_uniformity_projection(f, points, v1, v2):
         2018-07-27 - Changed from cosine projection to sine projection 
                     - Samuel Wong
     """
-    p = grad_multi(f, points)
-    e1, e2 = Gram_Schmidt_two(v1, v2)
-    p_projection = orthogonal_projection(p, e1, e2)
-    # call this projection cosine because it is adjacent over hypotenuse
-    cos = LA.norm(p_projection, axis = 1)/LA.norm(p, axis = 1)
-    sin = np.sqrt(1- cos**2) # calculate sine from cosine
-    return sin
-    
\ No newline at end of file
+    return uniformity_projection_from_gradient(grad_multi(f, points), v1, v2)
+
+
+def uniformity_projection_from_integrals(gradient, integral_gradients,
+                                         rtol = 1e-10):
+    """
+    NAME:
+        uniformity_projection_from_integrals
+
+    PURPOSE:
+        Fractional length of the part of the gradient of the density that is
+        orthogonal to the space spanned by the gradients of any number k of
+        integrals of motion (for example E, L_z and a candidate third
+        integral). The span at every point is found with a QR decomposition
+        of all points at once, instead of a Gram-Schmidt chain written for a
+        fixed number of vectors. A gradient of an integral that is (nearly) a
+        combination of the previous ones does not add to the span.
+
+    INPUT:
+        gradient = (m,6) array of the gradient of the density at m points, or
+                   (l,m,6) array of the gradients of l densities
+        integral_gradients = (m,k,6) array of the gradients of k integrals at
+                             each of the m points
+        rtol = diagonal elements of R smaller than rtol times the largest one
+               at the same point are treated as zero
+
+    OUTPUT:
+        array of shape (m,), or (l,m) for l densities; for k = 2 the same as
+        uniformity_projection_from_gradient
+    """
+    # orthonormal bases of the spans, as the columns of (m,6,k) arrays
+    Q, R = LA.qr(np.swapaxes(integral_gradients, -1, -2))
+    diagonal = np.abs(np.diagonal(R, axis1 = -2, axis2 = -1))
+    independent = diagonal > rtol*np.max(diagonal, axis = -1, keepdims = True)
+    Q = Q*independent[:, None, :]
+    # components along the basis and residual, for any number of densities
+    coefficients = np.einsum('mik,...mi->...mk', Q, gradient)
+    residual = gradient - np.einsum('mik,...mk->...mi', Q, coefficients)
+    return LA.norm(residual, axis = -1)/LA.norm(gradient, axis = -1)
+
+
+def evaluate_uniformity_integrals(f, points, integral_gradients):
+    """
+    NAME:
+        evaluate_uniformity_integrals
+
+    PURPOSE:
+        Calculate the fractional length of the part of grad(f)(points) outside
+        the space spanned by the gradients of k integrals of motion. A result
+        close to 0 means the function is uniform along all of them.
+
+    INPUT:
+        f = a differentiable function that takes an array of points, each with
+            n dimensions
+        points = (m,n) array, representing m points, each with n dimensions
+        integral_gradients = (m,k,n) array of the gradients of k integrals at
+                             each point, e.g.
+                             np.stack([del_E(points), del_Lz(points)], axis = 1)
+
+    OUTPUT:
+        array of shape (m,)
+    """
+    return uniformity_projection_from_integrals(grad_multi(f, points),
+                                                integral_gradients)
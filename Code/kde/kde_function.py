@@ -3,6 +3,65 @@ import numpy as np
 from sklearn.neighbors import KernelDensity
 from astropy.coordinates import SkyCoord
 
+def kde_scaling(inputs, bw_multiplier=10):
+    """
+    NAME:
+        kde_scaling
+    
+    PURPOSE:
+        Compute the z-score scaling of the inputs and the bandwidth used by
+        generate_KDE, so that other estimators can use the same ones.
+    
+    INPUT:
+        inputs (ndarray) = An NxM matrix where N is the number of data 
+                           points and M is the number of parameters.
+        bw_multiplier = multiplier of the bandwidth
+    
+    OUTPUT:
+        (mean, standard deviation, bandwidth); the mean and standard deviation
+        are arrays of M values and the bandwidth is in scaled units
+    """
+    inputs_std = np.nanstd(inputs, axis=0)
+    inputs_mean = np.mean(inputs, axis=0)
+    
+    #Optimizing bandwidth in terms of Scott's Multivariate Rule of Thumb
+    N = inputs.shape[0]
+    bw = bw_multiplier * np.nanstd((inputs - inputs_mean)/inputs_std) * \
+        N ** (-1/10.)
+    return inputs_mean, inputs_std, bw
+
+
+def selection_fraction(samples, selection):
+    """
+    NAME:
+        selection_fraction
+    
+    PURPOSE:
+        Evaluate a selection function at points in galactocentric cartesian
+        coordinates.
+    
+    INPUT:
+        samples (ndarray) = A QxM matrix of points in natural units
+        selection = a selection function that takes parallax to Sun and
+                    galactic latitude and returns the fraction of stars that
+                    are left after selection; takes parallax in physical units
+    
+    OUTPUT:
+        array of Q selection fractions
+    """
+    #compute parallax in physical units. Inputs are in natural units.
+    x, y, z, vx, vy, vz = samples.T
+    #distannce to sun; compute sqrt in natural unit; times 8 to turn to
+    #physical
+    distance = 8.*np.sqrt((x-(-1.03749451))**2 + y**2 + (z-0.000875)**2)
+    parallax = 1/distance
+    # convert cartesian galactocentric to galactic
+    gal = SkyCoord(x=8.*x, y=8.*y, z=8.*z, unit="kpc",
+                        frame="galactocentric").galactic
+    b = gal.b.degree
+    return selection(parallax, b)
+
+
 #Defining a KDE function to quickly compute probabilities for the data set
 def generate_KDE(inputs, ker, selection = None, bw_multiplier=10):
     """
@@ -30,16 +89,10 @@ def generate_KDE(inputs, ker, selection = None, bw_multiplier=10):
     HISTORY:
         2018-07-15 - Updated - Ayush Pandhi
     """
-    #Scaling velocities with z-score
-    inputs_std = np.nanstd(inputs, axis=0)
-    i1, i2, i3, i4, i5, i6 = np.mean(inputs, axis=0)
-    inputs_mean = np.hstack((i1, i2, i3, i4, i5, i6))
+    #Scaling velocities with z-score and choosing the bandwidth
+    inputs_mean, inputs_std, bw = kde_scaling(inputs, bw_multiplier)
     inputs = (inputs - inputs_mean)/inputs_std
     
-    #Optimizing bandwidth in terms of Scott's Multivariate Rule of Thumb
-    N = inputs.shape[0]
-    bw = bw_multiplier * np.nanstd(inputs) * N ** (-1/10.)
-    
     #Fit data points to selected kernel and bandwidth
     kde = KernelDensity(kernel=ker, bandwidth=bw).fit(inputs)  
     
@@ -64,19 +117,8 @@ def generate_KDE(inputs, ker, selection = None, bw_multiplier=10):
         HISTORY:
             2018-07-15 - Updated - Ayush Pandhi
         """
-        if selection is not None:
-            #compute parallax in physical units. Inputs are in natural units.
-            x, y, z, vx, vy, vz = samples.T
-            #distannce to sun; compute sqrt in natural unit; times 8 to turn to
-            #physical
-            distance = 8.*np.sqrt((x-(-1.03749451))**2 + y**2 + (z-0.000875)**2)
-            parallax = 1/distance
-            # convert cartesian galactocentric to galactic
-            gal = SkyCoord(x=8.*x, y=8.*y, z=8.*z, unit="kpc",
-                                frame="galactocentric").galactic
-            b = gal.b.degree
-        
         #Scaling samples with standard deviation
+        samples_natural = samples
         samples = (samples - inputs_mean)/inputs_std
         
         #Get the log density for selected samples and apply exponential to get normal probabilities
@@ -88,7 +130,7 @@ def generate_KDE(inputs, ker, selection = None, bw_multiplier=10):
             return dens
         else:
             # divide by selection fraction only when selection function is given
-            return dens/selection(parallax, b)
+            return dens/selection_fraction(samples_natural, selection)
     
     #Return a black box function for sampling
     return input_KDE
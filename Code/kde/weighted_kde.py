@@ -0,0 +1,230 @@
+"""
+NAME:
+    weighted_kde
+
+PURPOSE:
+    Evaluate many weighted versions of the Epanechnikov KDE of generate_KDE,
+    together with their gradients, from a single tree built on the original
+    samples. A bootstrap resample is the original sample with an integer
+    weight (its multiplicity) on every star and a jackknife sample is the
+    original sample with zero weight on one fold, so the densities of all
+    replicates at a set of points are the product of one sparse matrix of
+    kernel values, computed in one neighbour traversal, with the matrix of
+    replicate weights. The z-score scaling and the bandwidth are those of the
+    original sample for every replicate.
+
+HOW TO USE:
+    kde = WeightedKDE(samples, selection, bw_multiplier)
+    weights = bootstrap_weights(len(samples), seeds)
+    density, gradient = kde.density_and_gradient(points, weights)
+
+    or, for a jackknife with the fold of every sample in folds,
+
+    density, gradient = kde.leave_one_fold_out(points, folds)
+"""
+import sys
+sys.path.append('../check_uniformity_of_density')
+
+import numpy as np
+from scipy import sparse
+from scipy.special import gamma
+from sklearn.neighbors import KDTree
+from kde.kde_function import kde_scaling, selection_fraction
+from Uniformity_Evaluation import grad_multi
+
+
+def bootstrap_weights(n, seeds, weighting='multinomial'):
+    """
+    NAME:
+        bootstrap_weights
+
+    PURPOSE:
+        Draw the multiplicity of every sample in each bootstrap replicate.
+
+    INPUT:
+        n - number of samples
+
+        seeds - list of numpy SeedSequence (or integers), one per replicate
+
+        weighting - 'multinomial' for the multiplicities of a resample with
+        replacement of n samples, or 'poisson' for independent Poisson(1)
+        multiplicities
+
+    OUTPUT:
+        (n, number of replicates) array of weights
+    """
+    weights = np.empty((n, len(seeds)))
+    for k, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        if weighting == 'multinomial':
+            weights[:, k] = np.bincount(rng.integers(0, n, n), minlength=n)
+        elif weighting == 'poisson':
+            weights[:, k] = rng.poisson(1., n)
+        else:
+            raise ValueError("weighting must be 'multinomial' or 'poisson'")
+    return weights
+
+
+class WeightedKDE:
+    """
+    Class evaluating weighted Epanechnikov KDEs with a tree built once
+    """
+    def __init__(self, inputs, selection=None, bw_multiplier=10,
+                 leaf_size=40):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            scale the samples as generate_KDE does and build their tree
+
+        INPUT:
+            inputs - NxM array of samples in natural units
+
+            selection - selection function, as for generate_KDE
+
+            bw_multiplier - multiplier of the bandwidth, as for generate_KDE
+
+            leaf_size - leaf size of the tree
+
+        OUTPUT:
+            None
+        """
+        self.mean, self.std, self.bw = kde_scaling(inputs, bw_multiplier)
+        self.selection = selection
+        self.n, self.dim = np.shape(inputs)
+        self.tree = KDTree((inputs - self.mean)/self.std, leaf_size=leaf_size)
+        # scaled samples, as stored by the tree
+        self.scaled = np.asarray(self.tree.data)
+        # normalization of the Epanechnikov kernel (1 - u^2) in dim
+        # dimensions, as in sklearn.neighbors.KernelDensity
+        unit_ball = np.pi**(self.dim/2.)/gamma(self.dim/2. + 1)
+        self.norm = unit_ball*2./(self.dim + 2)*self.bw**self.dim
+
+    def kernel_matrix(self, points):
+        """
+        NAME:
+            kernel_matrix
+
+        PURPOSE:
+            Find the samples within one bandwidth of each point in one
+            traversal of the tree and return the kernel values and the
+            scaled offsets from which the density and its gradient follow.
+
+        INPUT:
+            points - (m, M) array of points in natural units
+
+        OUTPUT:
+            sparse CSR matrix of shape ((M+1)*m, N); rows i*(M+1) hold the
+            kernel values 1 - u^2 of point i and rows i*(M+1) + 1 + j the
+            j-th component of u = (z - z_sample)/bw, where z are scaled
+            coordinates
+        """
+        scaled = (points - self.mean)/self.std
+        index, distance = self.tree.query_radius(scaled, self.bw,
+                                                 return_distance=True)
+        count = np.array([len(i) for i in index])
+        columns = np.concatenate(index) if len(index) else np.array([], int)
+        point = np.repeat(np.arange(len(points)), count)
+        u = (scaled[point] - self.scaled[columns])/self.bw
+        values = np.column_stack([1. - (np.concatenate(distance)/self.bw)**2,
+                                  u])
+        width = self.dim + 1
+        rows = (point*width)[:, None] + np.arange(width)
+        return sparse.csr_matrix(
+                (values.ravel(), (rows.ravel(),
+                                  np.repeat(columns, width))),
+                shape=(len(points)*width, self.n))
+
+    def density_and_gradient(self, points, weights, chunk_size=1000):
+        """
+        NAME:
+            density_and_gradient
+
+        PURPOSE:
+            Evaluate the density and its gradient at points for every column
+            of weights. The points are processed in chunks so that only the
+            kernel matrix of one chunk is held in memory.
+
+        INPUT:
+            points - (m, M) array of points in natural units
+
+            weights - (N, k) array of the weights of the samples in k
+            replicates; a column of ones gives the KDE of generate_KDE
+
+            chunk_size - number of points per chunk
+
+        OUTPUT:
+            (density, gradient); density has shape (k, m) and gradient
+            (k, m, M), both with respect to natural units
+        """
+        weights = np.asarray(weights, dtype=float)
+        return self._density_and_gradient(points,
+                                          self._sums(points, weights,
+                                                     chunk_size),
+                                          np.sum(weights, axis=0))
+
+    def leave_one_fold_out(self, points, folds, chunk_size=1000):
+        """
+        NAME:
+            leave_one_fold_out
+
+        PURPOSE:
+            Evaluate the density and its gradient at points for each sample
+            without one fold of the samples. The kernel sums of every fold
+            are computed in one traversal and each leave-one-fold-out sum is
+            the total minus the sum of the fold.
+
+        INPUT:
+            points - (m, M) array of points in natural units
+
+            folds - array of the fold of every sample, from 0 to k-1
+
+            chunk_size - number of points per chunk
+
+        OUTPUT:
+            (density, gradient); density has shape (k, m) and gradient
+            (k, m, M), both with respect to natural units
+        """
+        folds = np.asarray(folds)
+        k = folds.max() + 1
+        # indicator matrix of the folds
+        membership = sparse.csr_matrix(
+                (np.ones(self.n), (np.arange(self.n), folds)),
+                shape=(self.n, k))
+        fold_sums = self._sums(points, membership, chunk_size)
+        total = np.sum(fold_sums, axis=2, keepdims=True)
+        fold_size = np.bincount(folds, minlength=k)
+        return self._density_and_gradient(points, total - fold_sums,
+                                          self.n - fold_size)
+
+    def _sums(self, points, weights, chunk_size):
+        # weighted kernel sums, of shape (m, M+1, k)
+        m, k = len(points), weights.shape[1]
+        sums = np.empty((m, self.dim + 1, k))
+        for start in range(0, m, chunk_size):
+            chunk = slice(start, min(start + chunk_size, m))
+            product = self.kernel_matrix(points[chunk]) @ weights
+            if sparse.issparse(product):
+                product = product.toarray()
+            sums[chunk] = product.reshape(-1, self.dim + 1, k)
+        return sums
+
+    def _density_and_gradient(self, points, sums, total_weight):
+        # density and gradient from the kernel sums and the total weight of
+        # every replicate
+        scale = 1./(self.norm*np.asarray(total_weight, dtype=float))
+        density = sums[:, 0, :].T*scale[:, None]
+        # d(1 - u^2)/dx_j = -2 u_j/(bw std_j)
+        gradient = -2.*np.transpose(sums[:, 1:, :], (2, 0, 1))* \
+            scale[:, None, None]/(self.bw*self.std)
+
+        if self.selection is not None:
+            # density/selection; the selection does not depend on the weights
+            inverse = lambda x: 1./selection_fraction(x, self.selection)
+            inverse_points = inverse(points)
+            inverse_gradient = grad_multi(inverse, points)
+            gradient = gradient*inverse_points[:, None] + \
+                density[:, :, None]*inverse_gradient
+            density = density*inverse_points
+        return density, gradient
@@ -9,13 +9,21 @@ HISTORY:
     2018-06-20 - Written - Michael Poon
 
 """
+import sys
+sys.path.append('..')
 
+import os
 import numpy as np
 from sklearn.cluster import MiniBatchKMeans
 from astropy.stats import median_absolute_deviation
+from tools.tools import array_hash
 
+# name of the rule used to scale each coordinate before clustering; part of the
+# key of cached cluster centres, so change it whenever the scaling changes
+SCALING_RULE = 'median_absolute_deviation'
 
-def kmeans(samples, n_clusters, batch_size): 
+
+def kmeans(samples, n_clusters, batch_size, random_state=None): 
     """
     NAME:
         kmeans
@@ -32,16 +40,59 @@ def kmeans(samples, n_clusters, batch_size):
         batch_size - batch size per iteration of MiniBatch KMeans over
                      gradient descent
         
+        random_state - seed of the random number generator used to initialize
+                       the centroids; None for a random initialization
         
     OUTPUT:
         Nx6 array of rectangular phase space coordinates of the form 
         (x, y, z, vx, vy, vz) in [kpc, kpc, kpc, km/s, km/s, km/s]
     """
     
-    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size)
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size,
+                             random_state=random_state)
     samples_mad = median_absolute_deviation(samples, axis=0, ignore_nan=True)
     kmeans.fit(samples/samples_mad)
     return kmeans.cluster_centers_*samples_mad
 
+
+def kmeans_cached(samples, n_clusters, batch_size, random_state=None,
+                  cache_dir='kmeans_cache'):
+    """
+    NAME:
+        kmeans_cached
+        
+    PURPOSE:
+        Same as kmeans, but look up the cluster centres in a cache on disk
+        first. The cache is keyed by a hash of the samples together with the
+        number of clusters, the batch size, the scaling rule and the seed, so
+        that a repeated clustering of the same samples is skipped.
+        
+    INPUT:
+        samples - Nx6 array of rectangular phase space coordinates
+        
+        n_clusters - number of centroids generated from MiniBatch KMeans
+        
+        batch_size - batch size per iteration of MiniBatch KMeans over
+                     gradient descent
+        
+        random_state - seed of the random number generator used to initialize
+                       the centroids; None for a random initialization, in
+                       which case the first clustering found is reused
+        
+        cache_dir - folder in which the cluster centres are stored
+        
+    OUTPUT:
+        n_clusters x 6 array of cluster centres, in the same units as samples
+    """
+    key = '{}_{}_{}_{}_{}'.format(array_hash(samples), n_clusters, batch_size,
+                                  SCALING_RULE, random_state)
+    file_name = os.path.join(cache_dir, key + '.npy')
+    if os.path.exists(file_name):
+        print('Loading cached cluster centres from', file_name)
+        return np.load(file_name)
     
-    
\ No newline at end of file
+    centres = kmeans(samples, n_clusters, batch_size, random_state)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    np.save(file_name, centres)
+    return centres
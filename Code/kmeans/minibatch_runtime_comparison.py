@@ -1,8 +1,315 @@
-from sklearn.cluster import KMeans
-from sklearn.cluster import MiniBatchKMeans
+"""
+NAME:
+    minibatch_runtime_comparison
+
+PURPOSE:
+    Benchmark the clustering used to choose the centres at which uniformity is
+    evaluated. Full KMeans, MiniBatch KMeans with different batch sizes and
+    any other centre selection strategy are run on synthetic catalogues and on
+    a cached copy of the Gaia catalogue, recording wall time, CPU time, peak
+    memory and inertia. The results are written to a JSON file so that the
+    defaults of get_cluster can be chosen with evidence.
+"""
+import sys
+sys.path.append('..')
+
+import os
+import json
 import time
+import resource
+import tracemalloc
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import pairwise_distances_argmin_min
+from astropy.stats import median_absolute_deviation
+from kmeans.kmeans import kmeans
+
+
+def full_kmeans(samples, n_clusters, random_state=None):
+    """
+    NAME:
+        full_kmeans
+
+    PURPOSE:
+        Cluster with full (Lloyd) KMeans, using the same scaling as kmeans.
+
+    INPUT:
+        samples - Nx6 array of rectangular phase space coordinates
+
+        n_clusters - number of centroids
+
+        random_state - seed of the initialization
+
+    OUTPUT:
+        n_clusters x 6 array of cluster centres
+    """
+    samples_mad = median_absolute_deviation(samples, axis=0, ignore_nan=True)
+    full = KMeans(n_clusters=n_clusters, n_init=1, random_state=random_state)
+    full.fit(samples/samples_mad)
+    return full.cluster_centers_*samples_mad
+
+
+def minibatch_strategy(batch_fraction=None, batch_size=None):
+    """
+    NAME:
+        minibatch_strategy
+
+    PURPOSE:
+        Return a centre selection strategy that uses MiniBatch KMeans with a
+        batch size that is either a fraction of the number of samples (as in
+        get_cluster) or fixed.
+
+    INPUT:
+        batch_fraction - batch size as a fraction of the number of samples
+
+        batch_size - fixed batch size; used if batch_fraction is None
+
+    OUTPUT:
+        function of (samples, n_clusters, random_state) returning the centres
+    """
+    def strategy(samples, n_clusters, random_state=None):
+        if batch_fraction is not None:
+            size = max(int(batch_fraction * len(samples)), 1)
+        else:
+            size = batch_size
+        return kmeans(samples, n_clusters, size, random_state)
+    return strategy
+
+
+def random_subsample(samples, n_clusters, random_state=None):
+    """
+    NAME:
+        random_subsample
+
+    PURPOSE:
+        Baseline centre selection strategy: pick n_clusters stars at random.
+
+    INPUT:
+        samples - Nx6 array of rectangular phase space coordinates
+
+        n_clusters - number of centres
+
+        random_state - seed of the random choice
+
+    OUTPUT:
+        n_clusters x 6 array of centres
+    """
+    rng = np.random.RandomState(random_state)
+    return samples[rng.choice(len(samples), n_clusters, replace=False)]
+
+
+# default strategies to compare; other centre selection strategies can be
+# added to this dictionary or passed to run_benchmark
+STRATEGIES = {'KMeans': full_kmeans,
+              'MiniBatchKMeans (batch = 0.1%)': minibatch_strategy(0.001),
+              'MiniBatchKMeans (batch = 1%)': minibatch_strategy(0.01),
+              'MiniBatchKMeans (batch = 10%)': minibatch_strategy(0.1),
+              'MiniBatchKMeans (batch = 1024)': minibatch_strategy(
+                      batch_size=1024),
+              'random subsample': random_subsample}
+
+
+def synthetic_catalogue(size, random_state=None):
+    """
+    NAME:
+        synthetic_catalogue
+
+    PURPOSE:
+        Generate a catalogue of stars resembling the local Gaia RV sample, as
+        a mixture of a thin-disc-like and a thick-disc-like Gaussian.
+
+    INPUT:
+        size - number of stars
+
+        random_state - seed of the random number generator
+
+    OUTPUT:
+        Nx6 array of rectangular galactocentric coordinates of the form
+        (x, y, z, vx, vy, vz) in [kpc, kpc, kpc, km/s, km/s, km/s]
+    """
+    rng = np.random.RandomState(random_state)
+    size = int(size)
+    mean = np.array([-8.3, 0., 0.03, 11.1, 232.24, 7.25])
+    thin = np.array([1., 1., 0.3, 35., 25., 20.])
+    thick = np.array([1.5, 1.5, 0.9, 70., 50., 45.])
+    scale = np.where(rng.uniform(size=(size, 1)) < 0.9, thin, thick)
+    return mean + scale*rng.normal(size=(size, 6))
+
+
+def real_catalogue(size, cache_file='gaia_catalogue.npy', random_state=None):
+    """
+    NAME:
+        real_catalogue
+
+    PURPOSE:
+        Draw a catalogue of the given size from the Gaia RV catalogue. The
+        catalogue is loaded once with search_local and cached in a .npy file
+        so that later benchmarks do not pay for the coordinate conversion.
+        If more stars are requested than there are in the catalogue, stars
+        are drawn with replacement.
+
+    INPUT:
+        size - number of stars
+
+        cache_file - .npy file in which the catalogue is cached
+
+        random_state - seed of the random draw
+
+    OUTPUT:
+        Nx6 array of rectangular galactocentric coordinates of the form
+        (x, y, z, vx, vy, vz) in [kpc, kpc, kpc, km/s, km/s, km/s]
+    """
+    if os.path.exists(cache_file):
+        catalogue = np.load(cache_file, mmap_mode='r')
+    else:
+        from search import search_local
+        catalogue = search_local.get_entire_catalogue()
+        np.save(cache_file, catalogue)
+
+    rng = np.random.RandomState(random_state)
+    size = int(size)
+    index = rng.choice(len(catalogue), size, replace=size > len(catalogue))
+    return np.asarray(catalogue[np.sort(index)])
+
+
+def inertia(samples, centres):
+    """
+    NAME:
+        inertia
+
+    PURPOSE:
+        Sum of squared distances from each sample to its closest centre, in
+        the scaled coordinates used by kmeans, so that all strategies are
+        compared on the same footing.
+
+    INPUT:
+        samples - Nx6 array of coordinates
+
+        centres - Mx6 array of centres
+
+    OUTPUT:
+        inertia as a float
+    """
+    samples_mad = median_absolute_deviation(samples, axis=0, ignore_nan=True)
+    _, distance = pairwise_distances_argmin_min(samples/samples_mad,
+                                                centres/samples_mad)
+    return float(np.sum(distance**2))
+
+
+def benchmark_strategy(strategy, samples, n_clusters, random_state=None):
+    """
+    NAME:
+        benchmark_strategy
+
+    PURPOSE:
+        Run one centre selection strategy and measure its cost.
+
+    INPUT:
+        strategy - function of (samples, n_clusters, random_state) returning
+        the centres
+
+        samples - Nx6 array of coordinates
+
+        n_clusters - number of centres
+
+        random_state - seed passed to the strategy
+
+    OUTPUT:
+        dictionary with the wall time and CPU time in seconds, the peak
+        memory traced by tracemalloc and the peak resident set size of the
+        process in bytes, and the inertia of the centres
+    """
+    tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    centres = strategy(samples, n_clusters, random_state)
+    cpu_time = time.process_time() - cpu_start
+    wall_time = time.perf_counter() - wall_start
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    return {'wall_time': wall_time, 'cpu_time': cpu_time,
+            'peak_traced_memory': peak_traced, 'peak_rss': peak_rss,
+            'inertia': inertia(samples, centres)}
+
+
+def run_benchmark(sizes=(1e4, 1e5, 1e6, 1e7), catalogues=('synthetic',),
+                  strategies=None, cluster_fraction=0.001, repeats=1,
+                  max_full_kmeans_size=1e5, output_file='kmeans_benchmark.json',
+                  random_state=0):
+    """
+    NAME:
+        run_benchmark
+
+    PURPOSE:
+        Benchmark every strategy on every catalogue size and write the
+        results to a JSON file, which is rewritten after every measurement so
+        that a long benchmark that is interrupted keeps what it has done.
+
+    INPUT:
+        sizes - numbers of stars in the catalogues
+
+        catalogues - 'synthetic' and/or 'real' (cached Gaia catalogue)
+
+        strategies - dictionary of name: strategy; default = STRATEGIES
+
+        cluster_fraction - number of centres as a fraction of the number of
+        stars; default = 0.001 as in get_cluster
+
+        repeats - number of times each measurement is repeated
+
+        max_full_kmeans_size - full KMeans is skipped for catalogues larger
+        than this, as its cost grows too quickly to be of use
+
+        output_file - JSON file to write the results to
+
+        random_state - seed of the catalogues and the strategies
+
+    OUTPUT:
+        list of dictionaries, one per measurement
+    """
+    if strategies is None:
+        strategies = STRATEGIES
+
+    records = []
+    for catalogue in catalogues:
+        for size in sizes:
+            if catalogue == 'synthetic':
+                samples = synthetic_catalogue(size, random_state)
+            elif catalogue == 'real':
+                samples = real_catalogue(size, random_state=random_state)
+            else:
+                raise ValueError("catalogue must be 'synthetic' or 'real'")
+            n_clusters = max(int(cluster_fraction * size), 1)
+
+            for name, strategy in strategies.items():
+                if strategy is full_kmeans and size > max_full_kmeans_size:
+                    continue
+                for repeat in range(repeats):
+                    print('{} catalogue of {:.0e} stars: {} ({}/{})'.format(
+                            catalogue, size, name, repeat + 1, repeats))
+                    record = {'catalogue': catalogue, 'size': int(size),
+                              'n_clusters': n_clusters, 'strategy': name,
+                              'repeat': repeat}
+                    record.update(benchmark_strategy(strategy, samples,
+                                                     n_clusters, random_state))
+                    records.append(record)
+                    with open(output_file, 'w') as f:
+                        json.dump(records, f, indent=1)
+    return records
+
+
+if __name__ == "__main__":
+
+    # User Input
+    sizes = [1e4, 1e5, 1e6, 1e7]
+    catalogues = ['synthetic', 'real']
 
-print(time.gmtime(0))
-t0 = time.time()
-t_minibatch = time.time() - t0
-print(t_minibatch)
\ No newline at end of file
+    records = run_benchmark(sizes=sizes, catalogues=catalogues)
+    for record in records:
+        print('{catalogue:>9} {size:>9} {strategy:>32}: {wall_time:8.2f} s, '
+              '{peak_traced_memory:12d} B, inertia = {inertia:.4g}'.format(
+                      **record))
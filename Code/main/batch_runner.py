@@ -0,0 +1,398 @@
+"""
+NAME:
+    batch_runner
+
+PURPOSE:
+    Run the main program non-interactively on a declarative list of runs in a
+    single process. Every run is a dictionary of the arguments of main (see
+    RUN_DEFAULTS), plus the search parameters epsilon, v_scale and search_star
+    and the names used for custom samples and densities, so that nothing is
+    asked from the user. Loaded catalogues, search results, KDEs and cluster
+    centres are kept in memory and reused between runs whose inputs coincide.
+    Results are saved in the same main_program_results layout as main. By
+    default the plots of a run are made by background processes while the
+    next runs are computed.
+
+HOW TO USE:
+    runs = sweep(epsilon=[0.5, 1.], band_width=[5, 10],
+                 uniformity_method=['projection', 'dot product'],
+                 search_star=[[-8.3, 0., 0.03, 11.1, 232.24, 7.25]])
+    BatchRunner().run_all(runs)
+
+    or, from a JSON file containing a list of runs, in which the selection is
+    given as the path of a dill file and the potential as the name of a galpy
+    potential:
+
+    python batch_runner.py runs.json
+"""
+import matplotlib
+# plots are only saved; a non-interactive backend stops plt.show from blocking
+matplotlib.use('Agg')
+
+import sys
+import json
+import time
+import itertools
+import traceback
+import dill
+import numpy as np
+import pylab as plt
+import galpy.potential
+from main_program_cluster import search_for_samples, search_file_name, \
+    make_result_folder, evaluate_save_plot, get_cluster, to_natural_units, \
+    generate_KDE, array_hash, Profiler, get_potential
+from render import Renderer
+
+# arguments of a run and their default values
+RUN_DEFAULTS = {'uniformity_method': 'projection',
+                'gradient_method': 'analytic',
+                'search_method': 'local',
+                'epsilon': None,
+                'v_scale': None,
+                'search_star': None,
+                'band_width': 10,
+                'custom_samples': None,
+                'file_name': None,
+                'custom_density': None,
+                'density_name': None,
+                'custom_centres': None,
+                'custom_potential': None,
+                'selection': None,
+                'cache_centres': True,
+                'kmeans_seed': None,
+                'plot': 'background',
+                'rasterize': False,
+                'max_bokeh_points': None,
+                'interpolate_potential': False,
+                'extra_integrals': None}
+
+
+def sweep(base=None, **parameters):
+    """
+    NAME:
+        sweep
+
+    PURPOSE:
+        Build the list of runs of a parameter sweep, with one run for every
+        combination of the given parameter values.
+
+    INPUT:
+        base - dictionary of arguments shared by all runs
+
+        parameters - for each argument to sweep over, a list of its values
+
+    OUTPUT:
+        list of run dictionaries
+    """
+    if base is None:
+        base = {}
+    names = list(parameters)
+    runs = []
+    for values in itertools.product(*[parameters[name] for name in names]):
+        run = dict(base)
+        run.update(zip(names, values))
+        runs.append(run)
+    return runs
+
+
+def load_runs(file_name):
+    """
+    NAME:
+        load_runs
+
+    PURPOSE:
+        Load a list of runs from a JSON file.
+
+    INPUT:
+        file_name - path of a JSON file containing a list of dictionaries; a
+        custom_potential can be given as the name of a potential in
+        galpy.potential, a selection as the path of a dill file and
+        custom_samples or custom_centres as the path of a .npy file
+
+    OUTPUT:
+        list of run dictionaries
+    """
+    with open(file_name) as f:
+        runs = json.load(f)
+    for run in runs:
+        if isinstance(run.get('custom_potential'), str):
+            run['custom_potential'] = getattr(galpy.potential,
+                                              run['custom_potential'])
+        for key in ['custom_samples', 'custom_centres']:
+            if isinstance(run.get(key), str):
+                run[key] = np.load(run[key])
+    return runs
+
+
+class BatchRunner:
+    """
+    Class running the main program on many runs in one process, reusing what
+    runs have in common
+    """
+    def __init__(self, render_workers=None):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a BatchRunner with empty memories of searches,
+            selection functions, KDEs and cluster centres
+
+        INPUT:
+            render_workers - number of processes making the plots of runs
+            with plot = 'background'; None for the number of CPUs
+
+        OUTPUT:
+            None
+        """
+        self.render_workers = render_workers
+        self._renderer = None
+        self._samples = {}
+        self._selections = {}
+        self._densities = {}
+        self._centres = {}
+
+    def get_selection(self, selection):
+        """
+        NAME:
+            get_selection
+
+        PURPOSE:
+            return the selection function of a run, loading it only once if it
+            is given as the path of a dill file
+
+        INPUT:
+            selection - None, a selection function or the path of a dill file
+
+        OUTPUT:
+            (selection function or None, key identifying it)
+        """
+        if selection is None:
+            return None, None
+        if isinstance(selection, str):
+            if selection not in self._selections:
+                with open(selection, 'rb') as dill_file:
+                    self._selections[selection] = dill.load(dill_file)
+            return self._selections[selection], selection
+        return selection, id(selection)
+
+    def get_samples(self, run, profiler):
+        """
+        NAME:
+            get_samples
+
+        PURPOSE:
+            return the samples of a run in natural units, searching the
+            catalogue only if no previous run made the same search
+
+        INPUT:
+            run - run dictionary with all arguments
+
+            profiler - Profiler recording the cost of a search
+
+        OUTPUT:
+            (samples, file_name, key identifying the samples)
+        """
+        if run['custom_samples'] is not None:
+            if run['file_name'] is None:
+                raise ValueError('runs with custom samples need a file_name')
+            key = ('custom', array_hash(run['custom_samples']))
+            if key not in self._samples:
+                with profiler.stage('unit conversion'):
+                    self._samples[key] = to_natural_units(
+                            run['custom_samples'])
+            return self._samples[key], run['file_name'], key
+
+        if run['search_method'] == 'all of local':
+            key = ('all of local',)
+        else:
+            if (run['epsilon'] is None or run['v_scale'] is None or
+                run['search_star'] is None):
+                raise ValueError('searches need epsilon, v_scale and '
+                                 'search_star')
+            key = (run['search_method'], run['epsilon'], run['v_scale'],
+                   tuple(run['search_star']))
+        if key not in self._samples:
+            samples, _ = search_for_samples(
+                    run['search_method'], run['band_width'], run['epsilon'],
+                    run['v_scale'], run['search_star'], profiler)
+            with profiler.stage('unit conversion'):
+                self._samples[key] = to_natural_units(samples)
+        # the band width is part of the name of a search, but not of the
+        # samples that are found
+        file_name = search_file_name(run['search_method'], run['band_width'],
+                                     run['epsilon'], run['v_scale'],
+                                     run['search_star'])
+        return self._samples[key], file_name, key
+
+    def get_density(self, run, samples, samples_key, profiler):
+        """
+        NAME:
+            get_density
+
+        PURPOSE:
+            return the density of a run; a KDE is only fitted if no previous
+            run used the same samples, band width and selection
+
+        INPUT:
+            run - run dictionary with all arguments
+
+            samples - samples in natural units
+
+            samples_key - key identifying the samples
+
+            profiler - Profiler recording the cost of fitting a KDE
+
+        OUTPUT:
+            density function
+        """
+        if run['custom_density'] is not None:
+            return run['custom_density']
+        selection, selection_key = self.get_selection(run['selection'])
+        key = (samples_key, run['band_width'], selection_key)
+        if key not in self._densities:
+            with profiler.stage('KDE fit'):
+                self._densities[key] = generate_KDE(
+                        samples, 'epanechnikov', selection, run['band_width'])
+        return self._densities[key]
+
+    def get_centres(self, run, samples, samples_key, profiler):
+        """
+        NAME:
+            get_centres
+
+        PURPOSE:
+            return the cluster centres of a run; kmeans is only run if no
+            previous run clustered the same samples with the same seed
+
+        INPUT:
+            run - run dictionary with all arguments
+
+            samples - samples in natural units
+
+            samples_key - key identifying the samples
+
+            profiler - Profiler recording the cost of clustering
+
+        OUTPUT:
+            cluster centres in natural units
+        """
+        if run['custom_centres'] is not None:
+            return run['custom_centres']
+        key = (samples_key, run['kmeans_seed'])
+        if key not in self._centres:
+            with profiler.stage('clustering'):
+                self._centres[key] = get_cluster(samples, None,
+                                                 run['cache_centres'],
+                                                 run['kmeans_seed'])
+        return self._centres[key]
+
+    def run(self, run, instrument=True):
+        """
+        NAME:
+            run
+
+        PURPOSE:
+            perform a single run of the main program
+
+        INPUT:
+            run - dictionary of arguments; missing ones take the value in
+            RUN_DEFAULTS
+
+            instrument - if True, save the cost of each stage of the run in
+            instrumentation.json next to its results; stages reused from
+            previous runs are not recorded
+
+        OUTPUT:
+            (file_name, cluster, result)
+        """
+        unknown = set(run) - set(RUN_DEFAULTS)
+        if unknown:
+            raise ValueError('unknown run arguments: {}'.format(unknown))
+        run = dict(RUN_DEFAULTS, **run)
+        profiler = Profiler(enabled=instrument)
+
+        samples, file_name, samples_key = self.get_samples(run, profiler)
+        density = self.get_density(run, samples, samples_key, profiler)
+        if run['custom_density'] is not None:
+            if run['density_name'] is None:
+                raise ValueError('runs with a custom density need a '
+                                 'density_name')
+            file_name = run['density_name'] + ' ' + file_name
+        selection, _ = self.get_selection(run['selection'])
+        file_name = make_result_folder(file_name, selection,
+                                       run['uniformity_method'])
+        centres = self.get_centres(run, samples, samples_key, profiler)
+
+        custom_potential = run['custom_potential']
+        if run['interpolate_potential']:
+            # built once per potential and process, then looked up
+            custom_potential = get_potential(custom_potential, True)
+
+        if run['plot'] == 'background' and self._renderer is None:
+            self._renderer = Renderer(self.render_workers)
+        cluster, result = evaluate_save_plot(
+                samples, density, file_name, run['uniformity_method'],
+                run['gradient_method'], centres, custom_potential,
+                profiler=profiler, plot=run['plot'], renderer=self._renderer,
+                rasterize=run['rasterize'],
+                max_bokeh_points=run['max_bokeh_points'],
+                extra_integrals=run['extra_integrals'])
+        plt.close('all')
+        return file_name, cluster, result
+
+    def run_all(self, runs, stop_on_error=False):
+        """
+        NAME:
+            run_all
+
+        PURPOSE:
+            perform every run in a list; a run that fails is reported and
+            skipped so that the rest of the sweep still happens
+
+        INPUT:
+            runs - list of run dictionaries
+
+            stop_on_error - if True, raise the error of a failed run instead
+
+        OUTPUT:
+            list of dictionaries summarizing each run, with its folder, status,
+            run time, and mean and standard deviation of the result; runs
+            whose plots could not all be made have status 'plot failed'
+        """
+        summary = []
+        for i, run in enumerate(runs):
+            print('Run {} of {}'.format(i + 1, len(runs)))
+            start = time.time()
+            try:
+                file_name, cluster, result = self.run(run)
+            except Exception:
+                if stop_on_error:
+                    raise
+                traceback.print_exc()
+                summary.append({'run': i, 'status': 'failed',
+                                'time': time.time() - start})
+                continue
+            if result.ndim != 1:
+                result = np.nanmax(np.absolute(result), axis = 1)
+            summary.append({'run': i, 'status': 'done',
+                            'file_name': file_name,
+                            'time': time.time() - start,
+                            'mean': float(np.nanmean(result)),
+                            'std': float(np.nanstd(result, ddof = 1))})
+
+        # wait for the plots made in the background
+        if self._renderer is not None:
+            failed = {file_name for file_name, _ in self._renderer.close()}
+            self._renderer = None
+            for record in summary:
+                if record.get('file_name') in failed:
+                    record['status'] = 'plot failed'
+        return summary
+
+
+if __name__ == "__main__":
+
+    summary = BatchRunner().run_all(load_runs(sys.argv[1]))
+    with open('main_program_results/batch summary.json', 'w') as f:
+        json.dump(summary, f, indent=1)
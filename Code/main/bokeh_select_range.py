@@ -5,11 +5,18 @@ NAME:
 PURPOSE:
     Used to help plot interactive dot product and fractional length projections using Bokeh linked plots.
     This is different from bokeh in main program because we CAN CHOOSE A RANGE
+    For large sets of results, use bokeh_server_select instead, which keeps
+    the results on a local server and only sends decimated points to the
+    browser.
     
 HOW TO USE:
     
 """
 
+import sys
+sys.path.append('..')
+sys.path.append('../check_uniformity_of_density')
+
 import numpy as np
 import astropy.units as unit
 from astropy.coordinates import SkyCoord, CartesianRepresentation, CartesianDifferential
@@ -21,78 +28,10 @@ from bokeh.plotting import figure
 from bokeh.models.annotations import Title
 import matplotlib as mpl
 import pylab as plt
+from tools.plots import color_plot_ij_bokeh, get_axis_from_index, bokeh_source
 plt.ioff() # turn off plots
 
 
-def color_plot_ij_bokeh(source, TOOLS, i, j, all_proj, counter, uniformity_method):
-    """
-    NAME:
-        color_plot_ij
-
-    PURPOSE:
-        Plots in either dot product or fractional length projections
-
-    INPUT:
-        source = dictionary-like data struction in Bokeh to update selected values in real-time
-        TOOLS = list of tools used in bokeh plots
-        i, j = projection axes
-        counter = used to order plots in position/velocity space when outputted
-        uniformity method = dot product/projection, projection refers to fractional length
-
-    OUTPUT:
-        None
-
-    HISTORY:
-        2018-07-30 - Written - Michael Poon
-    """
-    
-    # get axes 
-    x_axis, x_divisor = get_axis_from_index(i)
-    y_axis, y_divisor = get_axis_from_index(j)
-    
-    
-    # create plot    
-    proj = figure(tools=TOOLS, plot_width=350, plot_height=300)
-    proj.scatter('{}'.format(x_axis), '{}'.format(y_axis), color='colours', size=0.5, fill_alpha=1, line_alpha=1, alpha=1, source=source)
-    proj.outline_line_color = None
-    proj.border_fill_color = None
-    proj.xgrid.grid_line_alpha = 0.2
-    proj.ygrid.grid_line_alpha = 0.2
-    color_mapper = LinearColorMapper(palette="Plasma256", low=0, high=1)
-    color_bar = ColorBar(color_mapper=color_mapper, label_standoff=8, width=15, location=(0,0))
-    proj.add_layout(color_bar, 'right')
-    proj.xaxis.axis_label = '{}/{}'.format(x_axis, x_divisor)
-    proj.yaxis.axis_label = '{}/{}'.format(y_axis, y_divisor)
-    proj.background_fill_color = "black"
-    
-    all_proj[counter] = proj
-
-def get_axis_from_index(i):
-    """
-    NAME:
-        get_axis_from_index
-
-    PURPOSE:
-        Since there are 6 dimensions corresponding to x, y, z, vx, vy, vz,
-        this function takes an index from 0 to 5, and output a string
-        corresponding to the appropriate name of axis as well as a string
-        that represents either solar radius or solar velocity, as corresponding
-        to the axis name.
-
-    INPUT:
-        i = an integer from 0 to 5 inclusive
-
-    OUTPUT:
-        (axis_name, divisor)
-
-    HISTORY:
-        2018-07-03 - Written - Samuel Wong
-    """
-    # create an list storing axis name in corresponding position
-    axis = [['x', 'R_0'], ['y', 'R_0'], ['z', 'R_0'], ['vx', 'v_0'],
-            ['vy', 'v_0'], ['vz', 'v_0']]
-    return axis[i]
-
 def color_plot_bokeh(source, TOOLS, uniformity_method):
     """
     NAME:
@@ -125,8 +64,9 @@ def color_plot_bokeh(source, TOOLS, uniformity_method):
             
     # Create frequency histogram
     
+    result = source.data['result']
     if uniformity_method == 'projection':
-        all_proj[15] = figure(tools=TOOLS, plot_width=350, plot_height=300)
+        all_proj[15] = figure(tools=TOOLS, width=350, height=300)
         hist, edges = np.histogram(result, bins='auto', density=True, range=(0,1))
         all_proj[15].quad(top=hist, bottom=0, left=edges[:-1], right=edges[1:])
         all_proj[15].xaxis.axis_label = 'Fractional Length of Projection'
@@ -136,7 +76,7 @@ def color_plot_bokeh(source, TOOLS, uniformity_method):
         all_proj[15].title = t
     
     elif uniformity_method == 'dot product':
-        all_proj[15] = figure(tools=TOOLS, plot_width=350, plot_height=300)
+        all_proj[15] = figure(tools=TOOLS, width=350, height=300)
         hist, edges = np.histogram(result, bins='auto', density=True, range=(0,1))
         all_proj[15].quad(top=hist, bottom=0, left=edges[:-1], right=edges[1:])
         all_proj[15].xaxis.axis_label = 'Maximum Absolute Dot Product'
@@ -169,9 +109,9 @@ def color_plot_bokeh(source, TOOLS, uniformity_method):
     else:
         button = Button(label='Projection Method', button_type='warning', width=350)
         
-    button.callback = CustomJS(args=dict(source=source), 
+    button.js_on_click(CustomJS(args=dict(source=source), 
                                code="""
-                               var inds = source.selected['1d'].indices;
+                               var inds = source.selected.indices;
                                var data = source.data;
                                var selected_dp = 0.;
                                var total_dp = 0.;
@@ -190,7 +130,7 @@ def color_plot_bokeh(source, TOOLS, uniformity_method):
                                    window.alert("No points chosen. Average Result (of all points) = " + (total_dp/data['result'].length).toFixed(2));
                                }
                           
-                               """)
+                               """))
     
     show(gridplot([[all_proj[0],  button,       all_proj[2],  all_proj[6], all_proj[9]], 
                    [all_proj[1],  all_proj[5],  all_proj[3],  all_proj[7], all_proj[10]],
@@ -209,6 +149,7 @@ if __name__ == "__main__":
     uniformity_method = "projection" #projection or dot product
     MIN_VAL=0.
     MAX_VAL=1.
+    MAX_POINTS=None # maximum number of points in the html; None to keep all
     output_file("{}.html".format(uniformity_method))
     data = np.load('projection data.npz')
             
@@ -222,26 +163,16 @@ if __name__ == "__main__":
     # Full range
     cluster = cluster[~np.isnan(result)]
     result = result[~np.isnan(result)]
-    colours = ["#%02x%02x%02x" % (int(r), int(g), int(b)) for r, g, b, _ in 255*mpl.cm.plasma(mpl.colors.Normalize()(result))]
     
     # Filter by a specified range of dot product
-    
-    if MIN_VAL != 0. or MIN_VAL != 1.:
-        cluster = cluster[(MIN_VAL < result) & (result < MAX_VAL)]
-        result_temp = result[(MIN_VAL < result) & (result < MAX_VAL)]
-        
-        # Covert list to array
-        colours = np.array([[colours]])
-        colours = colours.flatten()
-        
-        colours = colours[(MIN_VAL < result) & (result < MAX_VAL)]
-        result = result_temp
-
+    if MIN_VAL != 0. or MAX_VAL != 1.:
+        in_range = (MIN_VAL < result) & (result < MAX_VAL)
+        cluster = cluster[in_range]
+        result = result[in_range]
           
-    # create a column data source for the plots to share
-    result_fixed = result
-    source = ColumnDataSource(data=dict(x=cluster.T[0], y=cluster.T[1], z=cluster.T[2],
-                                        vx=cluster.T[3], vy=cluster.T[4], vz=cluster.T[5], result=result, colours=colours))
+    # create a column data source for the plots to share; at most MAX_POINTS
+    # points are kept, chosen at random stratified by result
+    source = bokeh_source(result, cluster, MAX_POINTS)
 
     #denote interactive tools for linked plots
     TOOLS = "box_select,lasso_select"
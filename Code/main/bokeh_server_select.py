@@ -0,0 +1,319 @@
+"""
+NAME:
+    bokeh_server_select
+
+PURPOSE:
+    Interactive range and lasso selection of the results of the main program,
+    served by a local bokeh server. Unlike bokeh_select_range, which writes
+    every point into a static html file, the results stay in the memory of
+    the server: the range of results shown is chosen with a slider, box and
+    lasso selections in any of the 15 projections are applied to all results
+    with vectorized masks, and only a decimated sample of the points that
+    pass the filters and lie in the zoomed region is sent to the browser. The
+    average and standard deviation shown are always those of all the results
+    that pass the filters, not only of the points drawn.
+
+HOW TO USE:
+    From Code/main:
+
+    python bokeh_server_select.py "projection data.npz" projection [port]
+
+    and open the address printed in a browser. A selection restricts every
+    projection to the selected points; "Reset selection" undoes it.
+"""
+import sys
+sys.path.append('..')
+sys.path.append('../check_uniformity_of_density')
+
+import numpy as np
+from matplotlib.path import Path
+from bokeh.events import SelectionGeometry, RangesUpdate
+from bokeh.layouts import gridplot, column
+from bokeh.models import ColumnDataSource, Button, Div, RangeSlider
+from bokeh.plotting import figure
+from bokeh.server.server import Server
+from tools.plots import color_plot_ij_bokeh, get_axis_from_index, decimate
+
+
+def load_results(file_name, uniformity_method):
+    """
+    NAME:
+        load_results
+
+    PURPOSE:
+        Load the results saved by the main program, keeping the maximum
+        absolute dot product for the dot product method and dropping nan.
+
+    INPUT:
+        file_name = path of the npz file saved by the main program
+        uniformity_method = "projection" or "dot product"
+
+    OUTPUT:
+        (result, cluster)
+    """
+    with np.load(file_name) as data:
+        cluster = data['cluster']
+        result = data['result']
+    if uniformity_method == "dot product":
+        result = np.nanmax(np.absolute(result), axis = 1)
+    good = ~np.isnan(result)
+    return result[good], cluster[good]
+
+
+def geometry_mask(x, y, geometry):
+    """
+    NAME:
+        geometry_mask
+
+    PURPOSE:
+        Find which points lie inside a box or lasso selection.
+
+    INPUT:
+        x, y = arrays of the coordinates of the points in the projection in
+               which the selection was made
+        geometry = geometry of a bokeh SelectionGeometry event
+
+    OUTPUT:
+        boolean array, True for the points inside the selection
+    """
+    if geometry['type'] == 'rect':
+        x0, x1 = sorted([geometry['x0'], geometry['x1']])
+        y0, y1 = sorted([geometry['y0'], geometry['y1']])
+        return (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+    if geometry['type'] == 'poly':
+        vertices = np.column_stack([geometry['x'], geometry['y']])
+        mask = np.zeros(len(x), dtype = bool)
+        # only test the points inside the bounding box of the lasso
+        box = ((x >= vertices[:, 0].min()) & (x <= vertices[:, 0].max()) &
+               (y >= vertices[:, 1].min()) & (y <= vertices[:, 1].max()))
+        mask[box] = Path(vertices).contains_points(
+                np.column_stack([x[box], y[box]]))
+        return mask
+    raise ValueError('unsupported selection {}'.format(geometry['type']))
+
+
+class ResultExplorer:
+    """
+    Class holding the results in memory and serving an interactive view of
+    them to every browser session
+    """
+    def __init__(self, result, cluster, uniformity_method, max_points = 20000):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a ResultExplorer
+
+        INPUT:
+            result = a numpy array storing the result at each cluster center,
+                     without nan
+            cluster = a numpy array storing cluster centers
+            uniformity_method = "projection" or "dot product"
+            max_points = maximum number of points sent to the browser
+
+        OUTPUT:
+            None
+        """
+        self.result = np.asarray(result, dtype = np.float32)
+        self.cluster = np.asarray(cluster, dtype = np.float32)
+        # one contiguous array per axis, for fast masks
+        self.axes = {get_axis_from_index(i)[0]:
+                     np.ascontiguousarray(self.cluster[:, i])
+                     for i in range(6)}
+        self.uniformity_method = uniformity_method
+        self.max_points = max_points
+
+    def visible_data(self, mask):
+        """
+        NAME:
+            visible_data
+
+        PURPOSE:
+            return the data of a decimated sample of the points in the mask
+
+        INPUT:
+            mask = boolean array of the points that pass the filters
+
+        OUTPUT:
+            dictionary of float32 arrays for a ColumnDataSource
+        """
+        index = np.flatnonzero(mask)
+        index = index[decimate(self.result[index], self.max_points,
+                               random_state = 0)]
+        data = {name: axis[index] for name, axis in self.axes.items()}
+        data['result'] = self.result[index]
+        return data
+
+    def summary(self, mask):
+        """
+        NAME:
+            summary
+
+        PURPOSE:
+            describe the results that pass the filters
+
+        INPUT:
+            mask = boolean array of the points that pass the filters
+
+        OUTPUT:
+            html string
+        """
+        n = np.count_nonzero(mask)
+        text = '{} of {} points chosen'.format(n, len(mask))
+        if n > 0:
+            text += ('<br>Average Result = {:.3f}'
+                     '<br>Standard Deviation = {:.3f}').format(
+                             np.mean(self.result[mask], dtype = np.float64),
+                             np.std(self.result[mask], dtype = np.float64))
+        return text
+
+    def make_document(self, doc):
+        """
+        NAME:
+            make_document
+
+        PURPOSE:
+            build the plots and widgets of one browser session and attach the
+            callbacks that filter the results on the server
+
+        INPUT:
+            doc = bokeh Document of the session
+
+        OUTPUT:
+            None
+        """
+        # state of the session: the filters and the zoomed region
+        state = {'low': 0., 'high': 1.,
+                 'selection': np.ones(len(self.result), dtype = bool),
+                 'viewport': None}
+
+        source = ColumnDataSource(data = self.visible_data(state['selection']))
+        histogram = ColumnDataSource(data = {'top': [], 'left': [],
+                                             'right': []})
+        stats = Div(width = 350)
+
+        TOOLS = "box_select,lasso_select,pan,wheel_zoom,reset"
+        all_proj = [None] * 15
+        counter = 0
+        pairs = []
+        for i in range(6):
+            for j in range(i + 1, 6):
+                color_plot_ij_bokeh(source, TOOLS, i, j, all_proj, counter,
+                                    self.uniformity_method)
+                pairs.append((get_axis_from_index(i)[0],
+                              get_axis_from_index(j)[0]))
+                counter += 1
+
+        hist_plot = figure(width = 350, height = 300, tools = "")
+        hist_plot.quad(top = 'top', bottom = 0, left = 'left',
+                       right = 'right', source = histogram)
+        if self.uniformity_method == "dot product":
+            hist_plot.xaxis.axis_label = 'Maximum Absolute Dot Product'
+        else:
+            hist_plot.xaxis.axis_label = 'Fractional Length of Projection'
+        hist_plot.yaxis.axis_label = 'Frequency'
+
+        slider = RangeSlider(start = 0., end = 1., value = (0., 1.),
+                             step = 0.01, title = 'Range of results',
+                             width = 350)
+        reset = Button(label = 'Reset selection', button_type = 'warning',
+                       width = 350)
+
+        def mask():
+            return state['selection'] & (self.result >= state['low']) & \
+                   (self.result <= state['high'])
+
+        def update(refresh_histogram = True):
+            filtered = mask()
+            shown = filtered
+            if state['viewport'] is not None:
+                x_name, y_name, x0, x1, y0, y1 = state['viewport']
+                x, y = self.axes[x_name], self.axes[y_name]
+                shown = filtered & (x >= x0) & (x <= x1) & \
+                        (y >= y0) & (y <= y1)
+            source.data = self.visible_data(shown)
+            source.selected.indices = []
+            if refresh_histogram:
+                stats.text = self.summary(filtered)
+                hist, edges = np.histogram(self.result[filtered], bins = 50,
+                                           range = (0, 1), density = True)
+                histogram.data = {'top': hist, 'left': edges[:-1],
+                                  'right': edges[1:]}
+
+        def on_slider(attr, old, new):
+            state['low'], state['high'] = new
+            update()
+
+        def on_reset():
+            state['selection'][:] = True
+            state['viewport'] = None
+            update()
+
+        def on_geometry(pair):
+            def callback(event):
+                if not event.final:
+                    return
+                x_name, y_name = pair
+                state['selection'] &= geometry_mask(
+                        self.axes[x_name], self.axes[y_name], event.geometry)
+                update()
+            return callback
+
+        def on_ranges(pair):
+            def callback(event):
+                state['viewport'] = pair + (event.x0, event.x1,
+                                            event.y0, event.y1)
+                update(refresh_histogram = False)
+            return callback
+
+        slider.on_change('value_throttled', on_slider)
+        reset.on_click(on_reset)
+        for proj, pair in zip(all_proj, pairs):
+            proj.on_event(SelectionGeometry, on_geometry(pair))
+            proj.on_event(RangesUpdate, on_ranges(pair))
+        update()
+
+        controls = column(slider, reset, stats)
+        doc.add_root(gridplot(
+                [[all_proj[0],  controls,     all_proj[2], all_proj[6], all_proj[9]],
+                 [all_proj[1],  all_proj[5],  all_proj[3], all_proj[7], all_proj[10]],
+                 [all_proj[12], None,         all_proj[4], all_proj[8], all_proj[11]],
+                 [all_proj[13], all_proj[14], hist_plot,   None,        None]]))
+
+
+def serve(file_name, uniformity_method, port = 5006, max_points = 20000):
+    """
+    NAME:
+        serve
+
+    PURPOSE:
+        Load results once and serve them with a local bokeh server until the
+        process is stopped.
+
+    INPUT:
+        file_name = path of the npz file saved by the main program
+        uniformity_method = "projection" or "dot product"
+        port = port of the server
+        max_points = maximum number of points sent to the browser
+
+    OUTPUT:
+        None
+    """
+    result, cluster = load_results(file_name, uniformity_method)
+    explorer = ResultExplorer(result, cluster, uniformity_method, max_points)
+    server = Server({'/': explorer.make_document}, port = port)
+    server.start()
+    print('Serving {} results at http://localhost:{}/'.format(len(result),
+                                                              port))
+    server.io_loop.start()
+
+
+if __name__ == "__main__":
+
+    # User Input
+    file_name = sys.argv[1] if len(sys.argv) > 1 else 'projection data.npz'
+    uniformity_method = sys.argv[2] if len(sys.argv) > 2 else "projection"
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 5006
+
+    serve(file_name, uniformity_method, port)
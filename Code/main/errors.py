@@ -1,29 +1,258 @@
 import os
 import sys
+import json
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import dill
 import numpy as np
-from sklearn.utils import resample
 from sklearn.model_selection import KFold
 from main_program_cluster import get_samples_density_filename, \
     get_Energy_Lz_gradient, evaluate_uniformity, generate_KDE, error_plot, \
-    errorbar_plot
+    errorbar_plot, uniformity_from_gradient, complement_of_pairs
+from kde.weighted_kde import WeightedKDE, bootstrap_weights
+from tools.running_statistics import ReplicateStatistics
 
 _ERASESTR = '\r                                                              \r'
 
+# state of a bootstrap worker process, set once by _initialize_bootstrap_worker
+_worker = {}
+
+
+def _initialize_bootstrap_worker(shm_name, shape, dtype, cluster_centres,
+                                 Energy_gradient, Lz_gradient,
+                                 uniformity_method, selection, band_width):
+    # attach to the samples in shared memory instead of receiving a copy
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm
+    _worker['samples'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker['cluster_centres'] = cluster_centres
+    _worker['Energy_gradient'] = Energy_gradient
+    _worker['Lz_gradient'] = Lz_gradient
+    _worker['uniformity_method'] = uniformity_method
+    # the selection function is often a lambda, which only dill can transfer
+    _worker['selection'] = dill.loads(selection)
+    _worker['band_width'] = band_width
+
+
+def _bootstrap_replicate(task):
+    """
+    NAME:
+        _bootstrap_replicate
+
+    PURPOSE:
+        Evaluate uniformity on one bootstrap resample of the shared samples.
+
+    INPUT:
+        task - (index of the replicate, SeedSequence of the replicate)
+
+    OUTPUT:
+        (index of the replicate, result)
+    """
+    i, seed = task
+    samples = _worker['samples']
+    rng = np.random.default_rng(seed)
+    resampled_data = samples[rng.integers(0, len(samples), len(samples))]
+    density = generate_KDE(resampled_data, 'epanechnikov',
+                           _worker['selection'], _worker['band_width'])
+    result = evaluate_uniformity(density, _worker['cluster_centres'],
+                                 _worker['Energy_gradient'],
+                                 _worker['Lz_gradient'],
+                                 _worker['uniformity_method'])
+    return i, result
+
+
+def weighted_uniformity(kde, cluster_centres, Energy_gradient, Lz_gradient,
+                        uniformity_method, replicates, get_weights,
+                        batch_size=None):
+    """
+    NAME:
+        weighted_uniformity
+
+    PURPOSE:
+        Evaluate uniformity at the cluster centres for many weightings of the
+        samples of a WeightedKDE, a batch of replicates at a time.
+
+    INPUT:
+        kde - WeightedKDE of the samples
+
+        cluster_centres - (m,6) array of cluster centres
+
+        Energy_gradient, Lz_gradient - (m,6) arrays of the gradients of the
+        integrals of motion at the cluster centres
+
+        uniformity_method - 'projection' or 'dot product'
+
+        replicates - array of the indices of the replicates to evaluate
+
+        get_weights - function of an array of replicate indices returning the
+        (N, number of indices) array of the weights of those replicates
+
+        batch_size - number of replicates evaluated in one traversal of the
+        tree; default = all, which needs N*len(replicates) floats of memory
+
+    OUTPUT:
+        generator of (indices of the replicates of a batch, array of their
+        results, each as returned by evaluate_uniformity)
+    """
+    if batch_size is None:
+        batch_size = max(len(replicates), 1)
+    # the orthogonal complements do not depend on the density
+    W = None
+    if uniformity_method == 'dot product':
+        W = complement_of_pairs(Energy_gradient, Lz_gradient)
+    
+    for start in range(0, len(replicates), batch_size):
+        indices = replicates[start:start + batch_size]
+        _, gradient = kde.density_and_gradient(cluster_centres,
+                                               get_weights(indices))
+        yield indices, uniformity_from_gradient(
+                gradient, Energy_gradient, Lz_gradient, uniformity_method, W)
+
+
+def _resample_replicates(samples, tasks, cluster_centres, Energy_gradient,
+                         Lz_gradient, uniformity_method, selection, band_width,
+                         n_workers):
+    """
+    NAME:
+        _resample_replicates
+
+    PURPOSE:
+        Evaluate uniformity on bootstrap resamples in a pool of processes
+        sharing the samples.
+
+    INPUT:
+        samples - (N,6) array of samples in natural units
+
+        tasks - list of (index of the replicate, SeedSequence of the
+        replicate)
+
+        cluster_centres, Energy_gradient, Lz_gradient, uniformity_method,
+        selection, band_width, n_workers - see bootstrap
+
+    OUTPUT:
+        generator of (index of a replicate, its result), in the order in which
+        the replicates are done
+    """
+    # put the samples in shared memory, where every worker reads them
+    samples = np.ascontiguousarray(samples, dtype=float)
+    shm = shared_memory.SharedMemory(create=True, size=samples.nbytes)
+    try:
+        np.ndarray(samples.shape, dtype=samples.dtype, buffer=shm.buf)[:] = \
+            samples
+        context = multiprocessing.get_context('spawn')
+        initargs = (shm.name, samples.shape, samples.dtype, cluster_centres,
+                    Energy_gradient, Lz_gradient, uniformity_method,
+                    dill.dumps(selection), band_width)
+        
+        sys.stdout.write('\n')
+        with context.Pool(n_workers, _initialize_bootstrap_worker,
+                          initargs) as pool:
+            # hand each replicate on as soon as it is done
+            for done, (i, result) in enumerate(pool.imap_unordered(
+                    _bootstrap_replicate, tasks)):
+                sys.stdout.write(_ERASESTR)
+                sys.stdout.write('Evaluated uniformity on {} of {} samples'
+                                 .format(done + 1, len(tasks)))
+                yield i, result
+        sys.stdout.write('\nDone\n')
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _uncertainty_folder(folder, method_folder, nsamples):
+    # make the folder main_program_results/folder/uncertainties/method_folder/
+    # nsamples samples/ and return its path relative to main_program_results
+    folder += 'uncertainties/' + method_folder + '{} samples/'.format(nsamples)
+    if not os.path.exists('main_program_results/' + folder):
+        os.makedirs('main_program_results/' + folder)
+    return folder
+
+
+def _replicate_values(result, uniformity_method):
+    # the max dot products of the original run of the main program are not
+    # necessarily at the same index in the resampled runs, and thus their
+    # uncertainties must be calculated separately from the uncertainties in
+    # each individual dot product
+    values = {'result': result}
+    if uniformity_method == 'dot product':
+        values['max_dot_product'] = np.nanmax(np.abs(result), axis=-1)
+    # the mean projection, or mean max dot product, over the cluster centres
+    values['summary'] = np.nanmean(values.get('max_dot_product', result),
+                                   axis=-1)
+    return values
+
+
+def _convergence(replicates, uniformity_method, elapsed):
+    """
+    NAME:
+        _convergence
+
+    PURPOSE:
+        Describe how well the uncertainties of a bootstrap are determined by
+        the replicates done so far.
+
+    INPUT:
+        replicates - ReplicateStatistics of the bootstrap
+
+        uniformity_method - 'projection' or 'dot product'
+
+        elapsed - time since the start of the bootstrap, in seconds
+
+    OUTPUT:
+        dictionary with the number of replicates, the elapsed time, the median
+        over the cluster centres of the relative standard error of their
+        uncertainty (of the max dot product for the dot product method), and
+        the mean over the replicates of the summary, its uncertainty and the
+        relative standard error of that uncertainty
+    """
+    centres = replicates['max_dot_product' if uniformity_method ==
+                         'dot product' else 'result']
+    summary = replicates['summary']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = centres.std_error()/centres.std()
+    return {'replicates': int(np.sum(replicates.done)),
+            'time': elapsed,
+            'centre relative error': float(np.nanmedian(relative))
+                                     if np.any(~np.isnan(relative))
+                                     else np.nan,
+            'summary': float(summary.mean),
+            'summary uncertainty': float(summary.std()),
+            'summary relative error': float(summary.std_error()/
+                                            summary.std())}
+
 
 def bootstrap(nsamples=10, uniformity_method='projection', 
               gradient_method='analytic', search_method='local', 
-              custom_samples=None, custom_potential=None):
+              custom_samples=None, custom_potential=None, selection=None,
+              band_width=10, file_name=None, epsilon=None, v_scale=None,
+              search_star=None, n_workers=None, random_state=None,
+              method='resample', weighting='multinomial', batch_size=None,
+              checkpoint_every=1, resume=True, keep_centres=None,
+              tolerance=None, min_samples=10, max_time=None):
     """
     NAME:
         bootstrap
         
     PURPOSE:
         Run a bootstrap uncertainty analysis on the results of a run of the main
-        program.
+        program. With the resample method, the replicates are spread over a
+        pool of processes that share one copy of the samples; each replicate
+        draws its resample from its own random stream, so that the results do
+        not depend on the number of processes. With the weighted method, a
+        resample is represented by the multiplicity of every star, and all
+        replicates are evaluated with one tree built on the original samples,
+        with the scaling and bandwidth of the original KDE. With a tolerance,
+        the bootstrap stops as soon as the relative standard error of the
+        uncertainties, at the median cluster centre and of the mean result
+        over the cluster centres, is below the tolerance, estimated from the
+        fourth moments of the replicates; the convergence after every
+        replicate (or batch) is saved in convergence.json.
         
     INPUT:
         nsamples - number of random samples to generate on which to re-run the
-        main program; default = 10
+        main program, or their maximum number with a tolerance; default = 10
         
         uniformity_method - 'projection' or 'dot product', referring to how
         uniformity of density is evaluated; default = projection
@@ -41,6 +270,43 @@ def bootstrap(nsamples=10, uniformity_method='projection',
         
         custom_potential - galpy Potential or list of Potentials used to 
         evaluate energy; default = MWPotential2014
+        
+        selection, band_width - selection function and bandwidth multiplier of
+        the KDE, as given to the main program
+        
+        file_name, epsilon, v_scale, search_star - name of the results of
+        custom samples and parameters of the search, as given to the main
+        program; the user is prompted for any of them that is needed and None
+        
+        n_workers - number of processes; default = number of CPUs
+        
+        random_state - seed of the resampling; None for a random seed
+        
+        method - 'resample' to refit a KDE on every resample, or 'weighted'
+        
+        weighting - for the weighted method, 'multinomial' (same as
+        resampling) or 'poisson' multiplicities
+        
+        batch_size - for the weighted method, number of replicates evaluated
+        together; default = all, or min_samples with a tolerance
+        
+        checkpoint_every - number of replicates between two checkpoints of
+        the running mean and variance of the results in replicates.npz; the
+        weighted method checkpoints at most once per batch
+        
+        resume - if True, continue from the checkpoint of a stopped run with
+        the same settings instead of starting over
+        
+        keep_centres - indices of the cluster centres whose result in every
+        replicate is saved in replicates.npz; default = none
+        
+        tolerance - relative standard error of the uncertainties at which to
+        stop; default = None, to do all nsamples replicates
+        
+        min_samples - number of replicates done before stopping is considered
+        
+        max_time - time, in seconds, after which this call stops starting
+        replicates; default = None, for no limit
                             
     OUTPUT:
         None (results are saved to a file)
@@ -51,7 +317,8 @@ def bootstrap(nsamples=10, uniformity_method='projection',
         function.
     """
     samples, density, folder = get_samples_density_filename(
-            None, search_method, custom_samples, uniformity_method)
+            None, search_method, custom_samples, uniformity_method, selection,
+            band_width, file_name, None, epsilon, v_scale, search_star)
     
     data_file = 'data.npz'
     if uniformity_method == 'projection':
@@ -64,42 +331,81 @@ def bootstrap(nsamples=10, uniformity_method='projection',
     Energy_gradient, Lz_gradient = get_Energy_Lz_gradient(
             cluster_centres, gradient_method, custom_potential)
     
-    results = []
-    sys.stdout.write('\n')
-    for i in range(nsamples):
-        sys.stdout.write(_ERASESTR)
-        sys.stdout.write('Evaluating uniformity on sample {}...'.format(i+1))
-        resampled_data = resample(samples)
-        density = generate_KDE(resampled_data, 'epanechnikov')
-        result = evaluate_uniformity(density, cluster_centres, Energy_gradient,
-                                     Lz_gradient, uniformity_method)
-        results.append(result)
-    sys.stdout.write('\nDone\n')
+    if method not in ['resample', 'weighted']:
+        raise ValueError("method must be 'resample' or 'weighted'")
     
-    results = np.stack(results)
-    errors = np.nanstd(results, axis=0)
+    folder = _uncertainty_folder(
+            folder, 'bootstrap/' if method == 'resample' else
+            'weighted bootstrap/', nsamples)
     
-    folder += 'uncertainties/'
-    if not os.path.exists('main_program_results/' + folder):
-        os.mkdir('main_program_results/' + folder)
-        
-    folder += 'bootstrap/'
-    if not os.path.exists('main_program_results/' + folder):
-        os.mkdir('main_program_results/' + folder)
-        
-    folder += '{} samples/'.format(nsamples)
-    if not os.path.exists('main_program_results/' + folder):
-        os.mkdir('main_program_results/' + folder)
+    # the mean and variance of the replicates are accumulated as they are
+    # done and checkpointed, so that a stopped run resumes where it stopped
+    settings = {'method': method, 'uniformity_method': uniformity_method,
+                'band_width': band_width}
+    if method == 'weighted':
+        settings['weighting'] = weighting
+    replicates = ReplicateStatistics(
+            'main_program_results/' + folder + 'replicates.npz', nsamples,
+            settings, random_state, keep_centres, checkpoint_every, resume)
+    seeds = np.random.SeedSequence(replicates.seed).spawn(nsamples)
+    remaining = replicates.remaining()
+    start = time.time()
+    
+    def stop():
+        # record the convergence and decide whether the uncertainties are
+        # known well enough, or the time is up
+        done = np.sum(replicates.done)
+        if done < 2:
+            return False
+        record = _convergence(replicates, uniformity_method,
+                              time.time() - start)
+        replicates.trace.append(record)
+        if (tolerance is not None and done >= min_samples and
+                max(record['centre relative error'],
+                    record['summary relative error']) < tolerance):
+            sys.stdout.write('\nConverged after {} samples\n'.format(done))
+            return True
+        return max_time is not None and time.time() - start > max_time
+    
+    if len(remaining) > 0 and method == 'weighted':
+        if batch_size is None and tolerance is not None:
+            batch_size = min_samples
+        kde = WeightedKDE(samples, selection, band_width)
+        batches = weighted_uniformity(
+                kde, cluster_centres, Energy_gradient, Lz_gradient,
+                uniformity_method, remaining,
+                lambda indices: bootstrap_weights(
+                        len(samples), [seeds[i] for i in indices], weighting),
+                batch_size)
+        for indices, results in batches:
+            replicates.add_batch(indices,
+                                 **_replicate_values(results,
+                                                     uniformity_method))
+            if stop():
+                break
+        batches.close()
+    elif len(remaining) > 0:
+        # stopping early closes the pool, abandoning the replicates under way
+        replicate_results = _resample_replicates(
+                samples, [(i, seeds[i]) for i in remaining], cluster_centres,
+                Energy_gradient, Lz_gradient, uniformity_method, selection,
+                band_width, n_workers)
+        for i, result in replicate_results:
+            replicates.add(i, **_replicate_values(result, uniformity_method))
+            if stop():
+                break
+        replicate_results.close()
+    replicates.save()
     
+    with open('main_program_results/' + folder + 'convergence.json',
+              'w') as f:
+        json.dump(replicates.trace, f, indent=1)
+    
+    errors = replicates['result'].std()
     np.save('main_program_results/' + folder + 'uncertainties', errors)
     
-    # the max dot products of the original run of the main program are not
-    # necessarily at the same index in the resampled runs, and thus their
-    # uncertainties must be calculated separately from the uncertainties in each
-    # individual dot product
     if uniformity_method == 'dot product':
-        results = np.nanmax(np.abs(results), axis=2)
-        errors = np.nanstd(results, axis=0)
+        errors = replicates['max_dot_product'].std()
         np.save('main_program_results/' + folder + 
                 'max_dot_product_uncertainties', errors)
         
@@ -109,16 +415,62 @@ def bootstrap(nsamples=10, uniformity_method='projection',
                   custom_potential, errors)
     
     
+def _refit_folds(samples, split_indices, folds, cluster_centres,
+                 Energy_gradient, Lz_gradient, uniformity_method, selection,
+                 band_width):
+    """
+    NAME:
+        _refit_folds
+
+    PURPOSE:
+        Evaluate uniformity with a KDE fitted on each leave-one-fold-out
+        sample.
+
+    INPUT:
+        samples - (N,6) array of samples in natural units
+
+        split_indices - list of the indices of the samples kept in each
+        leave-one-fold-out sample
+
+        folds - indices of the leave-one-fold-out samples to evaluate
+
+        cluster_centres, Energy_gradient, Lz_gradient, uniformity_method,
+        selection, band_width - see jackknife
+
+    OUTPUT:
+        generator of (index of a leave-one-fold-out sample, its result)
+    """
+    sys.stdout.write('\n')
+    for i in folds:
+        sys.stdout.write(_ERASESTR)
+        sys.stdout.write('Evaluating uniformity on sample {}...'.format(i+1))
+        split = split_indices[i]
+        density = generate_KDE(samples[split], 'epanechnikov', selection,
+                               band_width)
+        result = evaluate_uniformity(density, cluster_centres, Energy_gradient,
+                                     Lz_gradient, uniformity_method)
+        yield i, result
+    sys.stdout.write('\nDone\n')
+
+
 def jackknife(nsamples=10, uniformity_method='projection', 
               gradient_method='analytic', search_method='local', 
-              custom_samples=None, custom_potential=None):
+              custom_samples=None, custom_potential=None, selection=None,
+              band_width=10, file_name=None, epsilon=None, v_scale=None,
+              search_star=None, method='refit', random_state=None,
+              checkpoint_every=1, resume=True, keep_centres=None):
     """
     NAME:
         jackknife
         
     PURPOSE:
         Run a jackknife uncertainty analysis on the results of a run of the main
-        program.
+        program. With the refit method, a KDE is fitted on every
+        leave-one-fold-out sample. With the subtract method, the kernel sums
+        of every fold are computed once, with the scaling and bandwidth of the
+        KDE of all samples, and each leave-one-fold-out density and gradient
+        is the total minus the fold, which costs about as much as a single
+        evaluation.
         
     INPUT:
         nsamples - number of groups in which to divide the data and on which to 
@@ -140,6 +492,21 @@ def jackknife(nsamples=10, uniformity_method='projection',
         
         custom_potential - galpy Potential or list of Potentials used to 
         evaluate energy; default = MWPotential2014
+        
+        selection, band_width - selection function and bandwidth multiplier of
+        the KDE, as given to the main program
+        
+        file_name, epsilon, v_scale, search_star - name of the results of
+        custom samples and parameters of the search, as given to the main
+        program; the user is prompted for any of them that is needed and None
+        
+        method - 'refit' or 'subtract'
+        
+        random_state - seed of the split into folds, smaller than 2**32; None
+        for a random seed
+        
+        checkpoint_every, resume, keep_centres - checkpointing of the running
+        statistics of the folds, as for bootstrap
                             
     OUTPUT:
         None (results are saved to a file)
@@ -150,7 +517,8 @@ def jackknife(nsamples=10, uniformity_method='projection',
         function.
     """
     samples, density, folder = get_samples_density_filename(
-            None, search_method, custom_samples, uniformity_method)
+            None, search_method, custom_samples, uniformity_method, selection,
+            band_width, file_name, None, epsilon, v_scale, search_star)
     
     data_file = 'data.npz'
     if uniformity_method == 'projection':
@@ -163,51 +531,58 @@ def jackknife(nsamples=10, uniformity_method='projection',
     Energy_gradient, Lz_gradient = get_Energy_Lz_gradient(
             cluster_centres, gradient_method, custom_potential)
     
-    # split the data into nsamples non-overlapping splits, each of which contain
-    # (len(samples) - len(samples) / nsamples) points
-    kf = KFold(n_splits=nsamples, shuffle=True)
-    splits = kf.split(samples)
-    split_indices = [indices for indices, _ in splits]
+    if method not in ['refit', 'subtract']:
+        raise ValueError("method must be 'refit' or 'subtract'")
     
-    results = []
-    sys.stdout.write('\n')
-    for i in range(len(split_indices)):
-        sys.stdout.write(_ERASESTR)
-        sys.stdout.write('Evaluating uniformity on sample {}...'.format(i+1))
-        split = split_indices[i]
-        density = generate_KDE(samples[split], 'epanechnikov')
-        result = evaluate_uniformity(density, cluster_centres, Energy_gradient,
-                                     Lz_gradient, uniformity_method)
-        results.append(result)
-    sys.stdout.write('\nDone\n')
+    folder = _uncertainty_folder(
+            folder, 'jackknife/' if method == 'refit' else
+            'subtracted jackknife/', nsamples)
     
-    results = np.stack(results)
-    var = np.sum((results-original_result)**2, axis=0)*(nsamples-1)/nsamples
-    errors = np.sqrt(var)
+    replicates = ReplicateStatistics(
+            'main_program_results/' + folder + 'replicates.npz', nsamples,
+            {'method': method, 'uniformity_method': uniformity_method,
+             'band_width': band_width},
+            random_state, keep_centres, checkpoint_every, resume)
+    remaining = replicates.remaining()
     
-    folder += 'uncertainties/'
-    if not os.path.exists('main_program_results/' + folder):
-        os.mkdir('main_program_results/' + folder)
-        
-    folder += 'jackknife/'
-    if not os.path.exists('main_program_results/' + folder):
-        os.mkdir('main_program_results/' + folder)
-        
-    folder += '{} samples/'.format(nsamples)
-    if not os.path.exists('main_program_results/' + folder):
-        os.mkdir('main_program_results/' + folder)
+    # split the data into nsamples non-overlapping splits, each of which contain
+    # (len(samples) - len(samples) / nsamples) points; the seed of a resumed
+    # run is that of its checkpoint, so that the folds are the same
+    kf = KFold(n_splits=nsamples, shuffle=True,
+               random_state=replicates.seed % 2**32)
+    splits = list(kf.split(samples))
+    split_indices = [indices for indices, _ in splits]
+    
+    if len(remaining) > 0 and method == 'subtract':
+        folds = np.empty(len(samples), dtype=int)
+        for i, (_, fold) in enumerate(splits):
+            folds[fold] = i
+        kde = WeightedKDE(samples, selection, band_width)
+        _, gradient = kde.leave_one_fold_out(cluster_centres, folds)
+        results = uniformity_from_gradient(gradient, Energy_gradient,
+                                           Lz_gradient, uniformity_method)
+        replicates.add_batch(remaining,
+                             **_replicate_values(results[remaining],
+                                                 uniformity_method))
+    elif len(remaining) > 0:
+        for i, result in _refit_folds(samples, split_indices, remaining,
+                                      cluster_centres, Energy_gradient,
+                                      Lz_gradient, uniformity_method,
+                                      selection, band_width):
+            replicates.add(i, **_replicate_values(result, uniformity_method))
+    replicates.save()
     
+    # as np.sum over the folds, the variance is nan where any fold is nan
+    statistics = replicates['result']
+    var = statistics.sum_of_squares(original_result)*(nsamples-1)/nsamples
+    errors = np.where(statistics.count == nsamples, np.sqrt(var), np.nan)
     np.save('main_program_results/' + folder + 'uncertainties', errors)
     
-    # the max dot products of the original run of the main program are not
-    # necessarily at the same index in the resampled runs, and thus their
-    # uncertainties must be calculated separately from the uncertainties in each
-    # individual dot product
     if uniformity_method == 'dot product':
-        results = np.nanmax(np.abs(results), axis=2)
+        statistics = replicates['max_dot_product']
         original_result = np.nanmax(np.abs(original_result), axis=1)
-        var = np.sum((results-original_result)**2, axis=0)*(nsamples-1)/nsamples
-        errors = np.sqrt(var)
+        var = statistics.sum_of_squares(original_result)*(nsamples-1)/nsamples
+        errors = np.where(statistics.count == nsamples, np.sqrt(var), np.nan)
         np.save('main_program_results/' + folder + 
                 'max_dot_product_uncertainties', errors)
         
@@ -215,4 +590,3 @@ def jackknife(nsamples=10, uniformity_method='projection',
                custom_potential)
     errorbar_plot(original_result, cluster_centres, folder, uniformity_method,
                   custom_potential, errors)
-    
\ No newline at end of file
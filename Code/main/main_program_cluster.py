@@ -31,13 +31,17 @@ from kde.kde_function import *
 from kmeans.kmeans import *
 from tools.tools import *
 from tools.plots import *
+from tools.profiling import Profiler
+from render import save_render_inputs, render, Renderer
 
 # create a subfolder to save results
 if not os.path.exists('main_program_results'):
     os.mkdir('main_program_results')
 
 
-def search_for_samples(search_method, band_width):
+def search_for_samples(search_method, band_width, epsilon = None,
+                       v_scale = None, point_galactocentric = None,
+                       profiler = None):
     """
     NAME:
         search_for_samples
@@ -50,6 +54,15 @@ def search_for_samples(search_method, band_width):
     INPUT:
         search_method = a string that is either "online", "local", or
                         "all of local"
+        band_width = multiplier of the bandwidth of the KDE, recorded in the
+                     file name
+        epsilon, v_scale = radius and velocity scale of the search; the user
+                           is prompted for any of them that is None
+        point_galactocentric = the search star, in galactocentric Cartesian
+                               coordinates with physical units; the user is 
+                               prompted for it if None
+        profiler = a Profiler recording the cost of loading and searching the
+                   catalogue; None to record nothing
     OUTPUT:
         samples = a numpy arrays containing 6 dimensional coordinates in
                   galactocentric Cartesian form with physical units
@@ -60,18 +73,57 @@ def search_for_samples(search_method, band_width):
         2018-06-25 - Written - Samuel Wong
     """
     if search_method != "all of local":
-        epsilon = float(input("epsilon = "))
-        v_scale = float(input("v_scale = "))
-        point_galactocentric, point_galactic = get_star_coord_from_user()
+        if epsilon is None:
+            epsilon = float(input("epsilon = "))
+        if v_scale is None:
+            v_scale = float(input("v_scale = "))
+        if point_galactocentric is None:
+            point_galactocentric, point_galactic = get_star_coord_from_user()
+        else:
+            point_galactocentric = np.asarray(point_galactocentric, dtype=float)
+            point_galactic = galactocentric_to_galactic(point_galactocentric)
+    if profiler is None:
+        profiler = Profiler(enabled = False)
     
-    if search_method == "online":
-        samples = search_online.search_phase_space(*point_galactic, epsilon, v_scale)
-    elif search_method == "local":
-        samples = search_local.search_phase_space(*point_galactic, epsilon, v_scale)
-    elif search_method == "all of local":
-        samples = search_local.get_entire_catalogue()
+    # load the local catalogue separately so that its cost is recorded apart
+    # from the search
+    if search_method != "online" and not search_local.gaiarv_loaded():
+        with profiler.stage('load'):
+            search_local.load_gaiarv()
+    
+    with profiler.stage('search'):
+        if search_method == "online":
+            samples = search_online.search_phase_space(*point_galactic, epsilon, v_scale)
+        elif search_method == "local":
+            samples = search_local.search_phase_space(*point_galactic, epsilon, v_scale)
+        elif search_method == "all of local":
+            samples = search_local.get_entire_catalogue()
     print('Found a sample of {} of stars,'.format(np.shape(samples)[0]))
     
+    if search_method == "all of local":
+        file_name = search_file_name(search_method)
+    else:
+        file_name = search_file_name(search_method, band_width, epsilon,
+                                     v_scale, point_galactocentric)
+    return samples, file_name
+
+
+def search_file_name(search_method, band_width = None, epsilon = None,
+                     v_scale = None, point_galactocentric = None):
+    """
+    NAME:
+        search_file_name
+    PURPOSE:
+        Generate the name under which the results of a search are saved.
+    INPUT:
+        search_method = one of "online", "local", "all of local"
+        band_width, epsilon, v_scale, point_galactocentric = parameters of the
+            KDE and the search, as in search_for_samples; not used if
+            search_method is "all of local"
+    OUTPUT:
+        file_name = a string that records the epsilon, v_scale, and search star
+                    or the fact that all of Gaia catalogue was used
+    """
     # create file name if a search was performed
     # if user is using all of catalogue, record this fact and epsilon and
     # v_scale in file name
@@ -84,11 +136,46 @@ def search_for_samples(search_method, band_width):
                      ).format(epsilon, v_scale, band_width, *point_galactocentric)
     # remove any line with \n in the title
     file_name = file_name.replace('\n','')
-    return samples, file_name
+    return file_name
+
+
+def make_result_folder(file_name, selection, uniformity_method):
+    """
+    NAME:
+        make_result_folder
+    PURPOSE:
+        Given the name of a run, create the sub-folders of main_program_results
+        in which its results are saved, and return their path.
+    INPUT:
+        file_name = a string representing the initial values for search, or
+                    user provided if no search was done
+        selection = the selection function, or None; its presence is recorded
+                    in the folder name
+        uniformity_method = "projection" or "dot product"
+    OUTPUT:
+        file_name = path of the folder relative to main_program_results,
+                    ending with the uniformity method and a slash
+    """
+    # add presence of selection in filename
+    if selection is not None:
+        file_name = '(with selection) ' + file_name
+    # create a sub-folder to save results wihout further specification of 
+    # uniformity method
+    if not os.path.exists('main_program_results/'+file_name):
+        os.mkdir('main_program_results/' + file_name)
+    # add uniformity sub folder to file name
+    file_name = file_name + '/' + uniformity_method + '/'
+    # add a directory a level deeper
+    if not os.path.exists('main_program_results/'+file_name):
+        os.mkdir('main_program_results/' + file_name)
+    return file_name
 
 
 def get_samples_density_filename(custom_density, search_method, custom_samples,
-                                 uniformity_method, selection, band_width):
+                                 uniformity_method, selection, band_width,
+                                 file_name = None, density_name = None,
+                                 epsilon = None, v_scale = None,
+                                 search_star = None, profiler = None):
     """
     NAME:
         get_samples_density_filename
@@ -110,6 +197,15 @@ def get_samples_density_filename(custom_density, search_method, custom_samples,
         selection = a selection function that takes parallax to Sun and returns
                     fraction of stars that are left after selection;
                     takes array; takes parallax in physical units
+        band_width = multiplier of the bandwidth of the KDE
+        file_name = name of the results of custom samples; the user is
+                    prompted for it if None
+        density_name = name of the custom density; the user is prompted for it
+                       if None
+        epsilon, v_scale, search_star = parameters of the search; the user is
+                                        prompted for any of them that is None
+        profiler = a Profiler recording the cost of each step; None to record
+                   nothing
     OUTPUT:
         samples = either custom or searched
         density = density function, either custom or generated by KDE
@@ -118,49 +214,50 @@ def get_samples_density_filename(custom_density, search_method, custom_samples,
     HISTORY:
         2018-06-25 - Written - Samuel Wong
     """   
+    if profiler is None:
+        profiler = Profiler(enabled = False)
     # use custom samples or search for samples in Gaia
     if custom_samples is not None:
-        file_name = input('Name of file to be saved: ')
+        if file_name is None:
+            file_name = input('Name of file to be saved: ')
         samples = custom_samples
     else:
-        samples, file_name = search_for_samples(search_method, band_width) 
+        samples, file_name = search_for_samples(search_method, band_width,
+                                                epsilon, v_scale, search_star,
+                                                profiler)
         
     # at this point, everything should have physical units
     # turn all data to natrual units; working with natural unit, galactocentric,
     # cartesian from this point on
-    samples = to_natural_units(samples)
+    with profiler.stage('unit conversion'):
+        samples = to_natural_units(samples)
         
     # use a custom density or generate a density using a KDE
     if custom_density is not None:
         density = custom_density
-        name_of_density = input('Name of custom density function: ')
-        file_name = name_of_density + ' ' + file_name
+        if density_name is None:
+            density_name = input('Name of custom density function: ')
+        file_name = density_name + ' ' + file_name
     else:
-        density = generate_KDE(samples, 'epanechnikov', selection, band_width)
+        with profiler.stage('KDE fit'):
+            density = generate_KDE(samples, 'epanechnikov', selection,
+                                   band_width)
     
-    # add presence of selection in filename
-    if selection is not None:
-        file_name = '(with selection) ' + file_name
-    # create a sub-folder to save results wihout further specification of 
-    # uniformity method
-    if not os.path.exists('main_program_results/'+file_name):
-        os.mkdir('main_program_results/' + file_name)
-    # add uniformity sub folder to file name
-    file_name = file_name + '/' + uniformity_method + '/'
-    # add a directory a level deeper
-    if not os.path.exists('main_program_results/'+file_name):
-        os.mkdir('main_program_results/' + file_name)
+    file_name = make_result_folder(file_name, selection, uniformity_method)
         
     return samples, density, file_name
 
 
-def get_cluster(samples, custom_centres):
+def get_cluster(samples, custom_centres, use_cache = True, random_state = None):
     """
     NAME:
         get_cluster
     PURPOSE:
         Given a sample, use kmeans minibatch to find some cluster centers that
-        are a good representative of the samples.
+        are a good representative of the samples. Unless told otherwise, the
+        cluster centres are looked up in a cache keyed by the samples and the
+        clustering parameters, so that repeated runs on the same samples skip
+        the clustering.
     INPUT:
         samples = a numpy arrays containing 6 dimensional coordinates in
                   galactocentric Cartesian form with natural units
@@ -168,6 +265,9 @@ def get_cluster(samples, custom_centres):
         custom_centres = a custom array of cluster centres at which to evaluate
                  uniformity; if None, will use kmeans clustering to get
                  the cluster centres
+        use_cache = if True, reuse cluster centres computed on a previous run
+                    with the same samples and clustering parameters
+        random_state = seed of kmeans; None for a random initialization
     OUTPUT:
         cluster = a numpy arrays containing 6 dimensional coordinates in
                   galactocentric Cartesian form with natural units; a smal but 
@@ -183,14 +283,19 @@ def get_cluster(samples, custom_centres):
         # let the number of cluster centers to be 0.1% of number of samples
         cluster_number = int(0.001 * np.shape(samples)[0])
         # use kmenas to generate a cluster of points
-        cluster = kmeans(samples, cluster_number, batch_size)
+        if use_cache:
+            cluster = kmeans_cached(samples, cluster_number, batch_size,
+                                    random_state, 'main_program_results/'
+                                    'kmeans_cache')
+        else:
+            cluster = kmeans(samples, cluster_number, batch_size, random_state)
     return cluster
 
 
 def get_Energy_Lz_gradient(cluster, gradient_method, custom_potential):
     if gradient_method == "analytic":
-        Energy_gradient = del_E(cluster, custom_potential)
-        Lz_gradient = del_Lz(cluster)
+        _, _, Energy_gradient, Lz_gradient = integrals_and_gradients(
+                cluster, custom_potential)
     elif gradient_method == "numeric":
         Energy_gradient = grad_multi(
                 lambda coord: Energy(coord, custom_potential), cluster)
@@ -218,10 +323,144 @@ def summary_save(result, cluster, file_name, uniformity_method):
                  cluster = cluster, result = result)
 
 
+def plot_results(samples, cluster, result, file_name, uniformity_method,
+                 custom_potential = None, plot = "inline", renderer = None,
+                 profiler = None, rasterize = False, max_bokeh_points = None):
+    """
+    NAME:
+        plot_results
+    PURPOSE:
+        Make the plots of a run, in this process, in background processes or
+        later with render.py.
+    INPUT:
+        samples = samples in natural units
+        cluster = cluster centres in natural units
+        result = result of the uniformity evaluation at each cluster centre
+        file_name = folder in main_program_results in which to save results
+        uniformity_method = "projection" or "dot product"
+        custom_potential, plot, rasterize, max_bokeh_points = see main
+        renderer = a Renderer to which the plots are submitted when plot is
+                   "background"; if None, a pool is started for this run and
+                   waited for
+        profiler = a Profiler recording the cost of each plot
+    OUTPUT:
+        None
+    """
+    if profiler is None:
+        profiler = Profiler(enabled = False)
+    
+    if plot == "inline":
+        with profiler.stage('kmeans plot'):
+            kmeans_plot(samples, cluster, file_name, rasterize)
+        with profiler.stage('color plot'):
+            color_plot(result, cluster, file_name, uniformity_method,
+                       custom_potential, rasterize)
+        with profiler.stage('bokeh plot'):
+            color_plot_bokeh(result, cluster, file_name, uniformity_method,
+                             max_points = max_bokeh_points)
+        with profiler.stage('errorbar plot'):
+            errorbar_plot(result, cluster, file_name, uniformity_method, 
+                          custom_potential)
+    elif plot in ("background", "defer"):
+        with profiler.stage('save render inputs'):
+            save_render_inputs(samples, cluster, result, file_name,
+                               uniformity_method, custom_potential, rasterize,
+                               max_bokeh_points)
+        if plot == "defer":
+            print('Plots deferred; make them with: python render.py "{}"'
+                  .format(file_name))
+        elif renderer is not None:
+            renderer.submit(file_name)
+        else:
+            with profiler.stage('render'):
+                render([file_name])
+    elif plot is not None:
+        raise ValueError('plot must be "inline", "background", "defer" or '
+                         'None')
+
+
+def evaluate_save_plot(samples, density, file_name, uniformity_method,
+                       gradient_method, custom_centres = None,
+                       custom_potential = None, cache_centres = True,
+                       kmeans_seed = None, profiler = None, plot = "inline",
+                       renderer = None, rasterize = False,
+                       max_bokeh_points = None, extra_integrals = None):
+    """
+    NAME:
+        evaluate_save_plot
+    PURPOSE:
+        Given samples and their density, find the cluster centres, evaluate
+        uniformity of the density at them, save the result and plot it. This
+        is everything main does after getting the samples and density.
+    INPUT:
+        samples = samples in natural units
+        density = density function of 6 dimensional coordinates in natural
+                  units
+        file_name = folder in main_program_results in which to save results
+        uniformity_method = "projection" or "dot product"
+        gradient_method = "analytic" or "numeric"
+        custom_centres, custom_potential, cache_centres, kmeans_seed, plot,
+            rasterize, max_bokeh_points, extra_integrals = see main
+        profiler = a Profiler recording the cost of each step; its report is
+                   saved next to the results; None to record nothing
+        renderer = a Renderer to which the plots are submitted when plot is
+                   "background"; if None, a pool is started for this run and
+                   waited for
+    OUTPUT:
+        (cluster, result)
+    """
+    if profiler is None:
+        profiler = Profiler(enabled = False)
+    
+    if custom_centres is not None:
+        cluster = custom_centres
+    else:
+        with profiler.stage('clustering'):
+            cluster = get_cluster(samples, None, cache_centres, kmeans_seed)
+    
+    if extra_integrals and uniformity_method != "projection":
+        raise ValueError('extra integrals need the projection method')
+    
+    with profiler.stage('gradients'):
+        Energy_gradient, Lz_gradient = get_Energy_Lz_gradient(
+                cluster, gradient_method, custom_potential)
+        if extra_integrals:
+            integral_gradients = np.stack(
+                    [Energy_gradient, Lz_gradient] +
+                    [integral.gradient(cluster)
+                     for integral in extra_integrals], axis = 1)
+        
+    start = time_class.time()
+    with profiler.stage('uniformity'):
+        if extra_integrals:
+            result = evaluate_uniformity_integrals(
+                    profiler.count('density', density), cluster,
+                    integral_gradients)
+        else:
+            result = evaluate_uniformity(profiler.count('density', density),
+                                         cluster, Energy_gradient,
+                                         Lz_gradient, uniformity_method)
+    inter_time = time_class.time() - start
+    print('time per star =', inter_time/np.shape(cluster)[0])
+    
+    with profiler.stage('save'):
+        summary_save(result, cluster, file_name, uniformity_method)
+    plot_results(samples, cluster, result, file_name, uniformity_method,
+                 custom_potential, plot, renderer, profiler, rasterize,
+                 max_bokeh_points)
+    profiler.save('main_program_results/' + file_name + 'instrumentation.json')
+    return cluster, result
+
+
 def main(uniformity_method = "projection", gradient_method = "analytic",
          search_method = "local", custom_density = None, custom_samples = None,
          custom_centres = None, custom_potential = None,
-         selection = None, band_width = 10):
+         selection = None, band_width = 10, cache_centres = True,
+         kmeans_seed = None, file_name = None, density_name = None,
+         epsilon = None, v_scale = None, search_star = None,
+         instrument = True, plot = "inline", rasterize = False,
+         max_bokeh_points = None, interpolate_potential = False,
+         extra_integrals = None):
     """
     NAME:
         main
@@ -258,6 +497,40 @@ def main(uniformity_method = "projection", gradient_method = "analytic",
         selection = a selection function that takes parallax to Sun and returns
                     fraction of stars that are left after selection;
                     takes array; takes parallax in physical units
+        band_width = multiplier of the bandwidth of the KDE
+        cache_centres = if True, reuse the kmeans cluster centres of a previous
+                        run on the same samples instead of clustering again
+        kmeans_seed = seed of the kmeans clustering; None for a random
+                      initialization
+        file_name = name under which results of custom samples are saved
+        density_name = name of the custom density
+        epsilon, v_scale = radius and velocity scale of the search
+        search_star = search star in galactocentric Cartesian coordinates with
+                      physical units
+                      
+        Any of file_name, density_name, epsilon, v_scale and search_star that
+        is needed and None is asked from the user.
+        instrument = if True, record the wall time, CPU time and peak memory of
+                     each stage and the number of density evaluations, and
+                     save them in instrumentation.json next to the results
+        plot = "inline" to make the plots in this process, "background" to
+               make them headlessly in a pool of worker processes,
+               "defer" to only save their inputs in the result folder so that
+               they can be made later with render.py, or None for no plots
+        rasterize = if True, draw the samples of the kmeans plot and the
+                    cluster centres of the color plot projections as binned
+                    images, whose cost does not depend on their number
+        max_bokeh_points = maximum number of points embedded in the bokeh
+                           html, chosen at random stratified by result;
+                           None to keep all
+        interpolate_potential = if True, evaluate the energy and its gradient
+                                with splines of the potential and its forces,
+                                tabulated once and cached on disk (see
+                                Interpolated_Potential)
+        extra_integrals = list of further integrals of motion, such as a
+                          Third_Integral.ThirdIntegral, each with a gradient
+                          method of (m,6) arrays; the projection method then
+                          tests uniformity along E, L_z and all of them
     HISTORY:
         2018-06-20 - Written - Samuel Wong
         2018-06-21 - Added option of custom samples - Samuel Wong and Michael
@@ -268,27 +541,129 @@ def main(uniformity_method = "projection", gradient_method = "analytic",
         2018-08-14 - Added option to divide by selection in density - Samuel Wong
         2018-08-19 - Added option to adjust bandwidth - Samuel Wong
     """        
+    profiler = Profiler(enabled = instrument)
+    samples, density, file_name = get_samples_density_filename(
+            custom_density, search_method, custom_samples, uniformity_method,
+            selection, band_width, file_name, density_name, epsilon, v_scale,
+            search_star, profiler)
+    if interpolate_potential:
+        with profiler.stage('potential interpolation'):
+            custom_potential = get_potential(custom_potential, True)
+    
+    evaluate_save_plot(samples, density, file_name, uniformity_method,
+                       gradient_method, custom_centres, custom_potential,
+                       cache_centres, kmeans_seed, profiler, plot,
+                       rasterize = rasterize,
+                       max_bokeh_points = max_bokeh_points,
+                       extra_integrals = extra_integrals)
+
+
+
+def potential_name(custom_potential):
+    """
+    NAME:
+        potential_name
+    PURPOSE:
+        Name a potential by its class, or by the classes of its components.
+    INPUT:
+        custom_potential = galpy potential or list of potentials; None for
+                           MWPotential2014
+    OUTPUT:
+        string
+    """
+    if custom_potential is None or custom_potential is MWPotential2014:
+        return 'MWPotential2014'
+    if isinstance(custom_potential, list):
+        return ' + '.join(type(p).__name__ for p in custom_potential)
+    return type(custom_potential).__name__
+
+
+def main_multi_potential(custom_potentials, potential_names = None,
+                         uniformity_method = "projection",
+                         gradient_method = "analytic",
+                         search_method = "local", custom_density = None,
+                         custom_samples = None, custom_centres = None,
+                         selection = None, band_width = 10,
+                         cache_centres = True, kmeans_seed = None,
+                         file_name = None, density_name = None,
+                         epsilon = None, v_scale = None, search_star = None,
+                         instrument = True, plot = "inline",
+                         rasterize = False, max_bokeh_points = None,
+                         interpolate_potential = False):
+    """
+    NAME:
+        main_multi_potential
+    PURPOSE:
+        Evaluate uniformity of the same density at the same cluster centres
+        in several potentials. Only the gradient of the energy depends on the
+        potential, so the gradient of the density, which is most of the cost
+        of main, is computed once and every potential only adds the cost of
+        its forces. The results in each potential are saved and plotted as by
+        main, in a sub-folder named after the potential, and side by side in
+        "potential comparison.npz".
+    INPUT:
+        custom_potentials = list of galpy potentials (or lists of potentials);
+                            None in the list stands for MWPotential2014
+        potential_names = names of the potentials, used as folder names; None
+                          to name them after their classes
+        the other inputs are the same as for main
+    OUTPUT:
+        (cluster, dictionary of the result of each potential by name)
+    """
+    if potential_names is None:
+        potential_names = [potential_name(p) for p in custom_potentials]
+    if len(set(potential_names)) != len(potential_names):
+        raise ValueError('potential names must be different')
+    profiler = Profiler(enabled = instrument)
     samples, density, file_name = get_samples_density_filename(
             custom_density, search_method, custom_samples, uniformity_method,
-            selection, band_width)
+            selection, band_width, file_name, density_name, epsilon, v_scale,
+            search_star, profiler)
+    if interpolate_potential:
+        with profiler.stage('potential interpolation'):
+            custom_potentials = [get_potential(p, True)
+                                 for p in custom_potentials]
     
-    cluster = get_cluster(samples, custom_centres)
+    if custom_centres is not None:
+        cluster = custom_centres
+    else:
+        with profiler.stage('clustering'):
+            cluster = get_cluster(samples, None, cache_centres, kmeans_seed)
+    
+    # the only part of the evaluation that does not depend on the potential
+    with profiler.stage('density gradient'):
+        density_gradient = grad_multi(profiler.count('density', density),
+                                      cluster)
     
-    Energy_gradient, Lz_gradient = get_Energy_Lz_gradient(
-            cluster, gradient_method, custom_potential)
+    renderer = None
+    if plot == "background":
+        renderer = Renderer()
+    results = {}
+    for custom_potential, name in zip(custom_potentials, potential_names):
+        with profiler.stage('uniformity in ' + name):
+            Energy_gradient, Lz_gradient = get_Energy_Lz_gradient(
+                    cluster, gradient_method, custom_potential)
+            result = uniformity_from_gradient(density_gradient,
+                                              Energy_gradient, Lz_gradient,
+                                              uniformity_method)
+        results[name] = result
         
-    start = time_class.time()
-    result = evaluate_uniformity(density, cluster, Energy_gradient,
-                                 Lz_gradient, uniformity_method)
-    inter_time = time_class.time() - start
-    print('time per star =', inter_time/np.shape(cluster)[0])
+        print(name + ':')
+        folder = file_name + name + '/'
+        if not os.path.exists('main_program_results/' + folder):
+            os.mkdir('main_program_results/' + folder)
+        summary_save(result, cluster, folder, uniformity_method)
+        plot_results(samples, cluster, result, folder, uniformity_method,
+                     custom_potential, plot, renderer, profiler, rasterize,
+                     max_bokeh_points)
     
-    summary_save(result, cluster, file_name, uniformity_method)        
-    kmeans_plot(samples, cluster, file_name)
-    color_plot(result, cluster, file_name, uniformity_method, custom_potential)
-    color_plot_bokeh(result, cluster, file_name, uniformity_method)
-    errorbar_plot(result, cluster, file_name, uniformity_method, 
-                  custom_potential)
+    np.savez('main_program_results/' + file_name + 'potential comparison',
+             cluster = cluster, names = np.array(potential_names),
+             result = np.stack([results[name] for name in potential_names]))
+    if renderer is not None:
+        renderer.close()
+    profiler.save('main_program_results/' + file_name + 'instrumentation.json')
+    return cluster, results
        
   
 if __name__ == "__main__": 
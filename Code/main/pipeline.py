@@ -0,0 +1,268 @@
+"""
+NAME:
+    pipeline
+
+PURPOSE:
+    Run the main program as a chain of stages (samples, density, cluster
+    centres, energy and L_z gradients, uniformity result) whose outputs are
+    saved on disk under a hash of everything they depend on. A rerun only
+    recomputes the stages whose inputs changed; e.g. switching the uniformity
+    method from projection to dot product reuses the samples, the KDE, the
+    cluster centres and the gradients.
+
+HOW TO USE:
+    run_pipeline(search_method='local', epsilon=0.5, v_scale=0.,
+                 search_star=[-8.3, 0., 0.03, 11.1, 232.24, 7.25],
+                 uniformity_method='dot product')
+"""
+import sys
+sys.path.append('..')
+
+import os
+import hashlib
+import dill
+import numpy as np
+from main_program_cluster import search_for_samples, search_file_name, \
+    make_result_folder, get_cluster, get_Energy_Lz_gradient, summary_save, \
+    evaluate_uniformity, generate_KDE, get_star_coord_from_user, \
+    to_natural_units, array_hash, plot_results
+
+
+def object_hash(obj):
+    """
+    NAME:
+        object_hash
+
+    PURPOSE:
+        Compute a digest of an input of a stage. Arrays are hashed by
+        content, simple values by their representation and anything else
+        (functions, potentials) by its dill serialization.
+
+    INPUT:
+        obj - the input
+
+    OUTPUT:
+        a string of 40 hexadecimal characters
+    """
+    if isinstance(obj, np.ndarray):
+        return array_hash(obj)
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        data = repr(obj).encode()
+    elif isinstance(obj, (tuple, list)):
+        data = ','.join(object_hash(item) for item in obj).encode()
+    else:
+        data = dill.dumps(obj)
+    return hashlib.sha1(data).hexdigest()
+
+
+class Pipeline:
+    """
+    Class memoizing the stages of the main program on disk
+    """
+    # file extension of each kind of artifact
+    _EXTENSIONS = {'array': '.npy', 'arrays': '.npz', 'object': '.pkl'}
+
+    def __init__(self, cache_dir='main_program_results/pipeline_cache'):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a Pipeline
+
+        INPUT:
+            cache_dir - folder in which the artifacts of the stages are saved
+
+        OUTPUT:
+            None
+        """
+        self.cache_dir = cache_dir
+
+    def key(self, name, *inputs):
+        """
+        NAME:
+            key
+
+        PURPOSE:
+            compute the key of a stage from its name and inputs
+
+        INPUT:
+            name - name of the stage
+
+            inputs - everything the stage depends on, including the keys of
+            the stages it uses
+
+        OUTPUT:
+            a string of 40 hexadecimal characters
+        """
+        digest = hashlib.sha1(name.encode())
+        for item in inputs:
+            digest.update(object_hash(item).encode())
+        return digest.hexdigest()
+
+    def stage(self, name, function, inputs, kind='array'):
+        """
+        NAME:
+            stage
+
+        PURPOSE:
+            return the output of a stage, loading it from disk if the stage
+            was already run with the same inputs and computing and saving it
+            otherwise
+
+        INPUT:
+            name - name of the stage, also the sub-folder of its artifacts
+
+            function - function without arguments computing the output
+
+            inputs - list of everything the output depends on
+
+            kind - 'array' for a numpy array, 'arrays' for a tuple of arrays,
+            'object' for anything else that dill can serialize
+
+        OUTPUT:
+            (output, key of the stage)
+        """
+        key = self.key(name, *inputs)
+        folder = os.path.join(self.cache_dir, name)
+        path = os.path.join(folder, key + self._EXTENSIONS[kind])
+
+        if os.path.exists(path):
+            print('Reusing {} from {}'.format(name, path))
+            return self._load(path, kind), key
+
+        output = function()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        # write to a temporary file first so that an interrupted run never
+        # leaves a partial artifact behind
+        with open(path + '.tmp', 'wb') as f:
+            if kind == 'array':
+                np.save(f, output)
+            elif kind == 'arrays':
+                np.savez(f, *output)
+            else:
+                dill.dump(output, f)
+        os.replace(path + '.tmp', path)
+        return output, key
+
+    @staticmethod
+    def _load(path, kind):
+        if kind == 'array':
+            return np.load(path)
+        if kind == 'arrays':
+            with np.load(path) as data:
+                return tuple(data['arr_{}'.format(i)]
+                             for i in range(len(data.files)))
+        with open(path, 'rb') as f:
+            return dill.load(f)
+
+
+def run_pipeline(uniformity_method="projection", gradient_method="analytic",
+                 search_method="local", custom_density=None,
+                 custom_samples=None, custom_centres=None,
+                 custom_potential=None, selection=None, band_width=10,
+                 kmeans_seed=None, file_name=None, density_name=None,
+                 epsilon=None, v_scale=None, search_star=None, plot='inline',
+                 renderer=None, rasterize=False, max_bokeh_points=None,
+                 cache_dir='main_program_results/pipeline_cache'):
+    """
+    NAME:
+        run_pipeline
+
+    PURPOSE:
+        Do the same as main, memoizing every stage on disk so that only the
+        stages whose inputs changed since a previous run are recomputed.
+
+    INPUT:
+        uniformity_method, gradient_method, search_method, custom_density,
+        custom_samples, custom_centres, custom_potential, selection,
+        band_width, kmeans_seed, file_name, density_name, epsilon, v_scale,
+        search_star - see main; the search parameters that are needed and
+        None are asked from the user before anything is computed
+
+        plot - how to make the plots: 'inline', 'background', 'defer' or
+        None; see main
+
+        renderer - Renderer to which the plots are submitted when plot is
+        'background'
+
+        rasterize - if True, draw the scatter plots as binned images; see main
+
+        max_bokeh_points - maximum number of points in the bokeh plot; see
+        main
+
+        cache_dir - folder in which the artifacts of the stages are saved
+
+    OUTPUT:
+        (cluster, result)
+    """
+    pipeline = Pipeline(cache_dir)
+
+    # samples, in natural units
+    if custom_samples is not None:
+        if file_name is None:
+            file_name = input('Name of file to be saved: ')
+        samples, samples_key = pipeline.stage(
+                'samples', lambda: to_natural_units(custom_samples),
+                [custom_samples])
+    else:
+        if search_method != "all of local":
+            if epsilon is None:
+                epsilon = float(input("epsilon = "))
+            if v_scale is None:
+                v_scale = float(input("v_scale = "))
+            if search_star is None:
+                search_star, _ = get_star_coord_from_user()
+            search_star = np.asarray(search_star, dtype=float)
+            search_inputs = [search_method, epsilon, v_scale, search_star]
+        else:
+            search_inputs = [search_method]
+        samples, samples_key = pipeline.stage(
+                'samples', lambda: to_natural_units(search_for_samples(
+                        search_method, band_width, epsilon, v_scale,
+                        search_star)[0]), search_inputs)
+        file_name = search_file_name(search_method, band_width, epsilon,
+                                     v_scale, search_star)
+
+    # density, either custom or a KDE of the samples
+    if custom_density is not None:
+        if density_name is None:
+            density_name = input('Name of custom density function: ')
+        file_name = density_name + ' ' + file_name
+        density, density_key = custom_density, object_hash(custom_density)
+    else:
+        density, density_key = pipeline.stage(
+                'density', lambda: generate_KDE(samples, 'epanechnikov',
+                                                selection, band_width),
+                [samples_key, 'epanechnikov', selection, band_width],
+                kind='object')
+    file_name = make_result_folder(file_name, selection, uniformity_method)
+
+    # cluster centres; the pipeline takes the place of the kmeans cache
+    if custom_centres is not None:
+        cluster, cluster_key = custom_centres, array_hash(custom_centres)
+    else:
+        cluster, cluster_key = pipeline.stage(
+                'centres', lambda: get_cluster(samples, None, False,
+                                               kmeans_seed),
+                [samples_key, kmeans_seed])
+
+    # gradients of the integrals of motion at the cluster centres
+    (Energy_gradient, Lz_gradient), gradient_key = pipeline.stage(
+            'gradients', lambda: get_Energy_Lz_gradient(
+                    cluster, gradient_method, custom_potential),
+            [cluster_key, gradient_method, custom_potential], kind='arrays')
+
+    # uniformity of the density at the cluster centres
+    result, _ = pipeline.stage(
+            'result', lambda: evaluate_uniformity(
+                    density, cluster, Energy_gradient, Lz_gradient,
+                    uniformity_method),
+            [density_key, cluster_key, gradient_key, uniformity_method])
+
+    summary_save(result, cluster, file_name, uniformity_method)
+    plot_results(samples, cluster, result, file_name, uniformity_method,
+                 custom_potential, plot, renderer, rasterize=rasterize,
+                 max_bokeh_points=max_bokeh_points)
+    return cluster, result
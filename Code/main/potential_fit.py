@@ -0,0 +1,339 @@
+"""
+NAME:
+    potential_fit
+
+PURPOSE:
+    Fit the parameters of a galpy potential by minimizing the mean, over the
+    cluster centres, of the projection of the gradient of the density onto
+    the complement of the gradients of E and L_z, so as to find the potential
+    in which the density looks most like a function of the integrals of
+    motion. The gradient of the density at the cluster centres does not
+    depend on the potential, so it is computed once and cached next to the
+    results; every trial potential only costs the gradient of its energy at
+    the cluster centres. Candidate parameter sets can be evaluated in a pool
+    of processes.
+
+HOW TO USE:
+    def make_potential(parameters):
+        # natural units; parameters are the circular velocity at R0 and the
+        # flattening
+        v0, q = parameters
+        return LogarithmicHaloPotential(amp = v0**2, q = q)
+
+    result = fit_potential(make_potential, [1., 0.9],
+                           bounds = [(0.5, 1.5), (0.5, 1.)],
+                           custom_samples = samples, file_name = 'fit',
+                           optimizer = 'differential evolution',
+                           n_workers = 4)
+    best_potential = make_potential(result.x)
+"""
+import os
+import json
+import multiprocessing
+import numpy as np
+from scipy.optimize import minimize, differential_evolution, OptimizeResult
+from main_program_cluster import get_samples_density_filename, \
+    get_cluster, get_Energy_Lz_gradient, grad_multi, \
+    uniformity_projection_from_gradient, del_Lz, Profiler
+
+# state of a worker process, set once by _initialize_worker
+_worker = {}
+
+
+def _initialize_worker(objective):
+    _worker['objective'] = objective
+
+
+def _evaluate_in_worker(parameters):
+    return _worker['objective'].value(parameters)
+
+
+class PotentialObjective:
+    """
+    Class evaluating the mean projection in the potentials of a parametrized
+    family, at fixed cluster centres and gradients of the density
+    """
+    def __init__(self, make_potential, cluster, density_gradient,
+                 gradient_method = 'analytic'):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a PotentialObjective
+
+        INPUT:
+            make_potential = function of a 1d array of parameters returning a
+                             galpy potential (or list of potentials) in
+                             natural units
+            cluster = (m,6) array of cluster centres in natural units
+            density_gradient = (m,6) array of the gradient of the density at
+                               the cluster centres
+            gradient_method = "analytic" or "numeric", referring to how the
+                              gradient of the energy is computed
+
+        OUTPUT:
+            None
+        """
+        self.make_potential = make_potential
+        self.cluster = cluster
+        self.density_gradient = density_gradient
+        self.gradient_method = gradient_method
+        # L_z does not depend on the potential
+        self.Lz_gradient = del_Lz(cluster)
+        # (parameters, value) of every evaluation made through __call__ or
+        # evaluate
+        self.history = []
+
+    def projection(self, parameters):
+        """
+        NAME:
+            projection
+
+        PURPOSE:
+            return the projection at every cluster centre in the potential of
+            a parameter set
+
+        INPUT:
+            parameters = 1d array of parameters
+
+        OUTPUT:
+            array of shape (m,)
+        """
+        potential = self.make_potential(np.asarray(parameters, dtype = float))
+        Energy_gradient = get_Energy_Lz_gradient(
+                self.cluster, self.gradient_method, potential)[0]
+        return uniformity_projection_from_gradient(
+                self.density_gradient, Energy_gradient, self.Lz_gradient)
+
+    def value(self, parameters):
+        """
+        NAME:
+            value
+
+        PURPOSE:
+            return the mean projection in the potential of a parameter set,
+            without recording it
+
+        INPUT:
+            parameters = 1d array of parameters
+
+        OUTPUT:
+            mean projection; inf if it is not defined, so that optimizers
+            move away from parameters for which the potential is not
+        """
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = np.nanmean(self.projection(parameters))
+        if not np.isfinite(mean):
+            return np.inf
+        return float(mean)
+
+    def __call__(self, parameters):
+        value = self.value(parameters)
+        self.history.append((np.array(parameters, dtype = float), value))
+        return value
+
+    def evaluate(self, candidates, pool = None):
+        """
+        NAME:
+            evaluate
+
+        PURPOSE:
+            return the mean projection of several parameter sets, in this
+            process or in a pool of processes, and record them
+
+        INPUT:
+            candidates = (n, number of parameters) array of parameter sets
+            pool = a pool started with start_pool; None to evaluate in this
+                   process
+
+        OUTPUT:
+            array of shape (n,)
+        """
+        candidates = np.atleast_2d(np.asarray(candidates, dtype = float))
+        if pool is None:
+            values = [self.value(parameters) for parameters in candidates]
+        else:
+            values = pool.map(_evaluate_in_worker, candidates)
+        self.history.extend(zip(candidates, values))
+        return np.array(values)
+
+    def start_pool(self, n_workers = None):
+        """
+        NAME:
+            start_pool
+
+        PURPOSE:
+            start a pool of processes, each holding a copy of this objective,
+            for evaluate; make_potential must then be a function defined at
+            the top level of a module (or of the script), which the processes
+            can import, not a lambda
+
+        INPUT:
+            n_workers = number of processes; None for the number of CPUs
+
+        OUTPUT:
+            multiprocessing pool, to be used as a context manager
+        """
+        context = multiprocessing.get_context('spawn')
+        # the workers get this objective without the records of this process
+        history, self.history = self.history, []
+        try:
+            return context.Pool(n_workers, _initialize_worker, (self,))
+        finally:
+            self.history = history
+
+
+def density_gradient_at(density, cluster, file_name, use_cache = True):
+    """
+    NAME:
+        density_gradient_at
+
+    PURPOSE:
+        Return the gradient of the density at the cluster centres, saved in
+        'density gradient.npz' next to the results so that later fits of the
+        same run skip it.
+
+    INPUT:
+        density = density function of 6 dimensional coordinates in natural
+                  units
+        cluster = (m,6) array of cluster centres in natural units
+        file_name = folder in main_program_results of the run
+        use_cache = if True, reuse the saved gradient if it was computed at
+                    the same cluster centres
+
+    OUTPUT:
+        (m,6) array
+    """
+    path = 'main_program_results/' + file_name + 'density gradient.npz'
+    if use_cache and os.path.exists(path):
+        with np.load(path) as data:
+            if np.array_equal(data['cluster'], cluster):
+                print('Loading cached density gradient from ' + path)
+                return data['gradient']
+    gradient = grad_multi(density, cluster)
+    np.savez(path, cluster = cluster, gradient = gradient)
+    return gradient
+
+
+def fit_potential(make_potential, initial, bounds = None,
+                  parameter_names = None, gradient_method = "analytic",
+                  search_method = "local", custom_density = None,
+                  custom_samples = None, custom_centres = None,
+                  selection = None, band_width = 10, cache_centres = True,
+                  kmeans_seed = None, file_name = None, density_name = None,
+                  epsilon = None, v_scale = None, search_star = None,
+                  candidates = None, optimizer = "Nelder-Mead",
+                  n_workers = 1, options = None, instrument = True):
+    """
+    NAME:
+        fit_potential
+    PURPOSE:
+        Find the parameters of a family of potentials that minimize the mean
+        projection at the cluster centres of a run of the main program. The
+        candidate parameter sets, if given, are evaluated first and the best
+        of them (or the initial parameters) starts the optimizer. With the
+        differential evolution optimizer, the parameter sets of every
+        generation are evaluated in a pool of n_workers processes. The best
+        parameters, the projection at every cluster centre in their potential
+        and all evaluations are saved in 'potential fit.npz' and
+        'potential fit.json' next to the results.
+    INPUT:
+        make_potential = function of a 1d array of parameters returning a
+                         galpy potential (or list of potentials) in natural
+                         units
+        initial = initial parameters
+        bounds = list of (lower, upper) bounds of each parameter; needed for
+                 differential evolution
+        parameter_names = names of the parameters, for the saved results
+        candidates = (n, number of parameters) array of parameter sets
+                     evaluated, in a pool of n_workers processes, before the
+                     optimizer; e.g. a grid
+        optimizer = "differential evolution", a method of
+                    scipy.optimize.minimize, or None to only evaluate the
+                    candidates
+        n_workers = number of processes evaluating candidates and the
+                    generations of differential evolution; None for the
+                    number of CPUs; with more than one, make_potential must
+                    be defined at the top level of a module or script
+        options = dictionary of further arguments of the optimizer
+        the other inputs are the same as for main
+    OUTPUT:
+        scipy OptimizeResult, whose x are the best parameters and fun their
+        mean projection
+    """
+    profiler = Profiler(enabled = instrument)
+    samples, density, file_name = get_samples_density_filename(
+            custom_density, search_method, custom_samples, "projection",
+            selection, band_width, file_name, density_name, epsilon, v_scale,
+            search_star, profiler)
+    if custom_centres is not None:
+        cluster = custom_centres
+    else:
+        with profiler.stage('clustering'):
+            cluster = get_cluster(samples, None, cache_centres, kmeans_seed)
+    with profiler.stage('density gradient'):
+        gradient = density_gradient_at(profiler.count('density', density),
+                                       cluster, file_name)
+
+    objective = PotentialObjective(make_potential, cluster, gradient,
+                                   gradient_method)
+    initial = np.asarray(initial, dtype = float)
+    if options is None:
+        options = {}
+    pool = None
+    if n_workers != 1 and (candidates is not None or
+                           optimizer == "differential evolution"):
+        pool = objective.start_pool(n_workers)
+    try:
+        with profiler.stage('fit'):
+            if candidates is not None:
+                values = objective.evaluate(candidates, pool)
+                if np.min(values) < objective(initial):
+                    initial = np.atleast_2d(candidates)[np.argmin(values)]
+            if optimizer == "differential evolution":
+                if bounds is None:
+                    raise ValueError('differential evolution needs bounds')
+                # the population of a generation is evaluated together
+                workers = lambda f, population: objective.evaluate(
+                        list(population), pool)
+                result = differential_evolution(
+                        objective, bounds, x0 = initial, workers = workers,
+                        updating = 'deferred', **options)
+            elif optimizer is not None:
+                result = minimize(objective, initial, method = optimizer,
+                                  bounds = bounds, **options)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if optimizer is None:
+        # the best evaluation
+        best = min(range(len(objective.history)),
+                   key = lambda i: objective.history[i][1])
+        result = OptimizeResult(x = objective.history[best][0],
+                                fun = objective.history[best][1],
+                                success = True, message = 'best candidate')
+    result.nfev_total = len(objective.history)
+
+    if parameter_names is None:
+        parameter_names = ['p{}'.format(i) for i in range(len(initial))]
+    parameters = np.array([p for p, _ in objective.history])
+    values = np.array([v for _, v in objective.history])
+    np.savez('main_program_results/' + file_name + 'potential fit',
+             cluster = cluster, result = objective.projection(result.x),
+             best = result.x, parameters = parameters, values = values)
+    with open('main_program_results/' + file_name + 'potential fit.json',
+              'w') as f:
+        json.dump({'parameters': dict(zip(parameter_names,
+                                          np.asarray(result.x).tolist())),
+                   'mean projection': float(result.fun),
+                   'optimizer': optimizer,
+                   'evaluations': len(values),
+                   'message': str(result.message)}, f, indent = 2)
+    print('Best parameters: ', dict(zip(parameter_names,
+                                        np.asarray(result.x).tolist())))
+    print('Mean projection: ', result.fun)
+    profiler.save('main_program_results/' + file_name + 'instrumentation.json')
+    return result
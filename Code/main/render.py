@@ -0,0 +1,321 @@
+"""
+NAME:
+    render
+
+PURPOSE:
+    Make the plots of a run of the main program from its saved results,
+    headlessly and off the critical path. main saves what the plots need in
+    the result folder (see save_render_inputs); the plots are then split into
+    independent jobs (the kmeans plot, the histograms, each of the 15
+    projections of the color plot, the bokeh plot and the errorbar plot) that
+    a Renderer runs in a pool of background processes using the non
+    interactive Agg backend, so that nothing blocks on plt.show. Plotting can
+    also be deferred entirely and done later, on another machine if need be,
+    with the render command.
+
+HOW TO USE:
+    renderer = Renderer()
+    renderer.submit(file_name)
+    ...
+    renderer.wait()
+
+    or, for result folders saved with main(plot = "defer"), from Code/main:
+
+    python render.py "<file_name>" ["<file_name>" ...]
+"""
+import sys
+sys.path.append('..')
+sys.path.append('../check_uniformity_of_density')
+
+import os
+import json
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import dill
+import numpy as np
+
+# folder, inside the result folder of a run, holding the inputs of its plots
+RENDER_INPUTS = 'render inputs'
+
+# inputs of the runs already loaded by this process, keyed by file name
+_inputs = {}
+
+
+def save_render_inputs(samples, cluster, result, file_name, uniformity_method,
+                       custom_potential = None, rasterize = False,
+                       max_bokeh_points = None):
+    """
+    NAME:
+        save_render_inputs
+
+    PURPOSE:
+        Save everything the plots of a run need in its result folder, so that
+        they can be made by another process or later by the render command.
+
+    INPUT:
+        samples = samples in natural units
+        cluster = cluster centres in natural units
+        result = result of the uniformity evaluation at each cluster centre
+        file_name = folder in main_program_results in which results are saved
+        uniformity_method = "projection" or "dot product"
+        custom_potential = potential used to evaluate energy; None for
+                           MWPotential2014
+        rasterize = if True, the kmeans plot and the projections of the color
+                    plot are drawn as binned images
+        max_bokeh_points = maximum number of points in the bokeh plot; None
+                           to keep all
+
+    OUTPUT:
+        None
+    """
+    folder = os.path.join('main_program_results', file_name, RENDER_INPUTS)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    np.save(os.path.join(folder, 'samples.npy'), samples)
+    np.savez(os.path.join(folder, 'result.npz'), cluster = cluster,
+             result = result)
+    if custom_potential is not None:
+        with open(os.path.join(folder, 'potential.pkl'), 'wb') as dill_file:
+            dill.dump(custom_potential, dill_file)
+    with open(os.path.join(folder, 'render.json'), 'w') as f:
+        json.dump({'file_name': file_name,
+                   'uniformity_method': uniformity_method,
+                   'custom_potential': custom_potential is not None,
+                   'rasterize': rasterize,
+                   'max_bokeh_points': max_bokeh_points}, f, indent = 1)
+
+
+def load_render_inputs(file_name):
+    """
+    NAME:
+        load_render_inputs
+
+    PURPOSE:
+        Load the inputs of the plots of a run saved by save_render_inputs.
+        They are kept in memory, so that a worker rendering many plots of the
+        same run only reads them once.
+
+    INPUT:
+        file_name = folder in main_program_results in which results are saved
+
+    OUTPUT:
+        dictionary with samples, cluster, result, uniformity_method,
+        custom_potential, rasterize and max_bokeh_points
+    """
+    if file_name not in _inputs:
+        folder = os.path.join('main_program_results', file_name,
+                              RENDER_INPUTS)
+        with open(os.path.join(folder, 'render.json')) as f:
+            inputs = json.load(f)
+        inputs['samples'] = np.load(os.path.join(folder, 'samples.npy'),
+                                    mmap_mode = 'r')
+        with np.load(os.path.join(folder, 'result.npz')) as data:
+            inputs['cluster'] = data['cluster']
+            inputs['result'] = data['result']
+        if inputs['custom_potential']:
+            with open(os.path.join(folder, 'potential.pkl'),
+                      'rb') as dill_file:
+                inputs['custom_potential'] = dill.load(dill_file)
+        else:
+            inputs['custom_potential'] = None
+        _inputs[file_name] = inputs
+    return _inputs[file_name]
+
+
+def plot_jobs():
+    """
+    NAME:
+        plot_jobs
+
+    PURPOSE:
+        List the independent plot jobs of a run.
+
+    INPUT:
+        None
+
+    OUTPUT:
+        list of tuples; the first item is the name of the plot and, for a
+        projection of the color plot, the other two are its axes
+    """
+    jobs = [('kmeans',), ('color summary',)]
+    for i in range(6):
+        for j in range(i + 1, 6):
+            jobs.append(('color', i, j))
+    jobs += [('bokeh',), ('errorbar',)]
+    return jobs
+
+
+def render_job(file_name, job):
+    """
+    NAME:
+        render_job
+
+    PURPOSE:
+        Make one plot of a run from its saved inputs.
+
+    INPUT:
+        file_name = folder in main_program_results in which results are saved
+        job = one of the tuples returned by plot_jobs
+
+    OUTPUT:
+        None
+    """
+    import pylab as plt
+    from tools.plots import kmeans_plot, prepare_color_plot, \
+        color_plot_summary, color_plot_ij, color_plot_bokeh, errorbar_plot
+
+    inputs = load_render_inputs(file_name)
+    uniformity_method = inputs['uniformity_method']
+    result, cluster = inputs['result'], inputs['cluster']
+    rasterize = inputs.get('rasterize', False)
+    try:
+        if job[0] == 'kmeans':
+            kmeans_plot(inputs['samples'], cluster, file_name, rasterize)
+        elif job[0] == 'color summary':
+            result, cluster = prepare_color_plot(result, cluster,
+                                                 uniformity_method)
+            color_plot_summary(result, cluster, file_name, uniformity_method,
+                               inputs['custom_potential'])
+        elif job[0] == 'color':
+            result, cluster = prepare_color_plot(result, cluster,
+                                                 uniformity_method)
+            color_plot_ij(result, cluster, file_name, uniformity_method,
+                          job[1], job[2], rasterize)
+        elif job[0] == 'bokeh':
+            color_plot_bokeh(result, cluster, file_name, uniformity_method,
+                             show_plot = False, 
+                             max_points = inputs.get('max_bokeh_points'))
+        elif job[0] == 'errorbar':
+            errorbar_plot(result, cluster, file_name, uniformity_method,
+                          inputs['custom_potential'])
+        else:
+            raise ValueError('unknown plot job {}'.format(job))
+    finally:
+        plt.close('all')
+
+
+def _initialize_worker():
+    # plots are only saved; Agg never opens a window nor blocks on plt.show
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+class Renderer:
+    """
+    Class rendering the plots of runs in a pool of background processes
+    """
+    def __init__(self, max_workers = None):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a Renderer; the worker processes are started with
+            spawn, so that they do not inherit the state of the computation
+
+        INPUT:
+            max_workers = number of worker processes; None for the number of
+                          CPUs
+
+        OUTPUT:
+            None
+        """
+        self._executor = ProcessPoolExecutor(
+                max_workers = max_workers,
+                mp_context = multiprocessing.get_context('spawn'),
+                initializer = _initialize_worker)
+        self._futures = {}
+
+    def submit(self, file_name):
+        """
+        NAME:
+            submit
+
+        PURPOSE:
+            queue all plots of a run whose inputs were saved by
+            save_render_inputs; returns immediately
+
+        INPUT:
+            file_name = folder in main_program_results in which results are
+                        saved
+
+        OUTPUT:
+            None
+        """
+        for job in plot_jobs():
+            future = self._executor.submit(render_job, file_name, job)
+            self._futures[future] = (file_name, job)
+
+    def wait(self):
+        """
+        NAME:
+            wait
+
+        PURPOSE:
+            wait until every queued plot is made; a plot that fails is
+            reported and does not stop the others
+
+        INPUT:
+            None
+
+        OUTPUT:
+            list of (file_name, job) of the plots that failed
+        """
+        failed = []
+        for future in as_completed(list(self._futures)):
+            file_name, job = self._futures.pop(future)
+            try:
+                future.result()
+            except Exception:
+                print('Plot {} of {} failed:'.format(job, file_name))
+                traceback.print_exc()
+                failed.append((file_name, job))
+        return failed
+
+    def close(self):
+        """
+        NAME:
+            close
+
+        PURPOSE:
+            wait for the queued plots and stop the worker processes
+
+        INPUT:
+            None
+
+        OUTPUT:
+            list of (file_name, job) of the plots that failed
+        """
+        failed = self.wait()
+        self._executor.shutdown()
+        return failed
+
+
+def render(file_names, max_workers = None):
+    """
+    NAME:
+        render
+
+    PURPOSE:
+        Make all plots of the given runs and wait for them.
+
+    INPUT:
+        file_names = list of folders in main_program_results whose inputs were
+                     saved by save_render_inputs
+        max_workers = number of worker processes; None for the number of CPUs
+
+    OUTPUT:
+        list of (file_name, job) of the plots that failed
+    """
+    renderer = Renderer(max_workers)
+    for file_name in file_names:
+        renderer.submit(file_name)
+    return renderer.close()
+
+
+if __name__ == "__main__":
+
+    failed = render(sys.argv[1:])
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,75 @@
+"""
+NAME:
+    test_toomredf
+
+PURPOSE:
+    Test the analytic forces, second derivatives and density of
+    ToomrePotential against central finite differences of the potential and
+    of the forces, and the Cartesian DF of toomredf and its gradient against
+    the cylindrical DF and central finite differences, for several powers n
+    of the distribution function.
+"""
+import numpy as np
+from toomredf import toomredf, ToomrePotential
+from tools.tools import rect_to_cyl
+
+dx = 1e-5
+
+
+def relative_error(analytic, numeric):
+    return np.max(np.abs(analytic - numeric)/(np.abs(numeric) + 1e-3))
+
+
+def test_toomre_potential(n, R, z, tolerance=1e-5):
+    pot = ToomrePotential(n=n)
+    potential = lambda R, z: pot._evaluate(R, z)
+    Rforce = -(potential(R + dx, z) - potential(R - dx, z))/(2*dx)
+    zforce = -(potential(R, z + dx) - potential(R, z - dx))/(2*dx)
+    R2deriv = -(pot._Rforce(R + dx, z) - pot._Rforce(R - dx, z))/(2*dx)
+    z2deriv = -(pot._zforce(R, z + dx) - pot._zforce(R, z - dx))/(2*dx)
+    Rzderiv = -(pot._Rforce(R, z + dx) - pot._Rforce(R, z - dx))/(2*dx)
+    # Poisson's equation
+    dens = (R2deriv + z2deriv - pot._Rforce(R, z)/R)/(4*np.pi)
+
+    errors = {'Rforce': relative_error(pot._Rforce(R, z), Rforce),
+              'zforce': relative_error(pot._zforce(R, z), zforce),
+              'R2deriv': relative_error(pot._R2deriv(R, z), R2deriv),
+              'z2deriv': relative_error(pot._z2deriv(R, z), z2deriv),
+              'Rzderiv': relative_error(pot._Rzderiv(R, z), Rzderiv),
+              'dens': relative_error(pot._dens(R, z), dens)}
+    print('n =', n, errors)
+    for name, error in errors.items():
+        assert error < tolerance, name
+    # the density of the potential is the density of the df
+    assert np.allclose(pot._dens(R, z), toomredf(n=n).density_cyl(R, z),
+                       rtol=1e-12)
+
+
+def test_cartesian(n, coord, tolerance=1e-6):
+    df = toomredf(n=n)
+    R, vR, vT, z, vz, phi = rect_to_cyl(*coord.T).T
+    assert np.allclose(df.evaluate_cartesian(coord), df(R, vR, vT, z, vz),
+                       rtol=1e-12)
+    numeric = np.stack([(df.evaluate_cartesian(coord + dx*e) -
+                         df.evaluate_cartesian(coord - dx*e))/(2*dx)
+                        for e in np.identity(6)], axis=1)
+    gradient = df.gradient_cartesian(coord)
+    error = np.max(np.abs(gradient - numeric))/np.max(np.abs(numeric))
+    print('n =', n, 'gradient of the df:', error)
+    assert error < tolerance
+    # the density for the main program uses the analytic gradient
+    assert np.all(df.custom_density().gradient(coord) == gradient)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    R = np.random.uniform(0.1, 3., 1000)
+    z = np.random.uniform(-2., 2., 1000)
+    for n in [0.5, 1., 2., 3.7]:
+        test_toomre_potential(n, R, z)
+    coord = np.column_stack((np.random.uniform(-1.5, 1.5, (1000, 3)),
+                             np.random.normal(0., 0.4, (1000, 3)) + 
+                             [0., 1., 0.]))
+    for n in [1., 2., 3.]:
+        test_cartesian(n, coord)
+    print('All tests passed')
@@ -83,6 +83,105 @@ class toomredf:
         
         return lz**(2*self.n)*np.exp(-E/sigma2)
     
+    def evaluate_cartesian(self, coord, use_physical=None):
+        """
+        NAME:
+            evaluate_cartesian
+            
+        PURPOSE:
+            return the DF at galactocentric Cartesian points, without
+            converting them to cylindrical coordinates
+            
+        INPUT:
+            coord - (m,6) array of (x, y, z, vx, vy, vz); natural units or kpc
+            and km/s
+            
+            use_physical - boolean override of the physical input/output setting
+            
+        OUTPUT:
+            array of shape (m,); same as __call__ at the same points
+        """
+        return self._cartesian(coord, use_physical, False)
+    
+    def gradient_cartesian(self, coord, use_physical=None):
+        """
+        NAME:
+            gradient_cartesian
+            
+        PURPOSE:
+            return the analytic gradient of the DF with respect to the
+            galactocentric Cartesian coordinates
+            
+        INPUT:
+            coord - (m,6) array of (x, y, z, vx, vy, vz); natural units or kpc
+            and km/s
+            
+            use_physical - boolean override of the physical input/output setting
+            
+        OUTPUT:
+            (m,6) array; derivatives with respect to natural units or to kpc
+            and km/s
+        """
+        return self._cartesian(coord, use_physical, True)
+    
+    def custom_density(self):
+        """
+        NAME:
+            custom_density
+            
+        PURPOSE:
+            return the DF as a density of (m,6) arrays in natural units, as
+            used by the main program, with its analytic gradient as the
+            gradient attribute, which grad_multi uses instead of finite
+            differences
+            
+        INPUT:
+            None
+            
+        OUTPUT:
+            function of (m,6) arrays, e.g. for main(custom_density=...)
+        """
+        density = lambda coord: self.evaluate_cartesian(coord, 
+                                                        use_physical=False)
+        density.gradient = lambda coord: self.gradient_cartesian(
+                coord, use_physical=False)
+        return density
+    
+    def _cartesian(self, coord, use_physical, gradient):
+        # the DF, or its gradient, at (m,6) Cartesian points
+        if use_physical is None:
+            use_physical = self.use_physical
+        
+        coord = np.array(coord, dtype=float)
+        scale = np.array([self.ro]*3 + [self.vo]*3)
+        if use_physical:
+            coord /= scale
+        
+        x, y, z, vx, vy, vz = coord.T
+        R = np.sqrt(x**2 + y**2)
+        lz = x*vy - y*vx
+        E = 0.5*(vx**2 + vy**2 + vz**2) + self.pot._evaluate(R, z)
+        sigma2 = 1/(2*self.n+2)
+        exponential = np.exp(-E/sigma2)
+        df = lz**(2*self.n)*exponential
+        if use_physical:
+            unit = (self.ro*self.vo)**(2*self.n)
+        else:
+            unit = 1.
+        if not gradient:
+            return unit*df
+        
+        Rforce = self.pot._Rforce(R, z)
+        del_lz = np.stack((vy, -vx, np.zeros_like(z), -y, x, 
+                           np.zeros_like(z)), axis=1)
+        del_E = np.stack((-Rforce*x/R, -Rforce*y/R, -self.pot._zforce(R, z),
+                          vx, vy, vz), axis=1)
+        result = (2*self.n*lz**(2*self.n-1)*exponential)[:, None]*del_lz \
+            - (df/sigma2)[:, None]*del_E
+        if use_physical:
+            result *= unit/scale
+        return result
+    
     def turn_physical_on(self):
         """
         NAME:
@@ -570,6 +669,159 @@ class ToomrePotential(Potential):
         theta = np.arcsin(R/r)
         return np.log(r) + self._P(theta)
         
+    def _Rforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+           _Rforce
+           
+        PURPOSE:
+           evaluate the radial force at R,z
+           
+        INPUT:
+           R - Galactocentric cylindrical radius
+           
+           z - vertical height
+           
+           phi - azimuth
+           
+           t - time
+           
+        OUTPUT:
+           -dPhi/dR
+        """
+        r2, g, _ = self._angular(R, z)
+        return -R/r2 + g*z*R/r2**1.5
+    
+    def _zforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+           _zforce
+           
+        PURPOSE:
+           evaluate the vertical force at R,z
+           
+        INPUT:
+           R - Galactocentric cylindrical radius
+           
+           z - vertical height
+           
+           phi - azimuth
+           
+           t - time
+           
+        OUTPUT:
+           -dPhi/dz
+        """
+        r2, g, _ = self._angular(R, z)
+        return -z/r2 - g*R**2/r2**1.5
+    
+    def _R2deriv(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+           _R2deriv
+           
+        PURPOSE:
+           evaluate the second radial derivative at R,z
+           
+        INPUT:
+           R - Galactocentric cylindrical radius
+           
+           z - vertical height
+           
+           phi - azimuth
+           
+           t - time
+           
+        OUTPUT:
+           d2Phi/dR2
+        """
+        r2, g, dg = self._angular(R, z)
+        return (z**2 - R**2)/r2**2 + dg*z**2*R**2/r2**3 \
+            - g*z*(z**2 - 2*R**2)/r2**2.5
+    
+    def _z2deriv(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+           _z2deriv
+           
+        PURPOSE:
+           evaluate the second vertical derivative at R,z
+           
+        INPUT:
+           R - Galactocentric cylindrical radius
+           
+           z - vertical height
+           
+           phi - azimuth
+           
+           t - time
+           
+        OUTPUT:
+           d2Phi/dz2
+        """
+        r2, g, dg = self._angular(R, z)
+        return (R**2 - z**2)/r2**2 + dg*R**4/r2**3 - 3*g*z*R**2/r2**2.5
+    
+    def _Rzderiv(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+           _Rzderiv
+           
+        PURPOSE:
+           evaluate the mixed radial, vertical derivative at R,z
+           
+        INPUT:
+           R - Galactocentric cylindrical radius
+           
+           z - vertical height
+           
+           phi - azimuth
+           
+           t - time
+           
+        OUTPUT:
+           d2Phi/dR/dz
+        """
+        r2, g, dg = self._angular(R, z)
+        return -2*R*z/r2**2 - dg*R**3*z/r2**3 \
+            - g*R*(R**2 - 2*z**2)/r2**2.5
+    
+    def _dens(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+           _dens
+           
+        PURPOSE:
+           evaluate the density at R,z, the density of toomredf
+           
+        INPUT:
+           R - Galactocentric cylindrical radius
+           
+           z - vertical height
+           
+           phi - azimuth
+           
+           t - time
+           
+        OUTPUT:
+           rho(R,z)
+        """
+        r2 = R**2 + z**2
+        c = z/np.sqrt(r2)
+        p = (1+c)**(self.n+1) + (1-c)**(self.n+1)
+        return (self.n+1)*(R**2/r2)**self.n/(np.pi*r2*p**2)
+    
+    def _angular(self, R, z):
+        # the potential is log(r) + P(c), with c = z/r = cos(theta) (P is
+        # even in c); return r^2, g = dP/dc and dg/dc
+        n = self.n
+        r2 = R**2 + z**2
+        c = z/np.sqrt(r2)
+        p = (1+c)**(n+1) + (1-c)**(n+1)
+        g = ((1+c)**n - (1-c)**n)/p
+        dg = n*((1+c)**(n-1) + (1-c)**(n-1))/p - (n+1)*g**2
+        return r2, g, dg
+    
     def _P(self, theta):
         return np.log(self._p(theta)/2)/(self.n+1)
     
@@ -79,6 +79,23 @@ def load_gaiarv(parallax_cut=True):
     _GAIA_LOADED = True
     _PARALLAX_CUT = parallax_cut
 
+def gaiarv_loaded(parallax_cut=True):
+    """
+    NAME:
+        gaiarv_loaded
+        
+    PURPOSE:
+        check whether the Gaia data is already loaded with the given
+        parallax_cut setting, so that searching does not need to load it
+        
+    INPUT:
+        parallax_cut - the parallax_cut setting of the search
+        
+    OUTPUT:
+        True or False
+    """
+    return _GAIA_LOADED and parallax_cut == _PARALLAX_CUT
+
 def search_phase_space(u0, v0, w0, U0, V0, W0, epsilon, v_scale,
                        parallax_cut=True, return_frame='galactocentric'):
     """
@@ -1,7 +1,20 @@
 import numpy as np
 from galpy.potential import SCFPotential, DiskSCFPotential
 
+def scf_coefficients(scf):
+    """
+    coefficients Acos of an axisymmetric SCFPotential, as given to its
+    constructor; SCFPotential keeps them multiplied by a normalization that
+    only depends on their shape, which is the Acos kept for ones
+    """
+    norm = SCFPotential(Acos=np.ones(scf._Acos.shape), a=scf._a)._Acos
+    return scf._Acos/norm
+
+
 class mySCFPotential(SCFPotential):
+    def scf_coefficients(self):
+        return scf_coefficients(self)
+    
     def _R2deriv(self,R,z,phi=0.,t=0.):
         dR= 1e-8
         return (self._Rforce(R,z) - self._Rforce(R+dR,z))/dR
@@ -16,6 +29,25 @@ class mySCFPotential(SCFPotential):
         
         
 class myDiskSCFPotential(DiskSCFPotential):
+    def __init__(self, Acos=None, **kwargs):
+        """
+        DiskSCFPotential; if the coefficients Acos of the SCF expansion of the
+        residual density are given (e.g. from scf_coefficients of a previous
+        instance with the same inputs), they are used instead of being
+        computed
+        """
+        if Acos is None:
+            DiskSCFPotential.__init__(self, **kwargs)
+            return None
+        # set up the disk with a trivial expansion, then replace it
+        kwargs.update(N=1, L=1, radial_order=None, costheta_order=None)
+        DiskSCFPotential.__init__(self, **kwargs)
+        self._scf = SCFPotential(amp=1., Acos=Acos, a=kwargs.get('a', 1.),
+                                 ro=None, vo=None)
+    
+    def scf_coefficients(self):
+        return scf_coefficients(self._scf)
+    
     def _R2deriv(self,R,z,phi=0.,t=0.):
         dR= 1e-8
         return (self._Rforce(R,z) - self._Rforce(R+dR,z))/dR
@@ -1,3 +1,5 @@
+import os
+import hashlib
 import numpy as np
 from galpy.potential import DiskSCFPotential, NFWPotential, \
     SCFPotential, scf_compute_coeffs_axi
@@ -121,13 +123,46 @@ hzdict = [{'type':'sech2', 'h':zd_HI},
           {'type':'exp', 'h':0.3/ro},
           {'type':'exp', 'h':0.9/ro}]
 
+#folder of the SCF coefficients computed on previous imports
+scf_cache = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'scf_cache')
+
+def cached_scf(name, parameters, make):
+    '''
+    SCF potential made by make(Acos), which computes the coefficients Acos
+    if they are None. The coefficients are saved in scf_cache under a key made
+    of the name and the parameters (those of the density and the expansion
+    orders), so that they are only computed on the first import.
+    '''
+    key = hashlib.sha1(repr((name, parameters)).encode()).hexdigest()
+    file_name = os.path.join(scf_cache, name + '_' + key + '.npy')
+    if os.path.exists(file_name):
+        return make(np.load(file_name))
+    potential = make(None)
+    if not os.path.exists(scf_cache):
+        os.makedirs(scf_cache)
+    np.save(file_name, potential.scf_coefficients())
+    return potential
+
+def make_bulge(Acos):
+    if Acos is None:
+        Acos = scf_compute_coeffs_axi(bulge_dens,20,10,a=0.1)[0]
+    return mySCFPotential(Acos=Acos,a=0.1,ro=ro,vo=vo)
+
+def make_disk(Acos):
+    return myDiskSCFPotential(Acos=Acos,
+                              dens=lambda R,z: gas_stellar_dens(R,z),
+                              Sigma=sigmadict, hz=hzdict,
+                              a=2.5, N=30, L=30,ro=ro,vo=vo)
+
 #generate separate disk and halo potential - and combined potential
-McMillan_bulge=\
-    mySCFPotential(Acos=scf_compute_coeffs_axi(bulge_dens,20,10,a=0.1)[0],
-                 a=0.1,ro=ro,vo=vo)
-McMillan_disk = myDiskSCFPotential(dens=lambda R,z: gas_stellar_dens(R,z),
-                                 Sigma=sigmadict, hz=hzdict,
-                                 a=2.5, N=30, L=30,ro=ro,vo=vo)
+McMillan_bulge = cached_scf('bulge',
+                            (rho0_bulge, r0_bulge, rcut, 20, 10, 0.1),
+                            make_bulge)
+McMillan_disk = cached_scf('disk',
+                           (sigmadict, hzdict, Sigma0_thin, Rd_thin, zd_thin,
+                            Sigma0_thick, Rd_thick, zd_thick, 30, 30, 2.5),
+                           make_disk)
 McMillan_halo = NFWPotential(amp = rho0_halo*(4*np.pi*rh**3),
                              a = rh,ro=ro,vo=vo)
 McMillan2017 = [McMillan_disk,McMillan_halo,McMillan_bulge]
@@ -5,16 +5,17 @@ import numpy as np
 import pylab as plt
 from mpl_toolkits.mplot3d import Axes3D
 from Integral_of_Motion import Energy, L_z
-from bokeh.io import output_file, show
+from bokeh.io import output_file, show, save
 from bokeh.layouts import gridplot
 from bokeh.models import ColumnDataSource, ColorBar, LinearColorMapper, CustomJS, Button, Div
 from bokeh.plotting import figure
+from bokeh.transform import linear_cmap
 from bokeh.models.annotations import Title
 import matplotlib as mpl
 import pylab as plt
 
 
-def kmeans_plot(samples, cluster, file_name):
+def kmeans_plot(samples, cluster, file_name, rasterize = False, bins = 512):
     """
     NAME:
         kmeans_plot
@@ -26,6 +27,10 @@ def kmeans_plot(samples, cluster, file_name):
         samples = a numpy array storing samples
         cluster = a numpy array storing cluster centers
         file_name = a string
+        rasterize = if True, draw the samples as an image of the number of
+                    samples per pixel instead of one marker per sample, which
+                    is much faster and smaller for large samples
+        bins = number of pixels along each axis of the rasterized image
 
     OUTPUT:
         None
@@ -37,7 +42,15 @@ def kmeans_plot(samples, cluster, file_name):
         # create graph of kmeans projection in 2 dimension
         fig = plt.figure(figsize=(8, 8), facecolor='black')
         # only plot projection of samples in x and y dimension
-        plt.scatter(samples[:,0], samples[:,1], s=1, c='blue')
+        if rasterize:
+            image, extent = rasterize_points(samples[:,0], samples[:,1],
+                                             bins = bins)
+            image[image == 0] = np.nan
+            plt.imshow(image, extent = extent, origin = 'lower', 
+                       aspect = 'auto', interpolation = 'nearest', 
+                       cmap = 'Blues_r', norm = mpl.colors.LogNorm())
+        else:
+            plt.scatter(samples[:,0], samples[:,1], s=1, c='blue')
         plt.scatter(cluster[:, 0], cluster[:, 1], s=1, c='red')
         plt.title("K-Means Cluster Centers in xy Dimension", fontsize=20)
         plt.xlabel('$x/R_0$', fontsize = 15)
@@ -91,7 +104,8 @@ def dot_product_plot(max_dot_product, cluster, file_name):
         plt.show()
     
     
-def color_plot_ij(result, cluster, file_name, uniformity_method, i, j):
+def color_plot_ij(result, cluster, file_name, uniformity_method, i, j,
+                  rasterize = False, bins = 256, reduction = 'mean'):
     """
     NAME:
         color_plot_ij
@@ -108,6 +122,12 @@ def color_plot_ij(result, cluster, file_name, uniformity_method, i, j):
         cluster = a numpy array storing cluster centers
         file_name = a string
         uniformity_method = "projection" or "dot product"
+        i, j = indices of the projection axes
+        rasterize = if True, draw an image in which each pixel is colored by
+                    the mean or maximum result of the cluster centres in it,
+                    instead of one marker per cluster centre
+        bins = number of pixels along each axis of the rasterized image
+        reduction = 'mean' or 'max'; how results in a pixel are combined
 
     OUTPUT:
         None
@@ -123,8 +143,15 @@ def color_plot_ij(result, cluster, file_name, uniformity_method, i, j):
         # we need to use the transpose to get all the components, instead of 
         # 6 components for each star.
         # set the color to the result
-        plt.scatter(*cluster.T[[i,j]], c=result, marker='.', s=5, 
-                    cmap='plasma', vmin=0, vmax=1)
+        if rasterize:
+            image, extent = rasterize_points(*cluster.T[[i,j]], result,
+                                             reduction, bins)
+            plt.imshow(image, extent = extent, origin = 'lower', 
+                       aspect = 'auto', interpolation = 'nearest',
+                       cmap = 'plasma', vmin = 0, vmax = 1)
+        else:
+            plt.scatter(*cluster.T[[i,j]], c=result, marker='.', s=5, 
+                        cmap='plasma', vmin=0, vmax=1)
         if uniformity_method == "dot product":
             plt.colorbar(label='Maximum Absolute Dot Product')
         elif uniformity_method == "projection":
@@ -178,31 +205,94 @@ def get_axis_from_index(i):
             ['vy', 'v_0'], ['vz', 'v_0']]
     return axis[i]
 
-def color_plot(result, cluster, file_name, uniformity_method, 
-               custom_potential = None):
+
+def rasterize_points(x, y, values = None, reduction = 'count', bins = 512,
+                     extent = None):
     """
     NAME:
-        color_plot
+        rasterize_points
 
     PURPOSE:
-        Given result and cluster, plot all possible 2 dimensional projection
-        scatter plot with color corresponding to result values. Save all the 
-        graph in the corresponding folder.
+        Bin points into a fixed resolution image in one vectorized pass, so
+        that the cost of a plot grows linearly with the number of points and
+        the size of the figure does not grow at all. Each pixel holds the
+        number of points in it, or the mean or maximum of their values.
+
+    INPUT:
+        x, y = arrays of the coordinates of the points
+        values = array of the values of the points; needed by 'mean' and 'max'
+        reduction = 'count', 'mean' or 'max'
+        bins = number of pixels along each axis
+        extent = [xmin, xmax, ymin, ymax]; default is the range of the points
+
+    OUTPUT:
+        (image, extent); image has shape (bins, bins) with y along the first
+        axis, ready for imshow with origin='lower'; pixels without points are
+        0 for 'count' and nan otherwise
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    good = np.isfinite(x) & np.isfinite(y)
+    if values is not None:
+        values = np.asarray(values, dtype=float)
+        good &= np.isfinite(values)
+    elif reduction != 'count':
+        raise ValueError("reduction '{}' needs values".format(reduction))
+    if extent is None:
+        if np.any(good):
+            extent = [np.min(x[good]), np.max(x[good]), 
+                      np.min(y[good]), np.max(y[good])]
+        else:
+            extent = [0., 1., 0., 1.]
+    xmin, xmax, ymin, ymax = [float(e) for e in extent]
+    # avoid a zero width range when all points share a coordinate
+    if xmax <= xmin:
+        xmin, xmax = xmin - 0.5, xmax + 0.5
+    if ymax <= ymin:
+        ymin, ymax = ymin - 0.5, ymax + 0.5
+    good &= (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+    
+    # pixel index of every point; points on the upper edge go in the last bin
+    ix = np.minimum(((x[good] - xmin)*(bins/(xmax - xmin))).astype(np.intp),
+                    bins - 1)
+    iy = np.minimum(((y[good] - ymin)*(bins/(ymax - ymin))).astype(np.intp),
+                    bins - 1)
+    pixel = iy*bins + ix
+    
+    count = np.bincount(pixel, minlength = bins*bins)
+    if reduction == 'count':
+        image = count.astype(float)
+    elif reduction == 'mean':
+        total = np.bincount(pixel, weights = values[good], 
+                            minlength = bins*bins)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            image = total/count
+    elif reduction == 'max':
+        image = np.full(bins*bins, -np.inf)
+        np.maximum.at(image, pixel, values[good])
+        image[count == 0] = np.nan
+    else:
+        raise ValueError("reduction must be 'count', 'mean' or 'max'")
+    return image.reshape(bins, bins), [xmin, xmax, ymin, ymax]
+
+
+def prepare_color_plot(result, cluster, uniformity_method):
+    """
+    NAME:
+        prepare_color_plot
+
+    PURPOSE:
+        Reduce dot product results to their maximum absolute value and filter
+        out the cluster centres where the result is nan, as needed by
+        color_plot_summary and color_plot_ij.
 
     INPUT:
         result = a numpy array storing the result at each cluster center
         cluster = a numpy array storing cluster centers
-        file_name = a string
         uniformity_method = "projection" or "dot product"
-        custom_potential = potential used to evaluate energy; default = 
-                           MWPotential2014
 
     OUTPUT:
-        None
-
-    HISTORY:
-        2018-07-03 - Written - Samuel Wong
-        2018-07-23 - Added uniformity method - Samuel Wong
+        (result, cluster)
     """
     # only work with the largest dot product, if that it is the input
     if uniformity_method == "dot product":
@@ -211,7 +301,31 @@ def color_plot(result, cluster, file_name, uniformity_method,
     # filter out nan
     cluster = cluster[~np.isnan(result)]
     result = result[~np.isnan(result)]
-        
+    return result, cluster
+
+
+def color_plot_summary(result, cluster, file_name, uniformity_method,
+                       custom_potential = None):
+    """
+    NAME:
+        color_plot_summary
+
+    PURPOSE:
+        Plot the histogram of the result and the scatter plot of the result in
+        the L_z-E plane. Takes the output of prepare_color_plot.
+
+    INPUT:
+        result = a numpy array storing the result at each cluster center,
+                 without nan
+        cluster = a numpy array storing cluster centers
+        file_name = a string
+        uniformity_method = "projection" or "dot product"
+        custom_potential = potential used to evaluate energy; default = 
+                           MWPotential2014
+
+    OUTPUT:
+        None
+    """
     energy = Energy(cluster, custom_potential)
     angular_momentum = L_z(cluster)
             
@@ -253,11 +367,45 @@ def color_plot(result, cluster, file_name, uniformity_method,
             plt.title('Maximum Absolute Value of Dot Product in $L_z-E$ Dimension')
             plt.savefig('main_program_results/' + file_name + 
                         '/color dot product L_z-E figure.png')
+
+
+def color_plot(result, cluster, file_name, uniformity_method, 
+               custom_potential = None, rasterize = False):
+    """
+    NAME:
+        color_plot
+
+    PURPOSE:
+        Given result and cluster, plot all possible 2 dimensional projection
+        scatter plot with color corresponding to result values. Save all the 
+        graph in the corresponding folder.
+
+    INPUT:
+        result = a numpy array storing the result at each cluster center
+        cluster = a numpy array storing cluster centers
+        file_name = a string
+        uniformity_method = "projection" or "dot product"
+        custom_potential = potential used to evaluate energy; default = 
+                           MWPotential2014
+        rasterize = if True, draw the projections as images; see
+                    color_plot_ij
+
+    OUTPUT:
+        None
+
+    HISTORY:
+        2018-07-03 - Written - Samuel Wong
+        2018-07-23 - Added uniformity method - Samuel Wong
+    """
+    result, cluster = prepare_color_plot(result, cluster, uniformity_method)
+    color_plot_summary(result, cluster, file_name, uniformity_method,
+                       custom_potential)
             
     # go through al combinations of axis projection and plot them
     for i in range(6):
         for j in range(i + 1, 6):
-            color_plot_ij(result, cluster, file_name, uniformity_method, i, j)
+            color_plot_ij(result, cluster, file_name, uniformity_method, i, j,
+                          rasterize)
 
 def error_plot_ij(errors, cluster, file_name, uniformity_method, i, j):
     """
@@ -503,8 +651,11 @@ def color_plot_ij_bokeh(source, TOOLS, i, j, all_proj, counter, uniformity_metho
     
     
     # create plot    
-    proj = figure(tools=TOOLS, plot_width=350, plot_height=300)
-    proj.scatter('{}'.format(x_axis), '{}'.format(y_axis), color='colours', size=0.5, fill_alpha=1, line_alpha=1, alpha=1, source=source)
+    # colours are mapped from the result in the browser and drawn with WebGL
+    proj = figure(tools=TOOLS, width=350, height=300, output_backend="webgl")
+    proj.scatter('{}'.format(x_axis), '{}'.format(y_axis), 
+                 color=linear_cmap('result', "Plasma256", 0, 1), size=0.5, 
+                 fill_alpha=1, line_alpha=1, alpha=1, source=source)
     proj.outline_line_color = None
     proj.border_fill_color = None
     proj.xgrid.grid_line_alpha = 0.2
@@ -519,7 +670,73 @@ def color_plot_ij_bokeh(source, TOOLS, i, j, all_proj, counter, uniformity_metho
     all_proj[counter] = proj
 
 
-def color_plot_bokeh(result, cluster, file_name, uniformity_method):
+def decimate(result, max_points, n_strata = 20, random_state = None):
+    """
+    NAME:
+        decimate
+
+    PURPOSE:
+        Choose at most max_points points at random, stratified by result, so
+        that every range of results keeps its share of the points and small
+        groups of extreme results are not lost.
+
+    INPUT:
+        result = a numpy array storing the result at each point, in [0, 1]
+        max_points = maximum number of points kept
+        n_strata = number of equal width ranges of result in [0, 1]
+        random_state = seed of the random choice
+
+    OUTPUT:
+        sorted array of the indices of the points kept
+    """
+    n = len(result)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+    rng = np.random.RandomState(random_state)
+    stratum = np.clip((result*n_strata).astype(np.intp), 0, n_strata - 1)
+    size = np.bincount(stratum, minlength = n_strata)
+    # every non empty stratum keeps at least one point
+    quota = np.where(size > 0, 
+                     np.maximum(size*max_points//n, 1), 0)
+    # rank the points of each stratum in a random order and keep the first
+    order = np.lexsort((rng.random_sample(n), stratum))
+    start = np.cumsum(size) - size
+    rank = np.empty(n, dtype = np.intp)
+    rank[order] = np.arange(n) - start[stratum[order]]
+    return np.flatnonzero(rank < quota[stratum])
+
+
+def bokeh_source(result, cluster, max_points = None, random_state = None):
+    """
+    NAME:
+        bokeh_source
+
+    PURPOSE:
+        Build the ColumnDataSource shared by the linked bokeh plots. Only the
+        coordinates and the result are stored, as float32 arrays that bokeh
+        embeds as binary buffers; colours are mapped in the browser.
+
+    INPUT:
+        result = a numpy array storing the result at each cluster center,
+                 without nan
+        cluster = a numpy array storing cluster centers
+        max_points = if not None, at most this many points are kept; see
+                     decimate
+        random_state = seed of the decimation
+
+    OUTPUT:
+        ColumnDataSource
+    """
+    keep = decimate(result, max_points, random_state = random_state)
+    cluster = np.asarray(cluster[keep], dtype = np.float32)
+    data = {get_axis_from_index(i)[0]: np.ascontiguousarray(cluster[:, i])
+            for i in range(6)}
+    data['result'] = np.asarray(result[keep], dtype = np.float32)
+    return ColumnDataSource(data = data)
+
+
+def color_plot_bokeh(result, cluster, file_name, uniformity_method,
+                     show_plot = True, max_points = None):
     """
     NAME:
         color_plot
@@ -533,6 +750,11 @@ def color_plot_bokeh(result, cluster, file_name, uniformity_method):
         source = dictionary-like data struction in Bokeh to update selected values in real-time
         TOOLS = list of tools used in bokeh plots
         uniformity method = dot product/projection, projection refers to fractional length
+        show_plot = if True, open the plots in a browser; otherwise only save
+                    them, which is what headless rendering needs
+        max_points = if not None, the plots show at most this many points,
+                     chosen at random stratified by result; the average
+                     shown by the button is then that of the points shown
 
     OUTPUT:
         None
@@ -551,11 +773,9 @@ def color_plot_bokeh(result, cluster, file_name, uniformity_method):
     # Full range
     cluster = cluster[~np.isnan(result)]
     result = result[~np.isnan(result)]
-    colours = ["#%02x%02x%02x" % (int(r), int(g), int(b)) for r, g, b, _ in 255*mpl.cm.plasma(mpl.colors.Normalize()(result))]
           
     # create a column data source for the plots to share
-    source = ColumnDataSource(data=dict(x=cluster.T[0], y=cluster.T[1], z=cluster.T[2],
-                                        vx=cluster.T[3], vy=cluster.T[4], vz=cluster.T[5], result=result, colours=colours))
+    source = bokeh_source(result, cluster, max_points)
     
     #denote interactive tools for linked plots
     TOOLS = "box_select,lasso_select"
@@ -593,9 +813,9 @@ def color_plot_bokeh(result, cluster, file_name, uniformity_method):
     else:
         button = Button(label='Projection Method', button_type='warning', width=350)
         
-    button.callback = CustomJS(args=dict(source=source), 
+    button.js_on_click(CustomJS(args=dict(source=source), 
                                code="""
-                               var inds = source.selected['1d'].indices;
+                               var inds = source.selected.indices;
                                var data = source.data;
                                var selected_dp = 0.;
                                var total_dp = 0.;
@@ -614,12 +834,16 @@ def color_plot_bokeh(result, cluster, file_name, uniformity_method):
                                    window.alert("No points chosen. Average Result (of all points) = " + (total_dp/data['result'].length).toFixed(2));
                                }
                           
-                               """)
+                               """))
     
-    show(gridplot([[all_proj[0],  button,       all_proj[2], all_proj[6], all_proj[9]], 
-                   [all_proj[1],  all_proj[5],  all_proj[3], all_proj[7], all_proj[10]],
-                   [all_proj[12], None,         all_proj[4], all_proj[8], all_proj[11]],
-                   [all_proj[13], all_proj[14], None,        None,        None]]))
+    grid = gridplot([[all_proj[0],  button,       all_proj[2], all_proj[6], all_proj[9]], 
+                     [all_proj[1],  all_proj[5],  all_proj[3], all_proj[7], all_proj[10]],
+                     [all_proj[12], None,         all_proj[4], all_proj[8], all_proj[11]],
+                     [all_proj[13], all_proj[14], None,        None,        None]])
+    if not show_plot:
+        save(grid)
+        return
+    show(grid)
         
     # Show twice to compare when selecting regions    
     show(gridplot([[all_proj[0],  button,       all_proj[2], all_proj[6], all_proj[9]], 
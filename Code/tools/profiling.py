@@ -0,0 +1,172 @@
+"""
+NAME:
+    profiling
+
+PURPOSE:
+    Record the cost of each stage of a run of the main program: wall time,
+    CPU time, peak resident set size of the process and peak memory traced by
+    tracemalloc, as well as the number of calls to (and points evaluated by)
+    functions such as the density. The report is saved as JSON.
+"""
+import sys
+import json
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+
+def peak_rss():
+    """
+    NAME:
+        peak_rss
+
+    PURPOSE:
+        return the peak resident set size of the process so far
+
+    INPUT:
+        None
+
+    OUTPUT:
+        peak resident set size in bytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return rss
+
+
+class Profiler:
+    """
+    Class recording the cost of the stages of a run
+    """
+    def __init__(self, enabled=True, trace_memory=True):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a Profiler
+
+        INPUT:
+            enabled - if False, nothing is recorded; used when no
+            instrumentation is wanted
+
+            trace_memory - if True, use tracemalloc to record the peak memory
+            allocated in each stage
+
+        OUTPUT:
+            None
+        """
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.stages = []
+        self.counters = {}
+        self._start = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        NAME:
+            stage
+
+        PURPOSE:
+            context manager recording the cost of the code run inside it
+
+        INPUT:
+            name - name of the stage
+
+        OUTPUT:
+            None
+        """
+        if not self.enabled:
+            yield
+            return
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            record = {'stage': name,
+                      'wall_time': time.perf_counter() - wall_start,
+                      'cpu_time': time.process_time() - cpu_start,
+                      'peak_rss': peak_rss()}
+            if self.trace_memory:
+                record['peak_traced_memory'] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(record)
+
+    def count(self, name, function):
+        """
+        NAME:
+            count
+
+        PURPOSE:
+            wrap a function of an (m,n) array of points so that the number of
+            calls and of points evaluated are recorded under the given name
+
+        INPUT:
+            name - name of the counter
+
+            function - function taking an array of points as first argument;
+            its gradient attribute, if any, is wrapped too
+
+        OUTPUT:
+            the wrapped function, or function itself if the profiler is
+            disabled
+        """
+        if not self.enabled:
+            return function
+        counter = self.counters.setdefault(name, {'calls': 0, 'points': 0})
+
+        def counted(points, *args, **kwargs):
+            counter['calls'] += 1
+            counter['points'] += len(points) if getattr(points, 'ndim', 1) > 1 \
+                else 1
+            return function(points, *args, **kwargs)
+        if hasattr(function, 'gradient'):
+            # keep the analytic gradient used by grad_multi, counted with
+            # the function
+            counted.gradient = self.count(name, function.gradient)
+        return counted
+
+    def report(self):
+        """
+        NAME:
+            report
+
+        PURPOSE:
+            return everything recorded so far
+
+        INPUT:
+            None
+
+        OUTPUT:
+            dictionary with the list of stages, the counters and the total
+            wall time since the profiler was created
+        """
+        return {'stages': self.stages, 'counters': self.counters,
+                'total_wall_time': time.perf_counter() - self._start}
+
+    def save(self, file_name):
+        """
+        NAME:
+            save
+
+        PURPOSE:
+            save the report as JSON; does nothing if the profiler is disabled
+
+        INPUT:
+            file_name - path of the JSON file
+
+        OUTPUT:
+            None
+        """
+        if not self.enabled:
+            return
+        with open(file_name, 'w') as f:
+            json.dump(self.report(), f, indent=1)
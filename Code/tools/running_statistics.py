@@ -0,0 +1,387 @@
+"""
+NAME:
+    running_statistics
+
+PURPOSE:
+    Accumulate the mean and variance of the results of resampling replicates
+    (bootstrap resamples, jackknife folds) one replicate at a time, with
+    Welford's online algorithm, instead of keeping every replicate in memory.
+    The statistics, the replicates already done and, optionally, the raw
+    results at a few cluster centres are checkpointed to an npz file, so that
+    a run that is stopped resumes from the last completed replicate.
+
+HOW TO USE:
+    replicates = ReplicateStatistics(path, n_replicates, settings, seed)
+    for i in replicates.remaining():
+        replicates.add(i, result=evaluate(i))
+    replicates.save()
+    errors = replicates['result'].std()
+"""
+import os
+import json
+import numpy as np
+
+
+class RunningStatistics:
+    """
+    Class accumulating the element-wise mean, variance and third and fourth
+    central moments of arrays of the same shape, ignoring nan
+    """
+    def __init__(self):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize an empty RunningStatistics
+
+        INPUT:
+            None
+
+        OUTPUT:
+            None
+        """
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.m3 = None
+        self.m4 = None
+
+    def add(self, x):
+        """
+        NAME:
+            add
+
+        PURPOSE:
+            add one array to the statistics; nan elements are not counted
+
+        INPUT:
+            x - array of the shape of all arrays added
+
+        OUTPUT:
+            None
+        """
+        x = np.asarray(x, dtype=float)
+        if self.count is None:
+            self.count = np.zeros(x.shape, dtype=int)
+            self.mean = np.zeros(x.shape)
+            self.m2 = np.zeros(x.shape)
+            self.m3 = np.zeros(x.shape)
+            self.m4 = np.zeros(x.shape)
+        good = ~np.isnan(x)
+        self.count += good
+        n = self.count
+        delta = np.where(good, x - self.mean, 0.)
+        delta_n = delta/np.maximum(n, 1)
+        term = delta*delta_n*(n - 1)
+        # the higher moments are updated with the lower ones of the previous
+        # step, as in Terriberry's extension of Welford's algorithm
+        self.mean += delta_n
+        self.m4 += term*delta_n**2*(n*n - 3*n + 3) + \
+            6*delta_n**2*self.m2 - 4*delta_n*self.m3
+        self.m3 += term*delta_n*(n - 2) - 3*delta_n*self.m2
+        self.m2 += term
+
+    def variance(self, ddof=0):
+        """
+        NAME:
+            variance
+
+        PURPOSE:
+            return the variance of the arrays added, as np.nanvar
+
+        INPUT:
+            ddof - delta degrees of freedom
+
+        OUTPUT:
+            array of variances; nan where fewer than ddof + 1 values were added
+        """
+        variance = np.full(self.m2.shape, np.nan)
+        np.divide(self.m2, self.count - ddof, out=variance,
+                  where=self.count > ddof)
+        return variance
+
+    def std(self, ddof=0):
+        """
+        NAME:
+            std
+
+        PURPOSE:
+            return the standard deviation of the arrays added, as np.nanstd
+
+        INPUT:
+            ddof - delta degrees of freedom
+
+        OUTPUT:
+            array of standard deviations
+        """
+        return np.sqrt(self.variance(ddof))
+
+    def std_error(self):
+        """
+        NAME:
+            std_error
+
+        PURPOSE:
+            return the standard error of the standard deviation of the arrays
+            added, from their second and fourth central moments,
+            sqrt((mu_4 - mu_2^2)/n)/(2 sigma)
+
+        INPUT:
+            None
+
+        OUTPUT:
+            array of standard errors; nan where fewer than 2 values were added
+            or the standard deviation is 0
+        """
+        n = np.where(self.count > 1, self.count, np.nan)
+        mu2 = self.m2/n
+        mu4 = self.m4/n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error = np.sqrt(np.maximum(mu4 - mu2**2, 0.)/n)/(2*np.sqrt(mu2))
+        return np.where(mu2 > 0, error, np.nan)
+
+    def sum_of_squares(self, reference):
+        """
+        NAME:
+            sum_of_squares
+
+        PURPOSE:
+            return the sum of the squared deviations of the arrays added from
+            a reference, such as the result of the full sample for a
+            jackknife
+
+        INPUT:
+            reference - array broadcastable to the shape of the arrays added
+
+        OUTPUT:
+            array of sums of squared deviations
+        """
+        return self.m2 + self.count*(self.mean - reference)**2
+
+    def state(self):
+        """
+        NAME:
+            state
+
+        PURPOSE:
+            return the arrays from which the statistics can be restored
+
+        INPUT:
+            None
+
+        OUTPUT:
+            dictionary of arrays
+        """
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2,
+                'm3': self.m3, 'm4': self.m4}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        NAME:
+            from_state
+
+        PURPOSE:
+            restore statistics saved with state
+
+        INPUT:
+            state - dictionary returned by state
+
+        OUTPUT:
+            RunningStatistics
+        """
+        statistics = cls()
+        statistics.count = np.array(state['count'])
+        statistics.mean = np.array(state['mean'])
+        statistics.m2 = np.array(state['m2'])
+        statistics.m3 = np.array(state['m3'])
+        statistics.m4 = np.array(state['m4'])
+        return statistics
+
+
+class ReplicateStatistics:
+    """
+    Class accumulating the statistics of the replicates of a resampling run
+    and checkpointing them to disk
+    """
+    def __init__(self, path, n_replicates, settings, seed=None, keep=None,
+                 checkpoint_every=1, resume=True):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            start the statistics of a run, or resume them from the checkpoint
+            at path if it was made with the same settings
+
+        INPUT:
+            path - path of the npz checkpoint
+
+            n_replicates - number of replicates of the run
+
+            settings - dictionary of the settings of the run, which must be
+            serializable to JSON; a checkpoint made with other settings is
+            not resumed
+
+            seed - entropy of the random numbers of the run; None to take it
+            from the checkpoint or, without one, to draw a new one
+
+            keep - indices of the cluster centres (along the first axis of the
+            results) whose raw result in every replicate is stored; None to
+            store none
+
+            checkpoint_every - number of replicates added between two
+            checkpoints
+
+            resume - if False, ignore any existing checkpoint
+
+        OUTPUT:
+            None
+        """
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.settings = dict(settings, n_replicates=n_replicates)
+        self.statistics = {}
+        self.kept = {}
+        self.kept_replicates = []
+        # records of the convergence of the run, appended by its caller
+        self.trace = []
+        self.keep = None if keep is None else np.asarray(keep, dtype=int)
+        self.done = np.zeros(n_replicates, dtype=bool)
+        self._unsaved = 0
+
+        if resume and os.path.exists(path):
+            self._load(seed)
+        else:
+            self.seed = np.random.SeedSequence(seed).entropy
+
+    def _load(self, seed):
+        with np.load(self.path) as data:
+            saved = json.loads(str(data['settings']))
+            saved_seed = saved.pop('seed')
+            if saved != self.settings or seed not in (None, saved_seed):
+                raise ValueError('the checkpoint {} was made with other '
+                                 'settings; remove it or do not resume'
+                                 .format(self.path))
+            self.seed = saved_seed
+            self.done = data['done']
+            self.trace = json.loads(str(data['trace']))
+            if 'keep' in data:
+                self.keep = data['keep']
+                self.kept_replicates = list(data['kept replicates'])
+            for name in json.loads(str(data['names'])):
+                self.statistics[name] = RunningStatistics.from_state(
+                        {key: data[name + ' ' + key]
+                         for key in ['count', 'mean', 'm2', 'm3', 'm4']})
+                if name + ' kept' in data:
+                    self.kept[name] = list(data[name + ' kept'])
+
+    def __getitem__(self, name):
+        return self.statistics[name]
+
+    def remaining(self):
+        """
+        NAME:
+            remaining
+
+        PURPOSE:
+            return the indices of the replicates not done yet
+
+        INPUT:
+            None
+
+        OUTPUT:
+            array of indices
+        """
+        return np.flatnonzero(~self.done)
+
+    def add(self, index, **values):
+        """
+        NAME:
+            add
+
+        PURPOSE:
+            add the results of one replicate and checkpoint if
+            checkpoint_every replicates were added since the last checkpoint
+
+        INPUT:
+            index - index of the replicate
+
+            values - arrays of the replicate, by name (e.g. result=...)
+
+        OUTPUT:
+            None
+        """
+        self._add(index, values)
+        self._checkpoint()
+
+    def add_batch(self, indices, **values):
+        """
+        NAME:
+            add_batch
+
+        PURPOSE:
+            add the results of several replicates, checkpointing at most once
+
+        INPUT:
+            indices - indices of the replicates
+
+            values - arrays whose first axis runs over the replicates, by name
+
+        OUTPUT:
+            None
+        """
+        for k, index in enumerate(indices):
+            self._add(index, {name: value[k]
+                              for name, value in values.items()})
+        self._checkpoint()
+
+    def _add(self, index, values):
+        for name, value in values.items():
+            self.statistics.setdefault(name, RunningStatistics()).add(value)
+            if self.keep is not None and np.ndim(value) > 0:
+                self.kept.setdefault(name, []).append(
+                        np.asarray(value)[self.keep])
+        if self.keep is not None:
+            self.kept_replicates.append(index)
+        self.done[index] = True
+        self._unsaved += 1
+
+    def _checkpoint(self):
+        if self._unsaved >= self.checkpoint_every:
+            self.save()
+
+    def save(self):
+        """
+        NAME:
+            save
+
+        PURPOSE:
+            write the checkpoint; the file is replaced atomically, so that a
+            run stopped while saving keeps its previous checkpoint
+
+        INPUT:
+            None
+
+        OUTPUT:
+            None
+        """
+        arrays = {'settings': json.dumps(dict(self.settings, seed=self.seed)),
+                  'names': json.dumps(list(self.statistics)),
+                  'done': self.done,
+                  'trace': json.dumps(self.trace)}
+        for name, statistics in self.statistics.items():
+            for key, value in statistics.state().items():
+                arrays[name + ' ' + key] = value
+        if self.keep is not None:
+            arrays['keep'] = self.keep
+            arrays['kept replicates'] = np.array(self.kept_replicates,
+                                                 dtype=int)
+            for name, kept in self.kept.items():
+                arrays[name + ' kept'] = np.array(kept)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, self.path)
+        self._unsaved = 0
@@ -10,6 +10,7 @@ HISTORY:
     2018-05-31 - Written - Samuel Wong
     2018-06-19 - Added Amount of Standard Deviation Cut function - Michael Poon
 """
+import hashlib
 import numpy as np
 import astropy.units as unit
 from astropy.coordinates import SkyCoord, CartesianRepresentation, CartesianDifferential
@@ -225,7 +226,8 @@ def get_star_coord_from_user():
 
 
 def create_meshgrid(xy_min, xy_max, xy_spacing, z_min, z_max, z_spacing,
-                    vxy_min, vxy_max, vxy_spacing, vz_min, vz_max, vz_spacing):
+                    vxy_min, vxy_max, vxy_spacing, vz_min, vz_max, vz_spacing,
+                    mask=None):
     """
     NAME:
         create_meshgrid
@@ -243,11 +245,16 @@ def create_meshgrid(xy_min, xy_max, xy_spacing, z_min, z_max, z_spacing,
         be the same. We assume the circle of Milky Way stars is symmetric in x, y, vx and vy.
         vxy_min and vxy_max refers to the bounds of vx and vy as the same.
 
+        mask = None, or a function of a (k,6) array of points returning
+        whether each point is kept, e.g. not_at_origin
+
     OUTPUT:
-        numpy array of 6 dimensional tuples, in the order of (x, y, z, vx, vy, vy)
+        MeshGrid of 6 dimensional points, in the order of (x, y, z, vx, vy, vy),
+        and in the order of the rows of the flattened np.meshgrid; its points
+        are only generated when indexed or iterated over.
         x, y and x are in kpc.
         vx, vy and vz are in km/s.
-        We artifically remove any point whose (x,y,z) = (0,0,0)
+        Points whose (x,y,z) = (0,0,0) are removed with mask = not_at_origin
 
     HISTORY:
         2018-06-04 - Written - Michael Poon
@@ -260,18 +267,166 @@ def create_meshgrid(xy_min, xy_max, xy_spacing, z_min, z_max, z_spacing,
     vy = np.arange(vxy_min, vxy_max + vxy_spacing, vxy_spacing)
     vz = np.arange(vz_min, vz_max + vz_spacing, vz_spacing)
 
-    x_values, y_values, z_values, vx_values, vy_values, vz_values = np.meshgrid(x, y, z, vx, vy, vz)
+    return MeshGrid(x, y, z, vx, vy, vz, mask=mask)
 
-    x_values = x_values.reshape(-1, 1)  # -1 is flatten and 1 is put into 1D column
-    y_values = y_values.reshape(-1, 1)
-    z_values = z_values.reshape(-1, 1)
-    vx_values = vx_values.reshape(-1, 1)
-    vy_values = vy_values.reshape(-1, 1)
-    vz_values = vz_values.reshape(-1, 1)
 
-    meshgrid = np.concatenate((x_values, y_values, z_values, vx_values, vy_values, vz_values), axis=1)
-    
-    return meshgrid
+def not_at_origin(points):
+    """
+    NAME:
+        not_at_origin
+
+    PURPOSE:
+        mask of a MeshGrid removing the points whose position is the origin,
+        where the energy is not defined
+
+    INPUT:
+        points - (k,6) array of points
+
+    OUTPUT:
+        boolean array of shape (k,), False at the origin
+    """
+    return np.any(points[:, :3] != 0, axis=1)
+
+
+class MeshGrid:
+    """
+    Class generating the points of a meshgrid on demand from their indices,
+    instead of holding them all in memory
+    """
+    def __init__(self, *axes, indexing='xy', mask=None, block_size=100000):
+        """
+        NAME:
+            __init__
+
+        PURPOSE:
+            initialize a MeshGrid with the points of
+            np.meshgrid(*axes, indexing=indexing), flattened and stacked as
+            columns
+
+        INPUT:
+            axes - 1d arrays of the values along each dimension
+
+            indexing - 'xy' or 'ij', as for np.meshgrid; with 'xy', the
+            second axis varies slowest
+
+            mask - None, or a function of a (k, number of axes) array of
+            points returning whether each point is kept
+
+            block_size - number of points generated at a time when counting
+            the points kept by the mask
+
+        OUTPUT:
+            None
+        """
+        if indexing not in ('xy', 'ij'):
+            raise ValueError("indexing must be 'xy' or 'ij'")
+        self.axes = [np.asarray(axis, dtype=float) for axis in axes]
+        self.mask = mask
+        self.block_size = block_size
+        # order in which the axes vary, from the slowest
+        self._order = list(range(len(axes)))
+        if indexing == 'xy' and len(axes) > 1:
+            self._order[0], self._order[1] = 1, 0
+        self._shape = tuple(len(self.axes[i]) for i in self._order)
+        self.size = int(np.prod(self._shape))
+        # cumulative number of points kept before each block
+        self._kept = None
+
+    def _points(self, start, stop):
+        # the points of indices start to stop of the unmasked grid
+        indices = np.unravel_index(np.arange(start, stop), self._shape)
+        points = np.empty((stop - start, len(self.axes)))
+        for axis, index in zip(self._order, indices):
+            points[:, axis] = self.axes[axis][index]
+        return points
+
+    def _block(self, block):
+        # the points kept of a block of the unmasked grid
+        points = self._points(block*self.block_size,
+                              min((block + 1)*self.block_size, self.size))
+        return points[self.mask(points)]
+
+    def _count(self):
+        # count the points kept in every block, once
+        if self._kept is None:
+            n_blocks = -(-self.size//self.block_size)
+            counts = [len(self._block(block)) for block in range(n_blocks)]
+            self._kept = np.concatenate(([0], np.cumsum(counts)))
+        return self._kept
+
+    def __len__(self):
+        if self.mask is None:
+            return self.size
+        return int(self._count()[-1])
+
+    @property
+    def shape(self):
+        return (len(self), len(self.axes))
+
+    def __getitem__(self, key):
+        """
+        NAME:
+            __getitem__
+
+        PURPOSE:
+            return a point or the points of a slice
+
+        INPUT:
+            key - index or slice of the points kept
+
+        OUTPUT:
+            array of shape (number of axes,) for an index, or (k, number of
+            axes) for a slice
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return np.array([self[i] for i in range(start, stop, step)]
+                                ).reshape(-1, len(self.axes))
+            return self._slice(start, max(start, stop))
+        index = int(key)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('index out of range')
+        return self._slice(index, index + 1)[0]
+
+    def _slice(self, start, stop):
+        # the kept points of indices start to stop
+        if self.mask is None:
+            return self._points(start, stop)
+        kept = self._count()
+        first = np.searchsorted(kept, start, side='right') - 1
+        last = np.searchsorted(kept, stop, side='left')
+        blocks = [self._block(block) for block in range(first, last)]
+        points = np.concatenate(blocks) if blocks else \
+            np.empty((0, len(self.axes)))
+        return points[start - kept[first]:stop - kept[first]]
+
+    def chunks(self, chunk_size):
+        """
+        NAME:
+            chunks
+
+        PURPOSE:
+            generate the points in consecutive chunks
+
+        INPUT:
+            chunk_size - number of points per chunk; the last chunk can be
+            smaller
+
+        OUTPUT:
+            generator of (k, number of axes) arrays
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self[start:start + chunk_size]
+
+    def __iter__(self):
+        for chunk in self.chunks(self.block_size):
+            yield from chunk
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
 
 
 def std_cut(samples, number_of_std_cut):
@@ -356,3 +511,28 @@ def cyl_to_rect(R, vR, vT, z, vz, phi):
         return np.array((x, y, z, vx, vy, vz)).reshape((1,-1))
     else:
         return np.stack((x, y, z, vx, vy, vz), axis=1)
+
+
+def array_hash(*arrays):
+    """
+    NAME:
+        array_hash
+        
+    PURPOSE:
+        compute a hexadecimal digest of the content of one or more arrays, used
+        as a key when caching results that depend on the samples
+        
+    INPUT:
+        arrays - any number of numpy arrays (or objects convertible to arrays);
+        the shape and data type are part of the digest
+        
+    OUTPUT:
+        a string of 40 hexadecimal characters
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.shape).encode())
+        digest.update(array.dtype.str.encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()